@@ -0,0 +1,3 @@
+"""
+Benchmarks of tpsread (run from the repository root, e.g. python -m benchmarks.suite)
+"""
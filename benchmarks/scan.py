@@ -0,0 +1,94 @@
+"""
+Benchmark of TPS table scan, and of repeated scans with the parsed records cache
+
+Usage: python -m benchmarks.scan [filename.tps [tablename [encoding]]]
+"""
+
+import sys
+import tracemalloc
+from timeit import default_timer
+
+from tpsread import TPS
+from tpsread.tpscache import TpsPageCache
+from tpsread.tpsrecord import TpsRecordsList
+
+# Scans of the records cache benchmark
+REPEATED_SCANS = 3
+
+
+def scan(tps):
+    start = default_timer()
+    count = 0
+    for record in tps:
+        count += 1
+    return count, default_timer() - start
+
+
+def pages(tps):
+    """
+    Read, uncompress and split every leaf page to records (page cache is disabled)
+    """
+    cached = tps.cached
+    tps.cached = False
+    leaf_pages = [tps.pages[page_ref] for page_ref in tps.pages.leaf_refs()]
+
+    start = default_timer()
+    for page in leaf_pages:
+        len(TpsRecordsList(tps, page, encoding=tps.encoding))
+    elapsed = default_timer() - start
+
+    # memory allocated while a page is decoded (peak) and kept by its records
+    tracemalloc.start()
+    peak = 0
+    kept = 0
+    for page in leaf_pages:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        records = TpsRecordsList(tps, page, encoding=tps.encoding)
+        len(records)
+        current, page_peak = tracemalloc.get_traced_memory()
+        peak += page_peak - before
+        kept += current - before
+        del records
+    tracemalloc.stop()
+
+    tps.cached = cached
+    return len(leaf_pages), elapsed, peak / len(leaf_pages), kept / len(leaf_pages)
+
+
+def records_cache(filename, tablename, encoding, max_pages):
+    """
+    Elapsed times of repeated scans with a records cache of max_pages pages, and the cache stats
+    """
+    tps = TPS(filename, encoding=encoding, cached=True, current_tablename=tablename,
+              records_cache=TpsPageCache(max_pages=max_pages))
+    times = [scan(tps)[1] for i in range(REPEATED_SCANS)]
+    return times, tps.cache_stats()['records']
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else './testdata/testfile.numeric.tps'
+    tablename = sys.argv[2] if len(sys.argv) > 2 else 'UNNAMED'
+    encoding = sys.argv[3] if len(sys.argv) > 3 else 'cp1251'
+
+    start = default_timer()
+    tps = TPS(filename, encoding=encoding, cached=True, current_tablename=tablename)
+    print('open: {:.3f} s'.format(default_timer() - start))
+
+    count, elapsed, peak, kept = pages(tps)
+    print('pages: {} pages, {:.3f} s, {:.0f} pages/s, {:.0f} bytes allocated (peak), {:.0f} bytes kept per page'
+          .format(count, elapsed, count / elapsed, peak, kept))
+
+    # first pass reads and parses the pages, second pass is served from the page cache (decode only)
+    for label in ('scan', 'scan (cached pages)'):
+        count, elapsed = scan(tps)
+        print('{}: {} rows, {:.3f} s, {:.0f} rows/s'.format(label, count, elapsed, count / elapsed))
+    print('cache: {}'.format(tps.cache_stats()))
+
+    # the records cache helps repeated scans only if it holds all leaf pages of the table
+    leaf_pages = len(tps.leaf_page_refs(tps.current_table_number))
+    for label, max_pages in (('disabled', 0), ('{} pages'.format(leaf_pages // 10), leaf_pages // 10),
+                             ('{} pages'.format(leaf_pages), leaf_pages)):
+        times, stats = records_cache(filename, tablename, encoding, max_pages)
+        print('records cache {}: scans {} s, {} hits, {} misses'.format(
+            label, ', '.join('{:.3f}'.format(elapsed) for elapsed in times), stats['hits'], stats['misses']))
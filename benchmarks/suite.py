@@ -0,0 +1,148 @@
+"""
+Benchmark suite on synthetic TPS files of several sizes
+
+For every size a plain and an encrypted file are generated (benchmarks.synthetic) and measured: open time,
+full scan rows/s, decryption throughput and peak memory of open and scan (tracemalloc, separate pass).
+Results may be saved as JSON and compared with a saved baseline: the suite fails if a measure is worse than
+the baseline by more than the tolerance.
+
+Usage: python -m benchmarks.suite [--rows 10000 100000] [--tables 1] [--field-types LONG STRING ...]
+                                  [--uncompressed] [--blob-size 0] [--seed 0] [--json results.json]
+                                  [--baseline baseline.json [--tolerance 0.2]]
+"""
+
+import argparse
+import json
+import os
+import os.path
+import sys
+import tempfile
+import tracemalloc
+from timeit import default_timer
+
+from tpsread import TPS
+
+from .synthetic import DEFAULT_FIELD_TYPES, FIELD_FORMAT, FIELD_SIZE, generate
+
+
+PASSWORD = 'benchmark'
+
+# measure -> True if greater is better
+MEASURES = {
+    'open_s': False,
+    'scan_rows_per_s': True,
+    'decrypt_mb_per_s': True,
+    'encrypted_scan_rows_per_s': True,
+    'peak_memory_mb': False,
+}
+
+
+def open_and_scan(filename, password=None):
+    start = default_timer()
+    tps = TPS(filename, password=password, current_tablename='TABLE1', encoding='ascii')
+    open_time = default_timer() - start
+    start = default_timer()
+    count = 0
+    for table_name, row in tps.iter_all_tables(memos=False):
+        count += 1
+    return open_time, count, default_timer() - start
+
+
+def peak_memory(filename):
+    tracemalloc.start()
+    open_and_scan(filename)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def decrypt_throughput(filename):
+    tps = TPS(filename, password=PASSWORD, current_tablename='TABLE1', encoding='ascii')
+    start = default_timer()
+    decrypted = tps.decryptor.decrypt_file()
+    elapsed = default_timer() - start
+    decrypted.close()
+    return os.path.getsize(filename) / elapsed
+
+
+def run(rows, tables, directory, **options):
+    """
+    options - generate options (field_types, compressed, blob_size, seed)
+    """
+    filename = os.path.join(directory, 'plain_{}.tps'.format(rows))
+    encrypted_filename = os.path.join(directory, 'encrypted_{}.tps'.format(rows))
+    file_size = generate(filename, rows=rows, tables=tables, **options)
+    generate(encrypted_filename, rows=rows, tables=tables, password=PASSWORD, **options)
+
+    open_time, count, scan_time = open_and_scan(filename)
+    encrypted_open_time, encrypted_count, encrypted_scan_time = open_and_scan(encrypted_filename, PASSWORD)
+    return {'rows': count,
+            'file_size': file_size,
+            'open_s': open_time,
+            'scan_rows_per_s': count / scan_time,
+            'decrypt_mb_per_s': decrypt_throughput(encrypted_filename) / 1e6,
+            'encrypted_scan_rows_per_s': encrypted_count / encrypted_scan_time,
+            'peak_memory_mb': peak_memory(filename) / 1e6}
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Descriptions of the measures worse than the baseline by more than the tolerance (fraction)
+    """
+    found = []
+    for rows, result in results.items():
+        if rows not in baseline:
+            continue
+        for measure, greater_is_better in MEASURES.items():
+            value = result[measure]
+            base_value = baseline[rows][measure]
+            if greater_is_better:
+                worse = value < base_value * (1 - tolerance)
+            else:
+                worse = value > base_value * (1 + tolerance)
+            if worse:
+                found.append('{} rows: {} {:.3f} (baseline {:.3f})'.format(rows, measure, value, base_value))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark suite on synthetic TPS files')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='rows per table')
+    parser.add_argument('--tables', type=int, default=1, help='tables per file')
+    parser.add_argument('--field-types', nargs='+', default=list(DEFAULT_FIELD_TYPES),
+                        choices=sorted(set(FIELD_FORMAT) | set(FIELD_SIZE)), help='field types of the tables')
+    parser.add_argument('--uncompressed', action='store_true', help='do not RLE compress pages')
+    parser.add_argument('--blob-size', type=int, default=0, help='size of the BLOB of every row (0 - no BLOB)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the field values')
+    parser.add_argument('--json', help='save results to JSON file')
+    parser.add_argument('--baseline', help='compare with results saved by --json')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression (fraction)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            result = run(rows, args.tables, directory, field_types=args.field_types,
+                         compressed=not args.uncompressed, blob_size=args.blob_size, seed=args.seed)
+            results[str(rows)] = result
+            print('{rows} rows, {file_size} bytes: open {open_s:.3f} s, scan {scan_rows_per_s:.0f} rows/s, '
+                  'decrypt {decrypt_mb_per_s:.1f} MB/s, encrypted scan {encrypted_scan_rows_per_s:.0f} rows/s, '
+                  'peak memory {peak_memory_mb:.1f} MB'.format(**result))
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            baseline = json.load(json_file)
+        found = regressions(results, baseline, args.tolerance)
+        for regression in found:
+            print('Regression: {}'.format(regression))
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
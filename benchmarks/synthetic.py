@@ -0,0 +1,348 @@
+"""
+Synthetic TPS file generator
+
+Files are built from the structures the reader parses: header (HEADER_STRUCT), pages (PAGE_HEADER) with
+records compressed by shared prefix (split_records) and optionally by RLE (uncompress), table definitions
+(TABLE_DEFINITION_STRUCT) with optional keys and their index records, and optionally encrypted with
+TpsDecryptor.encrypt. Control pages hold the refs of their child pages. Records are sorted by their bytes in
+tree order as in real files.
+
+Usage: python -m benchmarks.synthetic filename.tps [rows [tables]]
+"""
+
+import random
+import struct
+import sys
+from datetime import date, timedelta
+
+from tpsread.tps import HEADER_STRUCT
+from tpsread.tpscrypt import TpsDecryptor
+from tpsread.tpspage import PAGE_HEADER
+from tpsread.tpsrecord import DATA_RECORD_HEADER_STRUCT, DATA_TYPE, INDEX_RECORD_HEADER_STRUCT, \
+    MEMO_RECORD_HEADER_STRUCT, MEMO_TYPE, METADATA_TYPE, RECORD_NUMBER_STRUCT, TABLE_DEFINITION_TYPE, \
+    TABLE_NAME_TYPE, TABLE_NUMBER_STRUCT
+from tpsread.tpstable import TABLE_DEFINITION_STRUCT
+
+
+HEADER_SIZE = 0x200
+
+# Uncompressed data size of a leaf page
+PAGE_DATA_SIZE = 0x1000
+
+# Children of a control page
+PAGE_CHILDREN = 64
+
+# Data size of a MEMO record
+MEMO_CHUNK_SIZE = 0x400
+
+DEFAULT_FIELD_TYPES = ('LONG', 'STRING', 'DATE', 'DECIMAL', 'DOUBLE', 'SHORT', 'CSTRING', 'TIME')
+
+FIELD_FORMAT = {'BYTE': '<B', 'SHORT': '<h', 'USHORT': '<H', 'LONG': '<i', 'ULONG': '<L', 'FLOAT': '<f',
+                'DOUBLE': '<d', 'DATE': '<L', 'TIME': '<L'}
+
+FIELD_SIZE = {'DECIMAL': 5, 'STRING': 20, 'CSTRING': 20, 'PSTRING': 20}
+
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa')
+
+
+def field_size(field_type, field_sizes=None):
+    if field_type in FIELD_FORMAT:
+        return struct.calcsize(FIELD_FORMAT[field_type])
+    return (field_sizes or FIELD_SIZE).get(field_type, FIELD_SIZE[field_type])
+
+
+def field_value(field_type, size, rnd):
+    """
+    Random field value as stored in the record
+    """
+    if field_type == 'BYTE':
+        return struct.pack('<B', rnd.randrange(0x100))
+    elif field_type in ('SHORT', 'USHORT', 'LONG', 'ULONG'):
+        bits = size * 8
+        if field_type in ('SHORT', 'LONG'):
+            value = rnd.randrange(-(1 << (bits - 1)), 1 << (bits - 1))
+        else:
+            value = rnd.randrange(1 << bits)
+        return struct.pack(FIELD_FORMAT[field_type], value)
+    elif field_type in ('FLOAT', 'DOUBLE'):
+        return struct.pack(FIELD_FORMAT[field_type], rnd.uniform(-1e6, 1e6))
+    elif field_type == 'DATE':
+        value = date(2000, 1, 1) + timedelta(days=rnd.randrange(10000))
+        return struct.pack('<L', (value.year << 16) | (value.month << 8) | value.day)
+    elif field_type == 'TIME':
+        return struct.pack('<L', (rnd.randrange(24) << 24) | (rnd.randrange(60) << 16) | (rnd.randrange(60) << 8) |
+                           rnd.randrange(100))
+    elif field_type == 'DECIMAL':
+        # the first nibble is the sign (F - negative)
+        digits = '{:0{}d}'.format(rnd.randrange(10 ** (size * 2 - 1)), size * 2)
+        if rnd.randrange(2):
+            digits = 'f' + digits[1:]
+        return bytes.fromhex(digits)
+    elif field_type == 'STRING':
+        return rnd.choice(WORDS).encode('ascii').ljust(size, b' ')[:size]
+    elif field_type == 'CSTRING':
+        return rnd.choice(WORDS).encode('ascii').ljust(size, b'\x00')[:size]
+    elif field_type == 'PSTRING':
+        word = rnd.choice(WORDS).encode('ascii')[:size - 1]
+        return (bytes((len(word),)) + word).ljust(size, b'\x00')
+    raise ValueError('Unsupported field type {}'.format(field_type))
+
+
+def key_bytes(field_type, data, descending=False, nocase=False):
+    """
+    Key bytes of the stored field value: numbers big-endian with the sign bit flipped (floats inverted if
+    negative), strings as stored (upper case if nocase), DECIMAL as stored, inverted if descending
+    """
+    if field_type in FIELD_FORMAT:
+        data = bytearray(reversed(data))
+        if field_type in ('SHORT', 'LONG'):
+            data[0] ^= 0x80
+        elif field_type in ('FLOAT', 'DOUBLE'):
+            if data[0] & 0x80:
+                data = bytearray(byte ^ 0xFF for byte in data)
+            else:
+                data[0] ^= 0x80
+    elif nocase:
+        data = data.upper()
+    if descending:
+        data = bytes(byte ^ 0xFF for byte in data)
+    return bytes(data)
+
+
+def table_definition(prefix, field_types, blob=False, field_sizes=None, keys=()):
+    """
+    Table definition (TABLE_DEFINITION_STRUCT) bytes and the fields (type, offset, size)
+    """
+    fields = []
+    offset = 0
+    definition_fields = []
+    for number, field_type in enumerate(field_types):
+        size = field_size(field_type, field_sizes)
+        fields.append((field_type, offset, size))
+        is_string = field_type in ('STRING', 'CSTRING', 'PSTRING')
+        definition_fields.append(dict(type=field_type, offset=offset,
+                                      name='{}:F{}_{}'.format(prefix, number, field_type),
+                                      array_element_count=1, size=size, overlaps=0, number=number,
+                                      array_element_size=size if is_string else None,
+                                      template=0 if is_string else None,
+                                      decimal_count=2 if field_type == 'DECIMAL' else None,
+                                      decimal_size=size * 2 - 1 if field_type == 'DECIMAL' else None))
+        offset += size
+    memos = []
+    if blob:
+        memos.append(dict(external_filename='', index_mark=1, name='{}:BLOB'.format(prefix), size=0,
+                          flags=dict(memo_type='BLOB', BINARY=True, Flag=False)))
+    indexes = []
+    for key in keys:
+        name, key_fields, nocase = key[:3]
+        indexes.append(dict(external_filename='', index_mark=1, name='{}:{}'.format(prefix, name),
+                            flags=dict(type=key_type(key), NOCASE=nocase, OPT=False, DUP=True),
+                            field_count=len(key_fields),
+                            index_field_propertly=[dict(field_number=number,
+                                                        field_order_type='DESCENDING' if descending else 'ASCENDING')
+                                                   for number, descending in key_fields]))
+    definition = TABLE_DEFINITION_STRUCT.build(dict(min_version_driver=2, record_size=offset,
+                                                    field_count=len(definition_fields), memo_count=len(memos),
+                                                    index_count=len(indexes),
+                                                    record_table_definition_field=definition_fields,
+                                                    record_table_definition_memo=memos,
+                                                    record_table_definition_index=indexes))
+    return definition, fields
+
+
+def key_type(key):
+    return key[3] if len(key) > 3 else 'KEY'
+
+
+def table_records(table_number, name, rows, field_types, blob_size, rnd, field_sizes=None, keys=()):
+    """
+    (record header size, record bytes) of a table in key order, and the last record number
+    """
+    definition, fields = table_definition(name[:3].upper(), field_types, blob=blob_size > 0,
+                                          field_sizes=field_sizes, keys=keys)
+    data_records = []
+    index_records = []
+    # record numbers do not depend on the number of rows (files differ by the added rows only)
+    first_record_number = (table_number << 24) + 1
+    for record_number in range(first_record_number, first_record_number + rows):
+        values = [field_value(field_type, size, rnd) for field_type, offset, size in fields]
+        data_records.append((DATA_RECORD_HEADER_STRUCT.size,
+                             DATA_RECORD_HEADER_STRUCT.pack(table_number, DATA_TYPE, record_number) +
+                             b''.join(values)))
+        for index_number, key in enumerate(keys):
+            if key_type(key) != 'KEY':
+                # INDEX and DYNAMIC_INDEX records are built by the application on demand
+                continue
+            key_name, key_fields, nocase = key[:3]
+            record = INDEX_RECORD_HEADER_STRUCT.pack(table_number, index_number) + \
+                b''.join(key_bytes(fields[number][0], values[number], descending, nocase)
+                         for number, descending in key_fields) + RECORD_NUMBER_STRUCT.pack(record_number)
+            index_records.append((len(record), record))
+    # index numbers are below DATA_TYPE
+    records = sorted(index_records, key=lambda record: record[1]) + data_records
+    records.append((5, TABLE_NUMBER_STRUCT.pack(table_number) + bytes((METADATA_TYPE, DATA_TYPE)) +
+                    struct.pack('<LL', rows, first_record_number + rows - 1)))
+    records.append((5, TABLE_NUMBER_STRUCT.pack(table_number) + bytes((TABLE_DEFINITION_TYPE,)) +
+                    struct.pack('<H', 0) + definition))
+    if blob_size > 0:
+        for record_number in range(first_record_number, first_record_number + rows):
+            blob = struct.pack('<L', blob_size) + bytes(rnd.randrange(0x100) for i in range(16)) * \
+                (blob_size // 16 + 1)
+            blob = blob[:blob_size + 4]
+            for sequence_number, pos in enumerate(range(0, len(blob), MEMO_CHUNK_SIZE)):
+                records.append((MEMO_RECORD_HEADER_STRUCT.size,
+                                MEMO_RECORD_HEADER_STRUCT.pack(table_number, MEMO_TYPE, record_number, 0,
+                                                               sequence_number) +
+                                blob[pos:pos + MEMO_CHUNK_SIZE]))
+    return records, first_record_number + rows - 1
+
+
+def pack_records(records):
+    """
+    Page data: every record shares the first bytes with the previous one (see tpsrecord.split_records)
+    """
+    data = bytearray()
+    previous = b''
+    previous_size = None
+    previous_header_size = None
+    for header_size, record in records:
+        shared = 0
+        limit = min(len(previous), len(record), 0x3F)
+        while shared < limit and previous[shared] == record[shared]:
+            shared += 1
+        byte_counter = shared
+        if len(record) != previous_size:
+            byte_counter |= 0x80
+        if header_size != previous_header_size:
+            byte_counter |= 0x40
+        data.append(byte_counter)
+        if byte_counter & 0x80:
+            data += struct.pack('<H', len(record))
+        if byte_counter & 0x40:
+            data += struct.pack('<H', header_size)
+        data += record[shared:]
+        previous = record
+        previous_size = len(record)
+        previous_header_size = header_size
+    return bytes(data)
+
+
+def rle_count(value):
+    if value > 0x7F:
+        return bytes(((value & 0x7F) | 0x80, value >> 7))
+    return bytes((value,))
+
+
+def compress(data):
+    """
+    RLE compression (inverse of tpsrecord.uncompress): literal bytes, then repeat count of the last byte
+    """
+    result = bytearray()
+    pos = 0
+    while pos < len(data):
+        # literal bytes up to the first byte of a run of 4 or more equal bytes
+        limit = min(len(data), pos + 0x7FFF)
+        end = pos
+        while end < limit and data[end:end + 4] != data[end:end + 1] * 4:
+            end += 1
+        if end < limit:
+            end += 1
+        result += rle_count(end - pos)
+        result += data[pos:end]
+        pos = end
+        if pos < len(data):
+            repeat_count = 0
+            while pos + repeat_count < len(data) and data[pos + repeat_count] == data[pos - 1] and \
+                    repeat_count < 0x7FFF:
+                repeat_count += 1
+            result += rle_count(repeat_count)
+            pos += repeat_count
+    return bytes(result)
+
+
+def page_bytes(offset, data, hierarchy_level, record_count, compressed):
+    uncompressed_size = PAGE_HEADER.size + len(data)
+    if compressed:
+        stored = compress(data)
+        if len(stored) >= len(data):
+            stored = data
+    else:
+        stored = data
+    size = PAGE_HEADER.size + len(stored)
+    page = PAGE_HEADER.pack(offset, size, uncompressed_size if stored is not data else size,
+                            uncompressed_size, record_count, hierarchy_level) + stored
+    # pages start at 0x100 boundaries
+    return page + b'\x00' * (-len(page) % 0x100)
+
+
+def generate(filename, rows=10000, tables=1, field_types=DEFAULT_FIELD_TYPES, compressed=True, password=None,
+             blob_size=0, seed=0, field_sizes=None, keys=()):
+    """
+    Write synthetic TPS file: tables named TABLE1, TABLE2... with rows rows each, fields of field_types,
+    a BLOB field of blob_size bytes if blob_size > 0. field_sizes - sizes of DECIMAL and string fields by
+    type (FIELD_SIZE by default). keys - keys of every table with their index records: (name, key fields,
+    nocase[, type]), key fields - (field number, descending), type - 'KEY' (default), 'INDEX' or
+    'DYNAMIC_INDEX' (no index records). Return the file size.
+    """
+    rnd = random.Random(seed)
+    records = []
+    last_record_number = 0
+    for table_number in range(1, tables + 1):
+        table_name = 'TABLE{}'.format(table_number)
+        table_records_list, last_record_number = table_records(table_number, table_name, rows, field_types,
+                                                               blob_size, rnd, field_sizes, keys)
+        records.extend(table_records_list)
+    names = []
+    for table_number in range(1, tables + 1):
+        names.append((5, bytes((TABLE_NAME_TYPE,)) + 'TABLE{}'.format(table_number).encode('ascii') +
+                      TABLE_NUMBER_STRUCT.pack(table_number)))
+    records.extend(sorted(names, key=lambda record: record[1]))
+
+    # leaf pages of about PAGE_DATA_SIZE bytes of records
+    leaves = [[]]
+    page_size = 0
+    for header_size, record in records:
+        if leaves[-1] and page_size + len(record) > PAGE_DATA_SIZE:
+            leaves.append([])
+            page_size = 0
+        leaves[-1].append((header_size, record))
+        page_size += len(record)
+
+    body = bytearray()
+    level_refs = []
+    for leaf_records in leaves:
+        level_refs.append(len(body) // 0x100)
+        body += page_bytes(HEADER_SIZE + len(body), pack_records(leaf_records), 0, len(leaf_records), compressed)
+
+    hierarchy_level = 0
+    while len(level_refs) > 1 or hierarchy_level == 0:
+        hierarchy_level += 1
+        parent_refs = []
+        for i in range(0, len(level_refs), PAGE_CHILDREN):
+            children = level_refs[i:i + PAGE_CHILDREN]
+            parent_refs.append(len(body) // 0x100)
+            body += page_bytes(HEADER_SIZE + len(body), struct.pack('<{}L'.format(len(children)), *children),
+                               hierarchy_level, len(children), False)
+        level_refs = parent_refs
+
+    file_size = HEADER_SIZE + len(body)
+    blocks = (HEADER_SIZE - 0x20) // 8
+    header = HEADER_STRUCT.build(dict(offset=0, size=HEADER_SIZE, file_size=file_size,
+                                      allocated_file_size=file_size, top_speed_mark=b'tOpS\x00\x00',
+                                      last_issued_row=last_record_number, change_count=1,
+                                      page_root_ref=level_refs[0],
+                                      block_start_ref=[0] * blocks,
+                                      block_end_ref=[len(body) // 0x100] + [0] * (blocks - 1)))
+    data = header + bytes(body)
+    if password is not None:
+        data = TpsDecryptor(None, password).encrypt(data)
+    with open(filename, 'wb') as tps_file:
+        tps_file.write(data)
+    return file_size
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    print(generate(sys.argv[1], rows=int(sys.argv[2]) if len(sys.argv) > 2 else 10000,
+                   tables=int(sys.argv[3]) if len(sys.argv) > 3 else 1))
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os.path
+
+import pytest
+
+from benchmarks.synthetic import generate
+from tpsread import TPS
+
+
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata')
+
+NUMERIC_FILENAME = os.path.join(TESTDATA, 'testfile.numeric.tps')
+
+# Rows of the numeric file read by the original reader (before the table scan was rewritten): row count and
+# sha256 of the rows_digest export
+NUMERIC_ROW_COUNT = 98640
+NUMERIC_ROWS_SHA256 = '47d520cd86d3bac28a379d745af126f5ad2098fd2f87a76d6081036f12c685e1'
+
+NODATA_FILENAME = os.path.join(TESTDATA, 'simple.nodata.tps')
+
+PASSWORD = 'secret'
+
+FIELD_TYPES = ('LONG', 'STRING', 'DATE', 'DECIMAL', 'DOUBLE', 'SHORT', 'CSTRING', 'TIME', 'BYTE', 'USHORT',
+               'ULONG', 'FLOAT', 'PSTRING')
+
+
+def open_numeric(**kwargs):
+    return TPS(NUMERIC_FILENAME, encoding='cp1251', current_tablename='UNNAMED', **kwargs)
+
+
+def open_synthetic(filename, **kwargs):
+    return TPS(filename, encoding='ascii', current_tablename='TABLE1', **kwargs)
+
+
+def rows_digest(rows):
+    """
+    sha256 of the rows exported as JSON lines of (name, value) pairs in field order
+    """
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(json.dumps(list(row.items())).encode('ascii') + b'\n')
+    return digest.hexdigest()
+
+
+def plain_rows(rows):
+    """
+    Rows with MEMO and BLOB handles read
+    """
+    return [dict((name, value.read() if hasattr(value, 'read') else value) for name, value in row.items())
+            for row in rows]
+
+
+@pytest.fixture(scope='session')
+def numeric():
+    return open_numeric()
+
+
+@pytest.fixture(scope='session')
+def numeric_rows():
+    # row dicts of the table scan, checked against the pinned rows (test_tps.test_expected_rows)
+    return list(open_numeric())
+
+
+@pytest.fixture(scope='session')
+def synthetic_filename(tmp_path_factory):
+    """
+    Two tables of all field types with BLOBs
+    """
+    filename = str(tmp_path_factory.mktemp('synthetic') / 'synthetic.tps')
+    generate(filename, rows=1500, tables=2, field_types=FIELD_TYPES, blob_size=300)
+    return filename
+
+
+@pytest.fixture(scope='session')
+def synthetic_rows(synthetic_filename):
+    tps = open_synthetic(synthetic_filename)
+    return dict((table_number, plain_rows(tps.iter_pages(None, table_number))) for table_number in (1, 2))
+
+
+@pytest.fixture(scope='session')
+def encrypted_filename(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp('encrypted') / 'encrypted.tps')
+    generate(filename, rows=1500, tables=2, field_types=FIELD_TYPES, blob_size=300, password=PASSWORD)
+    return filename
@@ -0,0 +1,86 @@
+"""
+AsyncTPS with thread and process executors compared with the baseline rows
+"""
+
+import asyncio
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from tpsread import AsyncTPS
+from tpsread.tpsasync import WORKER_FILES, read_pages, worker_files
+from tpsread.tpsdecoder import RECNO_FIELDNAME
+
+from .conftest import PASSWORD, open_synthetic
+
+
+async def read_table(filename, executor, name, **kwargs):
+    async with await AsyncTPS.open(filename, executor=executor, prefetch=2, chunk_size=4, encoding='ascii',
+                                   current_tablename='TABLE1', **kwargs) as async_tps:
+        table = async_tps.table(name)
+        rows = []
+        async for row in table:
+            row['TAB:BLOB'] = await async_tps.read_memo(row['TAB:BLOB'])
+            rows.append(row)
+        record_number = rows[7][RECNO_FIELDNAME]
+        row = await table.get(record_number)
+        row['TAB:BLOB'] = await async_tps.read_memo(row['TAB:BLOB'])
+        assert row == rows[7]
+    assert async_tps.tps.tps_file.closed
+    return rows
+
+
+@pytest.mark.parametrize('executor_class', [None, ThreadPoolExecutor, ProcessPoolExecutor])
+def test_rows(synthetic_filename, synthetic_rows, executor_class):
+    executor = executor_class(max_workers=2) if executor_class is not None else None
+    try:
+        assert asyncio.run(read_table(synthetic_filename, executor, 'TABLE2')) == synthetic_rows[2]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def test_encrypted(encrypted_filename, synthetic_rows):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        assert asyncio.run(read_table(encrypted_filename, executor, None, password=PASSWORD)) == synthetic_rows[1]
+
+
+def test_concurrent_files(synthetic_filename, encrypted_filename, synthetic_rows):
+    async def read_files():
+        return await asyncio.gather(read_table(synthetic_filename, None, 'TABLE1'),
+                                    read_table(encrypted_filename, None, 'TABLE2', password=PASSWORD))
+
+    assert asyncio.run(read_files()) == [synthetic_rows[1], synthetic_rows[2]]
+
+
+def test_early_exit(synthetic_filename):
+    async def first_rows():
+        async with await AsyncTPS.open(synthetic_filename, prefetch=1, chunk_size=1, encoding='ascii',
+                                       current_tablename='TABLE1') as async_tps:
+            async for rows in async_tps.batches(memos=False):
+                return rows
+
+    rows = asyncio.run(first_rows())
+    assert rows and 'TAB:BLOB' not in rows[0]
+
+
+def test_worker_files(synthetic_filename, synthetic_rows):
+    # files of a worker process are closed when they are evicted
+    tps = open_synthetic(synthetic_filename)
+    state = pickle.dumps(tps)
+    page_refs = tps.leaf_page_refs(1)[:1]
+    opened = []
+    try:
+        for i in range(WORKER_FILES + 1):
+            rows = read_pages('key{}'.format(i), state, page_refs, 1)
+            assert rows == [dict((name, value) for name, value in row.items() if name != 'TAB:BLOB')
+                            for row in synthetic_rows[1][:len(rows)]]
+            opened.append(worker_files.get('key{}'.format(i)))
+        assert read_pages('key0', None, page_refs, 1) is None
+        assert opened[0].tps_file.closed
+        assert not any(worker_tps.tps_file.closed for worker_tps in opened[1:])
+    finally:
+        for worker_tps in opened:
+            worker_tps.close()
+        worker_files.clear()
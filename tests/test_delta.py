@@ -0,0 +1,79 @@
+"""
+Snapshots, changes and follow of a file rewritten with added rows
+"""
+
+import os
+import threading
+
+import pytest
+
+from benchmarks.synthetic import generate
+from tpsread.tpsdecoder import RECNO_FIELDNAME
+
+from .conftest import FIELD_TYPES, open_synthetic, plain_rows
+
+
+def write(filename, rows):
+    # the reader maps the file: the new file replaces it as a whole
+    generate(filename + '.new', rows=rows, tables=2, field_types=FIELD_TYPES)
+    os.replace(filename + '.new', filename)
+
+
+def test_changes(tmp_path):
+    filename = str(tmp_path / 'delta.tps')
+    write(filename, 1000)
+    tps = open_synthetic(filename)
+    previous = tps.snapshot()
+    assert not tps.changes(previous)
+
+    write(filename, 1200)
+    assert tps.refresh()
+    changes = tps.changes(previous)
+    first = (1 << 24) + 1
+    assert changes.inserted == {1: list(range(first + 1000, first + 1200)),
+                                2: list(range((2 << 24) + 1001, (2 << 24) + 1201))}
+    # values of the second table are drawn after the rows of the first one
+    assert changes.updated == {2: list(range((2 << 24) + 1, (2 << 24) + 1001))}
+    assert changes.deleted == {}
+    assert not tps.changes(changes.snapshot)
+
+    expected = plain_rows(open_synthetic(filename).iter_pages(None))[1000:]
+    assert [(kind, record_number, row) for kind, record_number, row in tps.iter_changes(previous)] == \
+        [('inserted', row[RECNO_FIELDNAME], row) for row in expected]
+
+
+def test_refresh(tmp_path):
+    filename = str(tmp_path / 'refresh.tps')
+    write(filename, 1000)
+    tps = open_synthetic(filename)
+    for table_number in (1, 2):
+        plain_rows(tps.iter_pages(None, table_number))
+    pages = tps.cache_stats()['pages']
+
+    write(filename, 1200)
+    assert tps.refresh()
+    fresh = open_synthetic(filename)
+    for table_number in (1, 2):
+        assert plain_rows(tps.iter_pages(None, table_number)) == plain_rows(fresh.iter_pages(None, table_number))
+    # unchanged pages of the first table are read from the cache, changed pages of the second one are not
+    stats = tps.cache_stats()['pages']
+    assert stats['hits'] > pages['hits']
+    assert stats['misses'] - pages['misses'] < fresh.cache_stats()['pages']['misses']
+    assert not tps.refresh()
+
+
+@pytest.mark.parametrize('table_number', [1, 2])
+def test_follow(tmp_path, table_number):
+    filename = str(tmp_path / 'follow.tps')
+    write(filename, 500)
+    tps = open_synthetic(filename)
+    writer = threading.Timer(0.2, write, (filename, 700))
+    writer.start()
+    try:
+        followed = list(tps.follow(interval=0.05, table_number=table_number, timeout=2))
+    finally:
+        writer.join()
+    assert followed == list(open_synthetic(filename).iter_pages(None, table_number))[500:]
+
+    tps = open_synthetic(filename)
+    assert len(list(tps.follow(interval=0.05, from_start=True, timeout=0.2))) == 700
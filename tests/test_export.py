@@ -0,0 +1,208 @@
+"""
+Column-wise (numpy, pandas, Arrow) and bulk (SQLite, CLI) exports compared with the baseline rows
+"""
+
+import json
+import os.path
+import shutil
+import sqlite3
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import pytest
+
+from tpsread.__main__ import STATE_FILENAME, file_signature, main
+from tpsread.tpsdecoder import RECNO_FIELDNAME
+from tpsread.tpsexport import plain_value
+
+from benchmarks.synthetic import generate
+
+from .conftest import PASSWORD, open_numeric, open_synthetic, plain_rows
+
+
+def normalized(value):
+    # exported value as the row dict value
+    if hasattr(value, 'item') and not isinstance(value, (datetime, timedelta)):
+        value = value.item()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, timedelta):
+        return (datetime.min + value).time()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def assert_rows(rows, expected):
+    assert len(rows) == len(expected)
+    for row, expected_row in zip(rows, expected):
+        assert list(row) == list(expected_row)
+        # DECIMAL values are exact in Arrow, floats in the rows
+        assert dict((name, normalized(value)) for name, value in row.items()) == \
+            dict((name, pytest.approx(value) if isinstance(value, float) else value)
+                 for name, value in expected_row.items())
+
+
+def test_numpy(numeric, numeric_rows):
+    pytest.importorskip('numpy')
+    values = numeric.to_numpy()
+    assert list(values.dtype.names) == list(numeric_rows[0])
+    assert_rows([dict(zip(values.dtype.names, row)) for row in values.tolist()], numeric_rows)
+    columns = numeric.to_numpy(columns=['TST:LONG'])
+    assert columns.dtype.names == (RECNO_FIELDNAME, 'TST:LONG')
+
+
+def test_numpy_columns(numeric, numeric_rows):
+    pytest.importorskip('numpy')
+    values = numeric.to_numpy(columns=['decimal', 'TST:BYTE'])
+    assert values.dtype.names == (RECNO_FIELDNAME, 'TST:DECIMAL', 'TST:BYTE')
+    assert values['TST:DECIMAL'].tolist()[:1000] == [row['TST:DECIMAL'] for row in numeric_rows[:1000]]
+    with pytest.raises(KeyError):
+        numeric.to_numpy(columns=['TST:LONG', 'TST:MISSING'])
+
+
+def test_wide_decimal(tmp_path):
+    # 31 digits: int64 would overflow
+    pytest.importorskip('pyarrow')
+    filename = str(tmp_path / 'decimal.tps')
+    generate(filename, rows=500, field_types=('DECIMAL', 'LONG', 'DECIMAL'), field_sizes={'DECIMAL': 16})
+    tps = open_synthetic(filename)
+    rows = plain_rows(tps.iter_pages(None))
+    assert any(row['TAB:F0_DECIMAL'] < 0 for row in rows) and any(row['TAB:F0_DECIMAL'] > 0 for row in rows)
+    assert_rows([dict(zip(tps.to_numpy().dtype.names, row)) for row in tps.to_numpy().tolist()], rows)
+    assert_rows(tps.to_pandas().to_dict('records'), rows)
+    batch = next(tps.iter_record_batches())
+    assert batch.schema.field('TAB:F0_DECIMAL').type.precision == 31
+    assert_rows(batch.to_pylist(), rows)
+
+
+def test_pandas(numeric, numeric_rows, synthetic_filename, synthetic_rows):
+    pytest.importorskip('pandas')
+    dataframe = numeric.to_pandas()
+    assert_rows(dataframe.to_dict('records'), numeric_rows)
+    chunks = list(numeric.to_pandas(chunksize=40000))
+    assert [len(chunk) for chunk in chunks] == [40000, 40000, len(numeric_rows) - 80000]
+
+    tps = open_synthetic(synthetic_filename)
+    dataframe = tps.to_pandas(table_number=2, categorical=True)
+    assert str(dataframe['TAB:F1_STRING'].dtype) == 'category'
+    expected = [dict((name, value) for name, value in row.items() if name != 'TAB:BLOB')
+                for row in synthetic_rows[2]]
+    assert_rows(dataframe.to_dict('records'), expected)
+
+    dataframe = tps.to_pandas(columns=['f6_cstring', 'TAB:F0_LONG'], categorical=['f6_cstring'])
+    assert list(dataframe.columns) == [RECNO_FIELDNAME, 'TAB:F6_CSTRING', 'TAB:F0_LONG']
+    assert str(dataframe['TAB:F6_CSTRING'].dtype) == 'category'
+    assert dataframe['TAB:F0_LONG'].tolist() == [row['TAB:F0_LONG'] for row in synthetic_rows[1]]
+    with pytest.raises(KeyError):
+        tps.to_pandas(columns=['TAB:F0_LONG', 'f99_long'])
+    with pytest.raises(KeyError):
+        tps.to_pandas(categorical=['TAB:MISSING'])
+    with pytest.raises(ValueError):
+        tps.to_pandas(columns=['TAB:F0_LONG'], categorical=['TAB:F1_STRING'])
+
+
+def test_arrow(synthetic_filename, synthetic_rows, tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+
+    tps = open_synthetic(synthetic_filename)
+    batches = list(tps.iter_record_batches(table_number=2, batch_size=1000))
+    assert [batch.num_rows for batch in batches] == [1000, 500]
+    assert_rows([row for batch in batches for row in batch.to_pylist()], synthetic_rows[2])
+
+    filename = str(tmp_path / 'table.parquet')
+    assert tps.to_parquet(filename, columns=['TAB:F3_DECIMAL', 'TAB:BLOB'], batch_size=700) == 1500
+    table = pq.read_table(filename)
+    assert table.num_rows == 1500
+    names = (RECNO_FIELDNAME, 'TAB:F3_DECIMAL', 'TAB:BLOB')
+    assert_rows(table.to_pylist(), [dict((name, row[name]) for name in names) for row in synthetic_rows[1]])
+
+
+def sqlite_rows(connection, table_name):
+    cursor = connection.execute('SELECT * FROM "{}" ORDER BY 1'.format(table_name))
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor]
+
+
+def test_sqlite(synthetic_filename, synthetic_rows, numeric_rows):
+    tps = open_synthetic(synthetic_filename)
+    connection = sqlite3.connect(':memory:')
+    assert tps.to_sqlite(connection, batch_size=100, transaction_rows=1000) == {'TABLE1': 1500, 'TABLE2': 1500}
+    for table_number in (1, 2):
+        expected = [dict((name, value.isoformat() if isinstance(value, (date, time)) else value)
+                         for name, value in row.items()) for row in synthetic_rows[table_number]]
+        assert sqlite_rows(connection, 'TABLE{}'.format(table_number)) == expected
+
+    connection = sqlite3.connect(':memory:')
+    assert open_numeric().to_sqlite(connection) == {'UNNAMED': len(numeric_rows)}
+    assert_rows(sqlite_rows(connection, 'UNNAMED'), numeric_rows)
+
+
+def test_sqlite_connection(synthetic_filename, tmp_path, monkeypatch):
+    # the pragmas of the load are restored on the caller's connection
+    connection = sqlite3.connect(str(tmp_path / 'mirror.sqlite'))
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = FULL')
+    pragmas = [connection.execute('PRAGMA {}'.format(name)).fetchone()
+               for name in ('synchronous', 'journal_mode', 'temp_store', 'cache_size')]
+    tps = open_synthetic(synthetic_filename)
+    assert tps.to_sqlite(connection, table_numbers=[2], indexes=False) == {'TABLE2': 1500}
+    assert [connection.execute('PRAGMA {}'.format(name)).fetchone()
+            for name in ('synchronous', 'journal_mode', 'temp_store', 'cache_size')] == pragmas
+    assert len(sqlite_rows(connection, 'TABLE2')) == 1500
+
+    # tables of the same name are not merged
+    monkeypatch.setattr(tps.tables, 'get_name', lambda number: 'Table' if number == 1 else 'TABLE')
+    with pytest.raises(ValueError):
+        tps.to_sqlite(connection)
+    with pytest.raises(ValueError):
+        tps.to_sqlite(connection, table_numbers=[2])
+    assert len(sqlite_rows(connection, 'TABLE2')) == 1500
+    connection.close()
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'jsonl', 'sqlite', 'parquet'])
+def test_cli(synthetic_filename, synthetic_rows, tmp_path, capsys, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    source = tmp_path / 'source'
+    os.makedirs(str(source / 'sub'))
+    shutil.copy(synthetic_filename, str(source / 'sub' / 'file.tps'))
+    output = str(tmp_path / 'output')
+    assert main([str(source), output, '--format', output_format, '--workers', '1', '--encoding', 'ascii',
+                 '--batch-size', '500']) == 0
+    assert '1 files converted' in capsys.readouterr().out
+    assert os.path.isfile(os.path.join(output, STATE_FILENAME))
+
+    expected = [dict((name, plain_value(value)) for name, value in row.items()) for row in synthetic_rows[2]]
+    if output_format == 'jsonl':
+        with open(os.path.join(output, 'sub', 'file', 'TABLE2.jsonl')) as jsonl_file:
+            assert [json.loads(line) for line in jsonl_file] == expected
+    elif output_format == 'csv':
+        with open(os.path.join(output, 'sub', 'file', 'TABLE2.csv')) as csv_file:
+            assert len(csv_file.readlines()) == 1501
+    elif output_format == 'sqlite':
+        connection = sqlite3.connect(os.path.join(output, 'sub', 'file.sqlite'))
+        assert len(sqlite_rows(connection, 'TABLE2')) == 1500
+        connection.close()
+    else:
+        import pyarrow.parquet as pq
+        assert pq.read_table(os.path.join(output, 'sub', 'file', 'TABLE2.parquet')).num_rows == 1500
+
+    # unchanged files are skipped
+    assert main([str(source), output, '--format', output_format, '--workers', '1', '--encoding', 'ascii']) == 0
+    assert '1 unchanged files skipped' in capsys.readouterr().out
+
+
+def test_file_signature(synthetic_filename, encrypted_filename, tmp_path, caplog):
+    assert file_signature(synthetic_filename)['change_count'] == 1
+    assert file_signature(encrypted_filename, PASSWORD)['change_count'] == 1
+    empty_filename = str(tmp_path / 'empty.tps')
+    open(empty_filename, 'wb').close()
+    for filename, password in ((encrypted_filename, 'wrong'), (empty_filename, None)):
+        caplog.clear()
+        assert file_signature(filename, password)['change_count'] is None
+        assert filename in caplog.text
+    with pytest.raises(OSError):
+        file_signature(str(tmp_path / 'missing.tps'))
@@ -0,0 +1,127 @@
+"""
+Keys (tpskey): index lookups compared with a linear filter of the rows
+"""
+
+from datetime import date
+
+import pytest
+
+from benchmarks.synthetic import generate
+from tpsread.tpsdecoder import RECNO_FIELDNAME
+from tpsread.tpsrecord import INDEX_RECORD_HEADER_STRUCT, RECORD_NUMBER_STRUCT
+
+from .conftest import open_synthetic
+
+
+FIELD_TYPES = ('LONG', 'STRING', 'SHORT', 'DOUBLE', 'DATE', 'ULONG')
+
+# (name, (field number, descending), nocase)
+KEYS = (('KEYLONG', ((0, False),), False),
+        ('KEYSHORT', ((2, True),), False),
+        ('KEYNAME', ((1, False), (0, True)), True),
+        ('KEYDOUBLE', ((3, False),), False),
+        ('KEYDATE', ((4, False), (5, False)), False),
+        ('INDEXLONG', ((0, False),), False, 'INDEX'))
+
+TABLE_NUMBER = 2
+
+
+@pytest.fixture(scope='module')
+def keyed(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp('keys') / 'keys.tps')
+    generate(filename, rows=3000, tables=2, field_types=FIELD_TYPES, keys=KEYS)
+    tps = open_synthetic(filename)
+    tps.set_current_table('TABLE2')
+    return tps
+
+
+@pytest.fixture(scope='module')
+def rows(keyed):
+    return list(keyed.iter_pages(None))
+
+
+def ordered(rows, key):
+    return sorted(rows, key=lambda row: (key(row), row[RECNO_FIELDNAME]))
+
+
+def test_index_pages(keyed, rows):
+    # every index spans several leaf pages
+    for number in range(len(KEYS) - 1):
+        assert len(keyed.leaf_page_refs(TABLE_NUMBER, (number,))) > 1
+    assert len(list(keyed.iter_index('KEYLONG'))) == len(rows) == 3000
+    assert keyed.verify() == []
+
+
+def test_signed(keyed, rows):
+    assert list(keyed.iter_index('KEYLONG')) == \
+        [([row['TAB:F0_LONG']], row[RECNO_FIELDNAME]) for row in ordered(rows, lambda row: row['TAB:F0_LONG'])]
+    low, high = -10 ** 9, 5 * 10 ** 8
+    assert list(keyed.lookup_range('KEYLONG', low, high)) == \
+        ordered([row for row in rows if low <= row['TAB:F0_LONG'] <= high], lambda row: row['TAB:F0_LONG'])
+    assert list(keyed.lookup_range('KEYLONG', high=-10 ** 9)) == \
+        ordered([row for row in rows if row['TAB:F0_LONG'] <= -10 ** 9], lambda row: row['TAB:F0_LONG'])
+    for row in rows[::300]:
+        assert keyed.lookup('KEYLONG', row['TAB:F0_LONG']) == \
+            [other for other in rows if other['TAB:F0_LONG'] == row['TAB:F0_LONG']]
+
+
+def test_descending(keyed, rows):
+    # descending keys: low <= high, rows in key order
+    assert list(keyed.lookup_range('keyshort', -1000, 1000)) == \
+        ordered([row for row in rows if -1000 <= row['TAB:F2_SHORT'] <= 1000], lambda row: -row['TAB:F2_SHORT'])
+    assert list(keyed.lookup_range('keyshort', 1000, -1000)) == []
+    assert list(keyed.lookup_range('KEYSHORT', high=-30000)) == \
+        ordered([row for row in rows if row['TAB:F2_SHORT'] <= -30000], lambda row: -row['TAB:F2_SHORT'])
+    assert list(keyed.lookup_range('KEYSHORT', low=30000)) == \
+        ordered([row for row in rows if row['TAB:F2_SHORT'] >= 30000], lambda row: -row['TAB:F2_SHORT'])
+    for row in rows[::250]:
+        assert keyed.lookup('KEYSHORT', row['TAB:F2_SHORT']) == \
+            [other for other in rows if other['TAB:F2_SHORT'] == row['TAB:F2_SHORT']]
+
+
+def test_string(keyed, rows):
+    def name_order(row):
+        return row['TAB:F1_STRING'].upper(), -row['TAB:F0_LONG']
+
+    assert [record_number for values, record_number in keyed.iter_index('KEYNAME')] == \
+        [row[RECNO_FIELDNAME] for row in ordered(rows, name_order)]
+    # NOCASE: values are compared in upper case
+    for name in ('gamma', 'Theta', 'IOTA'):
+        assert keyed.lookup('KEYNAME', name) == \
+            ordered([row for row in rows if row['TAB:F1_STRING'] == name.lower()], name_order)
+    assert list(keyed.lookup_range('KEYNAME', 'beta', 'delta')) == \
+        ordered([row for row in rows if 'beta' <= row['TAB:F1_STRING'] <= 'delta'], name_order)
+    row = rows[123]
+    assert keyed.lookup('KEYNAME', (row['TAB:F1_STRING'], row['TAB:F0_LONG'])) == [row]
+    # the second (DESCENDING) field decides the order of the bounds
+    low, high = (row['TAB:F1_STRING'], -10 ** 9), (row['TAB:F1_STRING'], 10 ** 9)
+    assert list(keyed.lookup_range('KEYNAME', low, high)) == \
+        ordered([other for other in rows if other['TAB:F1_STRING'] == row['TAB:F1_STRING'] and
+                 -10 ** 9 <= other['TAB:F0_LONG'] <= 10 ** 9], name_order)
+    assert keyed.lookup('KEYNAME', 'omega') == []
+
+
+def test_float_and_date(keyed, rows):
+    low, high = -250000.5, 10000.25
+    assert list(keyed.lookup_range('KEYDOUBLE', low, high)) == \
+        ordered([row for row in rows if low <= row['TAB:F3_DOUBLE'] <= high], lambda row: row['TAB:F3_DOUBLE'])
+    low, high = date(2005, 1, 1), date(2006, 6, 30)
+    assert list(keyed.lookup_range('KEYDATE', low, high)) == \
+        ordered([row for row in rows if low <= row['TAB:F4_DATE'] <= high],
+                lambda row: (row['TAB:F4_DATE'], row['TAB:F5_ULONG']))
+
+
+def test_records_range(keyed, rows):
+    key = keyed.get_key('KEYLONG')
+    value = rows[42]['TAB:F0_LONG']
+    records = list(keyed.records_range(key.prefix(value)))
+    assert [key.decode(record[INDEX_RECORD_HEADER_STRUCT.size:-RECORD_NUMBER_STRUCT.size])
+            for record in records] == [[value]]
+    assert len(list(keyed.records_range(key.prefix()))) == len(rows)
+    with pytest.raises(KeyError):
+        keyed.get_key('KEYMISSING')
+    with pytest.raises(ValueError):
+        key.prefix((1, 2))
+    # INDEX records are not kept in the file
+    with pytest.raises(ValueError):
+        keyed.get_key('INDEXLONG')
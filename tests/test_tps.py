@@ -0,0 +1,199 @@
+"""
+Access paths of TPS compared with the table scan, the scan is checked against the pinned rows of the numeric
+file
+"""
+
+import os.path
+import shutil
+
+import pytest
+
+from tpsread import TPS
+from tpsread.tpscache import TpsPageCache
+from tpsread.tpsdecoder import RECNO_FIELDNAME
+from tpsread.tpsrecord import DATA_TYPE
+from tpsread.tpsstats import TpsStats
+
+from .conftest import NUMERIC_ROW_COUNT, NUMERIC_ROWS_SHA256, PASSWORD, open_numeric, open_synthetic, plain_rows, \
+    rows_digest
+
+
+def test_expected_rows(numeric, numeric_rows):
+    assert len(numeric_rows) == NUMERIC_ROW_COUNT
+    assert rows_digest(numeric_rows) == NUMERIC_ROWS_SHA256
+    assert rows_digest(numeric.iter_pages(None)) == NUMERIC_ROWS_SHA256
+
+
+def test_iter_tuples(numeric, numeric_rows):
+    schema = numeric.schema()
+    tuples = list(numeric.iter_tuples())
+    assert tuples == [tuple(row[name] for name in schema.names) for row in numeric_rows]
+    named = next(numeric.iter_tuples(named=True))
+    assert named._asdict() == dict(zip(schema.identifiers, tuples[0]))
+
+
+def test_iter_batches(numeric, numeric_rows):
+    names = ['TST:LONG', 'TST:DECIMAL']
+    batches = list(numeric.iter_batches(10000, columns=names))
+    assert [len(batch) for batch in batches[:-1]] == [10000] * (len(batches) - 1)
+    assert [row for batch in batches for row in batch] == \
+        [(row[RECNO_FIELDNAME], row['TST:LONG'], row['TST:DECIMAL']) for row in numeric_rows]
+    columns = next(numeric.iter_batches(100, columns=names, named=True, layout='columns'))
+    assert columns.decimal == [row['TST:DECIMAL'] for row in numeric_rows[:100]]
+    with pytest.raises(ValueError):
+        next(numeric.iter_batches(100, layout='table'))
+
+
+def test_get_many(numeric, numeric_rows):
+    wanted = numeric_rows[::997] + numeric_rows[-3:]
+    record_numbers = [row[RECNO_FIELDNAME] for row in wanted]
+    assert numeric.get_many(record_numbers[::-1]) == wanted[::-1]
+    assert numeric.get(record_numbers[0]) == wanted[0]
+    assert numeric.get(0) is None
+    assert numeric.get_many([record_numbers[0], max(record_numbers) + 1]) == [wanted[0], None]
+
+
+@pytest.mark.parametrize('where', [
+    [('TST:LONG', '>', 0)],
+    [('long', '<=', 1000), ('TST:BYTE', '==', 1)],
+    [('TST:DECIMAL', '<', -10)],
+    [('TST:SHORT', 'in', (0, 1, 2, -1)), ('TST:ULONG', '!=', 0)],
+    [('TST:USHORT', 'not in', (0,)), ('TST:REAL', '>=', 0.5)],
+])
+def test_scan(numeric, numeric_rows, where):
+    operators = {'==': lambda a, b: a == b, '!=': lambda a, b: a != b, '<': lambda a, b: a < b,
+                 '<=': lambda a, b: a <= b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+                 'in': lambda a, b: a in b, 'not in': lambda a, b: a not in b}
+    expected = [row for row in numeric_rows
+                if all(operators[operator](row[column if ':' in column else 'TST:' + column.upper()], value)
+                       for column, operator, value in where)]
+    assert expected
+    assert list(numeric.scan(where=where)) == expected
+    assert list(numeric.scan(columns=['TST:SHORT'], where=where)) == \
+        [{RECNO_FIELDNAME: row[RECNO_FIELDNAME], 'TST:SHORT': row['TST:SHORT']} for row in expected]
+
+
+def test_blob(synthetic_filename, synthetic_rows):
+    tps = open_synthetic(synthetic_filename)
+    rows = synthetic_rows[1]
+    assert all(len(row['TAB:BLOB']) == 300 for row in rows)
+    record_number = rows[10][RECNO_FIELDNAME]
+    memo = tps.memo(record_number, 'TAB:BLOB')
+    assert memo.read() == rows[10]['TAB:BLOB']
+    assert memo.open().read() == rows[10]['TAB:BLOB']
+    assert plain_rows(tps.scan(columns=['TAB:BLOB'], where=[('TAB:F0_LONG', '==', rows[10]['TAB:F0_LONG'])])) == \
+        [{RECNO_FIELDNAME: record_number, 'TAB:BLOB': rows[10]['TAB:BLOB']}]
+    with pytest.raises(KeyError):
+        tps.memo(record_number, 'TAB:MISSING')
+
+
+def test_memo_definitions():
+    tps = TPS(os.path.join(os.path.dirname(__file__), '..', 'testdata', 'simple.nodata.tps'), encoding='cp1251',
+              current_tablename='UNNAMED')
+    assert [memo.name for number, memo in tps.get_memos()] == ['SIM:BLOB', 'SIM:MEMO']
+    assert list(tps) == []
+    assert tps.memo(1, 'SIM:MEMO').read() == ''
+
+
+def test_iter_all_tables(synthetic_filename, synthetic_rows):
+    tps = open_synthetic(synthetic_filename)
+    rows = {}
+    for table_name, row in tps.iter_all_tables():
+        rows.setdefault(table_name, []).append(row)
+    assert dict((table_name, plain_rows(table_rows)) for table_name, table_rows in rows.items()) == \
+        {'TABLE1': synthetic_rows[1], 'TABLE2': synthetic_rows[2]}
+
+
+def test_encrypted(encrypted_filename, synthetic_rows):
+    for predecrypt in (None, 'memory', 'file'):
+        tps = open_synthetic(encrypted_filename, password=PASSWORD, predecrypt=predecrypt)
+        assert plain_rows(tps.iter_pages(None, 2)) == synthetic_rows[2]
+        assert tps.verify() == []
+
+
+def test_verify(numeric, synthetic_filename):
+    assert numeric.verify() == []
+    assert open_synthetic(synthetic_filename).verify() == []
+
+
+def test_sidecar(synthetic_filename, synthetic_rows, tmp_path):
+    filename = str(tmp_path / 'sidecar.tps')
+    shutil.copy(synthetic_filename, filename)
+    sidecar = str(tmp_path / 'sidecar.tpsidx')
+    tps = open_synthetic(filename, sidecar=sidecar)
+    assert os.path.isfile(sidecar)
+    assert plain_rows(tps.iter_pages(None)) == synthetic_rows[1]
+    restored = open_synthetic(filename, sidecar=sidecar)
+    assert restored.pages.leaf_refs() == tps.pages.leaf_refs()
+    assert plain_rows(restored.iter_pages(None, 2)) == synthetic_rows[2]
+
+
+def test_iter_parallel(numeric_rows):
+    assert list(open_numeric().iter_parallel(workers=2)) == numeric_rows
+    assert sorted(open_numeric().iter_parallel(workers=2, ordered=False),
+                  key=lambda row: row[RECNO_FIELDNAME]) == numeric_rows
+
+
+def test_export_all(synthetic_filename, synthetic_rows):
+    class ListSink(list):
+        def write(self, row):
+            self.append(row)
+
+    tps = open_synthetic(synthetic_filename)
+    sinks = {}
+    counts = tps.export_all(lambda table_name: sinks.setdefault(table_name, ListSink()))
+    assert counts == {'TABLE1': 1500, 'TABLE2': 1500}
+    assert plain_rows(sinks['TABLE2']) == synthetic_rows[2]
+
+
+def test_page_caches(numeric_rows):
+    tps = open_numeric()
+    assert sum(1 for row in tps) == len(numeric_rows)
+    assert list(tps) == numeric_rows
+    stats = tps.cache_stats()
+    assert stats['pages']['hits'] >= stats['pages']['misses'] > 0
+    # the records cache is disabled by default
+    assert stats['records']['pages'] == 0
+
+    tps = open_numeric(records_cache=TpsPageCache())
+    assert list(tps) == numeric_rows
+    assert list(tps) == numeric_rows
+    stats = tps.cache_stats()['records']
+    assert stats['hits'] >= stats['misses'] == stats['pages'] > 0
+
+
+def test_close(encrypted_filename, synthetic_rows):
+    for predecrypt in (None, 'memory', 'file'):
+        with open_synthetic(encrypted_filename, password=PASSWORD, predecrypt=predecrypt) as tps:
+            assert plain_rows(tps.iter_pages(None)) == synthetic_rows[1]
+        assert tps.tps_file.closed
+        assert tps.cache_stats()['pages']['pages'] == 0
+        with pytest.raises(ValueError):
+            list(tps.iter_pages(None))
+
+
+def test_stats(numeric_rows, synthetic_filename, synthetic_rows):
+    # decode stage is counted per row and measured per page
+    stats = TpsStats()
+    tps = open_numeric(stats=stats)
+    assert sum(1 for row in tps) == stats.rows_decoded == len(numeric_rows)
+    assert stats.times['decode'] == 0.0
+    calls = []
+    stats.add_hook(lambda stage, counters, elapsed: calls.append((stage, counters)))
+    stats.reset()
+    assert len(list(tps.iter_tuples())) == stats.rows_decoded == len(numeric_rows)
+    decode_calls = [counters for stage, counters in calls if stage == 'decode']
+    assert len(decode_calls) == len(tps.leaf_page_refs(tps.current_table_number, (DATA_TYPE,)))
+    assert stats.times['decode'] > 0
+
+    stats.reset()
+    expected = [row for row in numeric_rows if row['TST:BYTE'] == 1]
+    assert list(tps.scan(where=[('TST:BYTE', '==', 1)])) == expected
+    assert stats.rows_decoded == len(expected)
+    stats.reset()
+    assert tps.get_many([row[RECNO_FIELDNAME] for row in expected[:10]]) == expected[:10]
+    assert stats.rows_decoded == 10
+
+    stats = TpsStats()
+    tps = open_synthetic(synthetic_filename, stats=stats)
+    assert sum(1 for row in tps.iter_all_tables()) == stats.rows_decoded == 3000
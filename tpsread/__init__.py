@@ -16,8 +16,14 @@ __url__ = 'http://tpsread.readthedocs.org'
 __license__ = 'GPL'
 __version__ = '0.0.7'
 
+import logging
+
 from .tps import TPS
+from .tpsasync import AsyncTPS
 from .tpscrypt import TpsDecryptor
 
+# diagnostic output is disabled unless the application configures logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
 # list of public objects
 __all__ = []
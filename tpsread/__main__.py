@@ -0,0 +1,168 @@
+"""
+Convert a directory tree of TPS files (all tables) to CSV, JSON Lines, SQLite or Parquet
+
+Files are converted by a pool of worker processes, a file per task, with bounded page caches. Output of
+SOURCE/dir/file.tps is OUTPUT/dir/file/<table>.<format> (OUTPUT/dir/file.sqlite for SQLite). Size, mtime
+and header change_count of converted files are saved to OUTPUT/.tpsread.json, unchanged files are skipped
+by the next run (unless --force).
+
+Usage: python -m tpsread SOURCE OUTPUT [--format csv|jsonl|sqlite|parquet] [--workers N] [--encoding cp1251]
+                         [--password PASSWORD] [--cache-mb 16] [--batch-size 10000] [--force]
+"""
+
+import argparse
+import json
+import logging
+import os
+import os.path
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timeit import default_timer
+
+from construct import ConstError, StreamError
+
+from .tps import TPS, read_header
+from .tpscache import TpsPageCache
+from .tpsexport import DEFAULT_BATCH_SIZE, FORMATS, export_file
+
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = '.tpsread.json'
+
+
+def find_files(source):
+    """
+    Paths of TPS files relative to source, sorted
+    """
+    found = []
+    for topdir, dirs, files in os.walk(source):
+        for filename in files:
+            if filename.lower().endswith('.tps'):
+                found.append(os.path.relpath(os.path.join(topdir, filename), source))
+    return sorted(found)
+
+
+def file_signature(filename, password=None):
+    """
+    Size, mtime and change_count of the file (change_count is None if the header can not be read: not a TPS
+    file, wrong password, empty file; such files are converted every time)
+    """
+    stat = os.stat(filename)
+    try:
+        change_count = read_header(filename, password).change_count
+    except (ConstError, StreamError, ValueError) as error:
+        logger.warning('Header of %s is not read: %s', filename, error)
+        change_count = None
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'change_count': change_count}
+
+
+def output_path(output, relative_path, output_format):
+    path = os.path.join(output, os.path.splitext(relative_path)[0])
+    if output_format == 'sqlite':
+        return path + '.sqlite'
+    return path
+
+
+def convert(filename, output_format, path, encoding, password, cache_mb, batch_size):
+    """
+    Convert the file in a worker process, return row counts by table name and elapsed time
+    """
+    start = default_timer()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with TPS(filename, encoding=encoding, password=password,
+             page_cache=TpsPageCache(max_bytes=cache_mb * 1024 * 1024)) as tps:
+        counts = export_file(tps, output_format, path, batch_size=batch_size)
+    return counts, default_timer() - start
+
+
+def load_state(filename):
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as state_file:
+        return json.load(state_file)
+
+
+def save_state(filename, state):
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as state_file:
+        json.dump(state, state_file, indent=1, sort_keys=True)
+    os.replace(temp_filename, filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='tpsread', description='Convert a directory tree of TPS files')
+    parser.add_argument('source', help='directory of TPS files')
+    parser.add_argument('output', help='output directory')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='output format')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (CPU count by default)')
+    parser.add_argument('--encoding', default='cp1251', help='encoding of strings')
+    parser.add_argument('--password', default=None, help='password of encrypted files')
+    parser.add_argument('--cache-mb', type=int, default=16, help='page cache budget of a worker (MB)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='rows per write (CSV, JSON Lines), executemany (SQLite), row group (Parquet)')
+    parser.add_argument('--force', action='store_true', help='convert unchanged files too')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+
+    os.makedirs(args.output, exist_ok=True)
+    state_filename = os.path.join(args.output, STATE_FILENAME)
+    state = load_state(state_filename)
+
+    files = find_files(args.source)
+    signatures = {}
+    pending = []
+    skipped = 0
+    for relative_path in files:
+        signature = file_signature(os.path.join(args.source, relative_path), args.password)
+        signature['format'] = args.format
+        signatures[relative_path] = signature
+        if not args.force and signature['change_count'] is not None and state.get(relative_path) == signature:
+            skipped += 1
+        else:
+            pending.append(relative_path)
+    if skipped:
+        print('{} unchanged files skipped'.format(skipped))
+
+    start = default_timer()
+    done = 0
+    failed = 0
+    total_rows = 0
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # largest files first
+        futures = dict((executor.submit(convert, os.path.join(args.source, relative_path), args.format,
+                                        output_path(args.output, relative_path, args.format), args.encoding,
+                                        args.password, args.cache_mb, args.batch_size), relative_path)
+                       for relative_path in sorted(pending, key=lambda path: -signatures[path]['size']))
+        for future in as_completed(futures):
+            relative_path = futures[future]
+            done += 1
+            try:
+                counts, elapsed = future.result()
+            except Exception as error:
+                failed += 1
+                print('[{}/{}] {}: failed: {!r}'.format(done, len(pending), relative_path, error), file=sys.stderr)
+                continue
+            rows = sum(counts.values())
+            size = signatures[relative_path]['size']
+            total_rows += rows
+            total_bytes += size
+            print('[{}/{}] {}: {} tables, {} rows, {:.1f} MB in {:.2f} s ({:.0f} rows/s)'.format(
+                done, len(pending), relative_path, len(counts), rows, size / 1e6, elapsed,
+                rows / elapsed if elapsed else 0))
+            state[relative_path] = signatures[relative_path]
+            save_state(state_filename, state)
+
+    elapsed = default_timer() - start
+    print('{} files converted, {} skipped, {} failed: {} rows, {:.1f} MB in {:.2f} s '
+          '({:.0f} rows/s, {:.1f} MB/s)'.format(
+              len(pending) - failed, skipped, failed, total_rows, total_bytes / 1e6, elapsed,
+              total_rows / elapsed if elapsed else 0, total_bytes / 1e6 / elapsed if elapsed else 0))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,25 +6,50 @@ http://www.softvelocity.com/clarion/pdf/languagereferencemanual.pdf
 http://www.softvelocity.com/clarion/pdf/databasedrivers.pdf
 """
 
+import logging
+import os
 import os.path
 import mmap
-from datetime import date
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+from datetime import date, time as datetime_time
 from warnings import warn
-from binascii import hexlify
 
 from six import text_type
-from construct import Array, Byte, Bytes, Const, Float32l, Float64l, Struct, Int16sl, Int32sl, Int32ub, \
-    Int8ul, Int16ul, Int32ul, ConstError
+from construct import Array, Byte, Bytes, Const, Struct, Int32ub, Int16ul, Int32ul, ConstError, StreamError
 
+from .tpscache import DEFAULT_PAGE_CACHE_BYTES, DEFAULT_RECORDS_CACHE_PAGES, TpsPageCache
 from .tpscrypt import TpsDecryptor
-from .tpstable import TpsTablesList
+from .tpstable import TpsSchema, TpsTablesList
 from .tpspage import TpsPagesList
-from .tpsrecord import TpsRecordsList
+from .tpsrecord import DATA_RECORD_HEADER_STRUCT, DATA_TYPE, INDEX_RECORD_HEADER_STRUCT, RECORD_NUMBER_STRUCT, \
+    TABLE_NAME_TYPE, TABLE_NUMBER_STRUCT, TpsRecordsList, contents_match
+from .tpskey import TpsKey, find_key
+from .tpsmemo import TpsMemo
+from .tpsdecoder import RECNO_FIELDNAME, TpsRecordDecoder, field_predicate, find_field
+from .tpsverify import TpsBlocks, verify
+from .tpssidecar import load_sidecar, save_sidecar, sidecar_filename
+from .tpsstats import TpsStats
+from .tpsdelta import changes, snapshot
 from .utils import check_value
 
 
+logger = logging.getLogger(__name__)
 
+# TPS file header
+HEADER_STRUCT = 'header' / Struct(
+                'offset' / Int32ul,
+                'size' / Int16ul,
+                'file_size' / Int32ul,
+                'allocated_file_size' / Int32ul,
+                'top_speed_mark' / Const(b'tOpS\x00\x00', Bytes(6)),
+                'last_issued_row' / Int32ub,
+                'change_count' / Int32ul,
+                'page_root_ref' / Int32ul,
+                'block_start_ref' / Array(lambda ctx: (ctx['size'] - 0x20) // 2 // 4, Int32ul),
+                'block_end_ref' / Array(lambda ctx: (ctx['size'] - 0x20) // 2 // 4, Int32ul))
 
 # Date structure
 DATE_STRUCT = 'date_struct' / Struct('day' / Byte,
@@ -39,6 +64,42 @@ TIME_STRUCT = 'time_struct' / Struct(
                      'hour' / Byte)
 
 
+# TPS file of the worker process (iter_parallel)
+worker_tps = None
+
+
+def init_worker(tps):
+    global worker_tps
+    worker_tps = tps
+
+
+def scan_pages(page_refs, table_number):
+    # memo handles are added by the parent process
+    return list(worker_tps.iter_pages(page_refs, table_number, memos=False))
+
+
+def read_header(filename, password=None, decryptor_class=TpsDecryptor):
+    """
+    Header of the TPS file without reading its pages (e.g. change_count of a file to find changed files)
+    """
+    with open(filename, mode='rb') as tpsfile:
+        tps_file = mmap.mmap(tpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        decryptor = decryptor_class(tps_file, password)
+        if decryptor.is_encrypted():
+            data = decryptor.decrypt(0x200, 0)
+        else:
+            data = tps_file[:0x200]
+        return HEADER_STRUCT.parse(data)
+    finally:
+        tps_file.close()
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class TPS:
     """
     TPS file
@@ -46,7 +107,19 @@ class TPS:
 
     def __init__(self, filename, encoding=None, password=None, cached=True, check=False,
                  current_tablename=None, date_fieldname=None,
-                 time_fieldname=None, decryptor_class=TpsDecryptor):
+                 time_fieldname=None, decryptor_class=TpsDecryptor, predecrypt=None, sidecar=False,
+                 page_cache=None, records_cache=None, stats=None):
+        """
+        predecrypt - decrypt the whole encrypted file once at open: 'memory' (anonymous mmap)
+        or 'file' (temporary file mmap), then reads are plain slices
+        sidecar - use sidecar metadata index (True - file.tpsidx next to the file, or sidecar filename):
+        restore page tree and tables from it if it is valid, else write it. Not used for encrypted files
+        (it would keep table definitions unencrypted).
+        page_cache, records_cache - page caches (see tpscache.TpsPageCache) of split page data and of parsed
+        records, LRU caches with default budgets if None (the records cache is disabled by default, see
+        tpscache.DEFAULT_RECORDS_CACHE_PAGES). Not used if cached is False.
+        stats - counters and timers of reading stages (tpsstats.TpsStats, without timing if None)
+        """
         self.filename = filename
         self.encoding = encoding
         self.password = password
@@ -64,141 +137,865 @@ class TPS:
             self.time_fieldname = time_fieldname
         else:
             self.time_fieldname = []
-        self.cache_pages = {}
+        if page_cache is None:
+            page_cache = TpsPageCache(max_bytes=DEFAULT_PAGE_CACHE_BYTES)
+        if records_cache is None:
+            records_cache = TpsPageCache(max_pages=DEFAULT_RECORDS_CACHE_PAGES)
+        self.page_cache = page_cache
+        self.records_cache = records_cache
+        self.stats = stats if stats is not None else TpsStats()
+        self.decoders = {}
+        self.keys = {}
+        # leaf page ref -> bytes of the first record (binary search by key)
+        self.first_keys = {}
+        self.blocks = None
 
         if not os.path.isfile(self.filename):
             raise FileNotFoundError(self.filename)
 
         self.file_size = os.path.getsize(self.filename)
 
-        # Check file size
-        if check:
-            if self.file_size & 0x3F != 0:
-                # TODO check translate
-                warn('File size is not a multiple of 64 bytes.', RuntimeWarning)
+        self.decryptor_class = decryptor_class
+        self.predecrypt = predecrypt
+        self.__open(predecrypt)
+
+        try:
+            logger.debug('Reading header...')
+            self.header = HEADER_STRUCT.parse(self.read(0x200))
+            if sidecar and self.password is None:
+                self.sidecar_filename = sidecar if sidecar is not True else sidecar_filename(self.filename)
+            else:
+                self.sidecar_filename = None
+            state = None
+            if self.sidecar_filename is not None:
+                state = load_sidecar(self, self.sidecar_filename)
+            if state is not None:
+                logger.debug('Reading sidecar index...')
+                self.pages = TpsPagesList(self, self.header.page_root_ref, check=self.check, state=state['pages'])
+                self.tables = TpsTablesList(self, encoding=self.encoding, check=self.check, state=state['tables'])
+            else:
+                logger.debug('Reading pages...')
+                self.pages = TpsPagesList(self, self.header.page_root_ref, check=self.check)
+                logger.debug('Reading tables...')
+                self.tables = TpsTablesList(self, encoding=self.encoding, check=self.check)
+                if self.sidecar_filename is not None:
+                    self.save_sidecar()
+            self.set_current_table(current_tablename)
+            if check:
+                for finding in self.verify(records=False):
+                    # TODO check translate
+                    warn(str(finding), RuntimeWarning)
+        except ConstError as errr:
+            logger.error('Bad cryptographic keys. %s %s', self.header, errr)
+
+    def __open(self, predecrypt=None):
+        # read-only mmap, it is never written
+        with open(self.filename, mode='rb') as tpsfile:
+            self.tps_file = mmap.mmap(tpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.decryptor = self.decryptor_class(self.tps_file, self.password)
+        if predecrypt is not None and self.decryptor.is_encrypted():
+            if predecrypt not in ('memory', 'file'):
+                raise ValueError('predecrypt must be None, "memory" or "file"')
+            decrypted_file = self.decryptor.decrypt_file(in_memory=predecrypt == 'memory')
+            self.tps_file.close()
+            self.tps_file = decrypted_file
+            self.decryptor = self.decryptor_class(self.tps_file, None)
+
+    def close(self):
+        """
+        Close the file mapping (the decrypted copy if predecrypt) and clear the page caches
+        """
+        self.tps_file.close()
+        self.page_cache.clear()
+        self.records_cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        with open(self.filename, mode='r+b') as tpsfile:
-            self.tps_file = mmap.mmap(tpsfile.fileno(), 0)
+    def refresh(self):
+        """
+        Reread the header and the page tree if the file has changed (e.g. it is written by a running
+        application), the file is mapped again if its size has changed. Unchanged control pages are kept, cached
+        leaf pages still in the tree are kept unless their data hash has changed (see TpsPagesList.refresh),
+        table definitions are kept. Return True if the file has changed.
+        """
+        file_size = os.path.getsize(self.filename)
+        resized = file_size != self.file_size
+        if resized:
+            self.tps_file.close()
+            self.file_size = file_size
+            self.__open(self.predecrypt)
+        header = HEADER_STRUCT.parse(self.read(0x200, 0))
+        if not resized and header.change_count == self.header.change_count and \
+                header.last_issued_row == self.header.last_issued_row:
+            return False
+        self.header = header
+        self.blocks = None
+        for page_ref in self.pages.refresh(self.header.page_root_ref):
+            self.discard_page(page_ref)
+        return True
 
-            self.decryptor = decryptor_class(self.tps_file, self.password)
+    def discard_page(self, page_ref):
+        """
+        Drop cached data of the leaf page (it has changed or is not in the page tree)
+        """
+        self.page_cache.discard(page_ref)
+        self.records_cache.discard(page_ref)
+        self.first_keys.pop(page_ref, None)
 
+    def __last_record_number(self, table_number):
+        # max record_number of DATA records of the table, 0 if there are none; the last DATA record is in the
+        # last page with the first record below the greatest DATA header key (see __find_page)
+        page_refs = self.pages.leaf_refs()
+        if not page_refs:
+            return 0
+        key = DATA_RECORD_HEADER_STRUCT.pack(table_number, DATA_TYPE, 0xFFFFFFFF) + b'\xff'
+        page_ref = page_refs[self.__find_page(page_refs, key)]
+        TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check)
+        record_numbers = self.pages.get_record_numbers(page_ref)
+        return record_numbers[table_number][1] if table_number in record_numbers else 0
+
+    def __rows_after(self, table_number, record_number):
+        # rows with greater record numbers, only the last pages are read (see records_range)
+        decoder = self.get_decoder(table_number)
+        memos = self.get_memos(table_number)
+        names = self.__names(decoder, memos)
+        low = DATA_RECORD_HEADER_STRUCT.pack(table_number, DATA_TYPE, record_number + 1)
+        high = TABLE_NUMBER_STRUCT.pack(table_number) + bytes((DATA_TYPE,))
+        records = list(self.records_range(low, high))
+        start = self.stats.start()
+        rows = []
+        for record in records:
+            record_table_number, record_type, record_number = DATA_RECORD_HEADER_STRUCT.unpack_from(record)
+            rows.append(self.__row(decoder, names, record_number, record[DATA_RECORD_HEADER_STRUCT.size:],
+                                   table_number, memos))
+        self.stats.add('decode', start, rows_decoded=len(rows))
+        return rows
+
+    def follow(self, interval=0.5, table_number=None, from_start=False, timeout=None):
+        """
+        Rows added to the table (current by default) while the file is written by another application
+
+        The header (change_count, last_issued_row) and the file size are polled every interval seconds, on a
+        change the page tree is reread (see refresh) and rows with record numbers above the last one seen are
+        yielded. Existing rows are yielded first if from_start is True. Stops after timeout seconds without
+        new rows (never if None). The file is only mapped read-only.
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        last_record_number = -1 if from_start else self.__last_record_number(table_number)
+        changed = from_start
+        last_change = time.monotonic()
+        while True:
+            if changed:
+                for row in self.__rows_after(table_number, last_record_number):
+                    last_record_number = max(last_record_number, row[RECNO_FIELDNAME])
+                    last_change = time.monotonic()
+                    yield row
+            if timeout is not None and time.monotonic() - last_change >= timeout:
+                return
+            time.sleep(interval)
             try:
-                # TPS file header
-                header = 'header' / Struct(
-                                'offset' / Int32ul,
-                                'size' / Int16ul,
-                                'file_size' / Int32ul,
-                                'allocated_file_size' / Int32ul,
-                                'top_speed_mark' / Const(b'tOpS\x00\x00', Bytes(6)),
-                                'last_issued_row' / Int32ub,
-                                'change_count' / Int32ul,
-                                'page_root_ref' / Int32ul,
-                                'block_start_ref' / Array(lambda ctx: (ctx['size'] - 0x20) // 2 // 4, Int32ul),
-                                'block_end_ref' / Array(lambda ctx: (ctx['size'] - 0x20) // 2 // 4, Int32ul))
-                print("Reading header...")
-                self.header = header.parse(self.read(0x200))
-                print("Reading pages...")
-                self.pages = TpsPagesList(self, self.header.page_root_ref, check=self.check)
-                print("Reading tables...")
-                self.tables = TpsTablesList(self, encoding=self.encoding, check=self.check)
-                self.set_current_table(current_tablename)
-            except ConstError as errr:
-                print('Bad cryptographic keys.', self.header, errr)
+                changed = self.refresh()
+            except (ConstError, StreamError, ValueError) as error:
+                # the file is being written, next poll
+                logger.debug('File is not read: %s', error)
+                changed = False
+
+    def __getstate__(self):
+        # mmap, decryptor and parsed pages (see TpsPageCache) are not pickled, the file is reopened
+        # (e.g. by worker processes)
+        state = self.__dict__.copy()
+        del state['tps_file']
+        del state['decryptor']
+        state['decoders'] = {}
+        state['keys'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__open()
+
+    def cache_stats(self):
+        """
+        Hits, misses, evictions and size of the page caches
+        """
+        return {'pages': self.page_cache.stats(), 'records': self.records_cache.stats()}
 
     def block_contains(self, start_ref, end_ref):
-        for i in range(len(self.header.block_start_ref)):
-            if self.header.block_start_ref[i] <= start_ref and end_ref <= self.header.block_end_ref[i]:
-                return True
-        return False
+        if self.blocks is None:
+            self.blocks = TpsBlocks(self.header.block_start_ref, self.header.block_end_ref)
+        return self.blocks.contains(start_ref, end_ref)
+
+    def verify(self, records=True):
+        """
+        Integrity check of the file (see tpsverify.verify), return list of TpsFinding
+        """
+        return verify(self, records=records)
 
     def read(self, size, pos=None):
         if pos is not None:
             self.seek(pos)
         else:
             pos = self.tps_file.tell()
+        start = self.stats.start()
         if self.decryptor.is_encrypted():
-            return self.decryptor.decrypt(size, pos)
+            data = self.decryptor.decrypt(size, pos)
+            self.stats.add('decrypt', start, bytes_read=size, bytes_decrypted=size)
         else:
-            return self.tps_file.read(size)
+            data = self.tps_file.read(size)
+            self.stats.add('read', start, bytes_read=size)
+        return data
 
     def seek(self, pos):
         self.tps_file.seek(pos)
 
+    def get_decoder(self, table_number, columns=None):
+        """
+        Record decoder compiled once per table definition (and columns, all if None)
+        """
+        decoder_key = table_number if columns is None else (table_number, tuple(columns))
+        if decoder_key not in self.decoders:
+            self.decoders[decoder_key] = TpsRecordDecoder(self.tables.get_definition(table_number),
+                                                          encoding=self.encoding,
+                                                          date_fieldname=self.date_fieldname,
+                                                          time_fieldname=self.time_fieldname,
+                                                          columns=columns)
+        return self.decoders[decoder_key]
+
+    def get_key(self, key_name, table_number=None):
+        """
+        Key (index) of the table (current by default) by name, see tpskey.TpsKey. Only KEY indexes are kept
+        in the file: ValueError for INDEX and DYNAMIC_INDEX (built by the application on demand).
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        definition = self.tables.get_definition(table_number)
+        number = find_key(definition, key_name)
+        if (table_number, number) not in self.keys:
+            key = TpsKey(table_number, number, definition, encoding=self.encoding)
+            if key.type != 'KEY':
+                raise ValueError('{} is {}, its records are not kept in the file'.format(key.name, key.type))
+            self.keys[(table_number, number)] = key
+        return self.keys[(table_number, number)]
+
+    def __page_first_key(self, page_ref):
+        # the first key of a page changed since refresh is dropped (see discard_page)
+        self.pages.is_current(page_ref)
+        if page_ref not in self.first_keys:
+            first_key = None
+            records = TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check)
+            for record in records.raw_records():
+                if len(record) > 0:
+                    first_key = bytes(record)
+                    break
+            self.first_keys[page_ref] = first_key
+        return self.first_keys[page_ref]
+
+    def __find_page(self, page_refs, key):
+        # position of the last page with the first record below key (pages without records are passed)
+        low = 0
+        high = len(page_refs)
+        while low < high:
+            middle = (low + high) // 2
+            first_key = self.__page_first_key(page_refs[middle])
+            if first_key is not None and first_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return max(low - 1, 0)
+
+    def records_range(self, low, high=None):
+        """
+        Raw records (bytes without data_size) with prefix from low to high (inclusive, low by default)
+
+        Records of the file are sorted by their bytes in tree order, so the first leaf page is found by
+        binary search over first records of the leaf pages, and only the pages of the range are read.
+        """
+        if high is None:
+            high = low
+        page_refs = self.pages.leaf_refs()
+        for page_ref in page_refs[self.__find_page(page_refs, low):]:
+            records = TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check)
+            for record in records.raw_records():
+                if len(record) == 0 or bytes(record[:len(low)]) < low:
+                    continue
+                if bytes(record[:len(high)]) > high:
+                    return
+                yield record
+
+    def iter_index(self, key_name, low=None, high=None, table_number=None):
+        """
+        (key field values, record_number) of the index records of the key from low to high values
+        (scalar or tuple of the first key fields, inclusive, from the lowest / to the highest if None) in key
+        order. low <= high for DESCENDING keys too: the records are read from high to low (see TpsKey.range).
+        """
+        key = self.get_key(key_name, table_number)
+        for record in self.records_range(*key.range(low, high)):
+            record_number = RECORD_NUMBER_STRUCT.unpack_from(record, len(record) - RECORD_NUMBER_STRUCT.size)[0]
+            yield key.decode(record[INDEX_RECORD_HEADER_STRUCT.size:-RECORD_NUMBER_STRUCT.size]), record_number
+
+    def lookup_range(self, key_name, low=None, high=None, table_number=None):
+        """
+        Rows of the table (current by default) with key values from low to high (see iter_index) in key order,
+        only index records of the range and the pages of the matching data records are read
+        """
+        record_numbers = [record_number for values, record_number
+                          in self.iter_index(key_name, low, high, table_number)]
+        for row in self.get_many(record_numbers, table_number):
+            if row is not None:
+                yield row
+
+    def lookup(self, key_name, value, table_number=None):
+        """
+        List of rows with the key value (scalar or tuple of the first key fields)
+        """
+        return list(self.lookup_range(key_name, value, value, table_number))
+
+    def __locate(self, page_refs, table_number, record_number):
+        # leaf page (of page_refs in tree order) with the DATA record, None if there is no such record;
+        # binary search by min/max record numbers of the pages (TpsPagesList.get_record_numbers)
+        key = DATA_RECORD_HEADER_STRUCT.pack(table_number, DATA_TYPE, record_number)
+        low = 0
+        high = len(page_refs)
+        while low < high:
+            middle = (low + high) // 2
+            page_ref = page_refs[middle]
+            record_numbers = self.pages.get_record_numbers(page_ref)
+            if record_numbers is None:
+                TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check)
+                record_numbers = self.pages.get_record_numbers(page_ref)
+            if table_number in record_numbers:
+                min_record_number, max_record_number = record_numbers[table_number]
+                if record_number < min_record_number:
+                    high = middle
+                elif record_number > max_record_number:
+                    low = middle + 1
+                else:
+                    return page_ref
+            else:
+                # no DATA of the table in the page
+                first_key = self.__page_first_key(page_ref)
+                if first_key is not None and first_key < key:
+                    low = middle + 1
+                else:
+                    high = middle
+        return None
+
+    def get_many(self, record_numbers, table_number=None):
+        """
+        Rows by record numbers of the table (current by default), None for missing records, in the same order
+
+        Leaf pages are located by their min/max record numbers and every page is read once.
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        decoder = self.get_decoder(table_number)
+        memos = self.get_memos(table_number)
+        names = self.__names(decoder, memos)
+        page_refs = self.leaf_page_refs(table_number, (DATA_TYPE,))
+        page_record_numbers = {}
+        for record_number in record_numbers:
+            page_ref = self.__locate(page_refs, table_number, record_number)
+            if page_ref is not None:
+                page_record_numbers.setdefault(page_ref, set()).add(record_number)
+
+        rows = {}
+        for page_ref in sorted(page_record_numbers):
+            wanted = page_record_numbers[page_ref]
+            records = TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check)
+            start = self.stats.start()
+            count = 0
+            for record in records.raw_records():
+                if len(record) < DATA_RECORD_HEADER_STRUCT.size or record[0] == TABLE_NAME_TYPE or \
+                        record[4] != DATA_TYPE:
+                    continue
+                record_table_number, record_type, record_number = DATA_RECORD_HEADER_STRUCT.unpack_from(record)
+                if record_table_number == table_number and record_number in wanted:
+                    rows[record_number] = self.__row(decoder, names, record_number,
+                                                     record[DATA_RECORD_HEADER_STRUCT.size:], table_number, memos)
+                    count += 1
+            self.stats.add('decode', start, rows_decoded=count)
+        return [rows.get(record_number) for record_number in record_numbers]
+
+    def get(self, record_number, table_number=None):
+        """
+        Row by record number of the table (current by default), None if there is no such record
+        """
+        return self.get_many([record_number], table_number)[0]
+
+    def snapshot(self):
+        """
+        Fingerprints of the leaf pages for change detection (see tpsdelta.TpsSnapshot)
+        """
+        return snapshot(self)[0]
+
+    def changes(self, previous):
+        """
+        Changes since the previous snapshot (see tpsdelta.TpsChanges), only pages with other fingerprints are
+        read. The snapshot to compare with next time is changes.snapshot.
+        """
+        return changes(self, previous)
+
+    def iter_changes(self, previous, table_number=None):
+        """
+        ('inserted' / 'updated' / 'deleted', record_number, row) of the table (current by default) since the
+        previous snapshot, row is None for deleted records
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        delta = self.changes(previous)
+        for kind in ('inserted', 'updated'):
+            record_numbers = getattr(delta, kind).get(table_number, [])
+            for record_number, row in zip(record_numbers, self.get_many(record_numbers, table_number)):
+                yield kind, record_number, row
+        for record_number in delta.deleted.get(table_number, []):
+            yield 'deleted', record_number, None
+
+    def build_page_index(self):
+        """
+        Read leaf pages not yet in the leaf page index (records are split, not parsed)
+        """
+        for page_ref in self.pages.leaf_refs():
+            if self.pages.get_contents(page_ref) is None:
+                TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check)
+
+    def save_sidecar(self, filename=None):
+        """
+        Write sidecar metadata index with the complete leaf page index
+        """
+        if filename is None:
+            filename = self.sidecar_filename or sidecar_filename(self.filename)
+        self.build_page_index()
+        save_sidecar(self, filename)
+
+    def leaf_page_refs(self, table_number=None, record_types=None, order='tree'):
+        """
+        Refs of leaf pages that may contain records of the table and record types (see page_records),
+        in tree order ('tree') or file order ('physical')
+        """
+        page_refs = []
+        for page_ref in self.pages.leaf_refs(order):
+            contents = self.pages.get_contents(page_ref)
+            if contents is None or contents_match(contents, table_number, record_types):
+                page_refs.append(page_ref)
+        return page_refs
+
+    def page_records(self, table_number=None, record_types=None, page_refs=None, reverse=False, order='tree'):
+        """
+        Records lists of the leaf pages that contain records of the table (any if None) and of the record
+        types (codes, any if None)
+
+        Pages already read are skipped using the leaf page index (TpsPagesList.get_contents), other pages are
+        read and split, their records are parsed only if they match.
+        """
+        if page_refs is None:
+            page_refs = self.leaf_page_refs(table_number, record_types, order)
+        if reverse:
+            page_refs = reversed(page_refs)
+        for page_ref in page_refs:
+            contents = self.pages.get_contents(page_ref)
+            if contents is not None and not contents_match(contents, table_number, record_types):
+                continue
+            records = TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check)
+            if records.contains(table_number, record_types):
+                yield records
+
+    def __data_pages(self, table_number, page_refs=None):
+        # DATA records of the table, a list per leaf page
+        for records in self.page_records(table_number, (DATA_TYPE,), page_refs):
+            yield [record for record in records
+                   if record.type == 'DATA' and record.data.table_number == table_number]
+
+    def __data_records(self, table_number, page_refs=None):
+        for records in self.__data_pages(table_number, page_refs):
+            for record in records:
+                yield record
+
+    def iter_pages(self, page_refs, table_number=None, memos=True):
+        """
+        Rows of the table (current by default) from the given leaf pages (all if None), with MEMO and BLOB
+        fields as lazy TpsMemo handles if memos is True
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        decoder = self.get_decoder(table_number)
+        memos = self.get_memos(table_number) if memos else ()
+        names = self.__names(decoder, memos)
+        for records in self.__data_pages(table_number, page_refs):
+            # decode stage is measured per page
+            start = self.stats.start()
+            rows = [self.__row(decoder, names, record.data.record_number, record.data.data, table_number, memos)
+                    for record in records]
+            self.stats.add('decode', start, rows_decoded=len(rows))
+            for row in rows:
+                yield row
+
+    @staticmethod
+    def __names(decoder, memos):
+        return [RECNO_FIELDNAME] + decoder.names + [memo.name for number, memo in memos]
+
+    def __values(self, decoder, record_number, data, table_number=None, memos=()):
+        """
+        Record number, decoded fields and TpsMemo handles of the memos (list), the decode stage is added to
+        stats by the caller (per page)
+        """
+        if len(data) != decoder.record_size:
+            check_value('table_record_size', len(data), decoder.record_size)
+        values = decoder.decode(data)
+        values.insert(0, record_number)
+        for number, memo in memos:
+            values.append(TpsMemo(self, table_number, record_number, number, memo))
+        return values
+
+    def __row(self, decoder, names, record_number, data, table_number=None, memos=()):
+        return dict(zip(names, self.__values(decoder, record_number, data, table_number, memos)))
+
+    def schema(self, table_number=None, columns=None):
+        """
+        TpsSchema of rows of the table (current by default): names, types and namedtuple row class,
+        only of the columns if not None
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        if columns is None:
+            return self.tables.get_schema(table_number)
+        return TpsSchema(self.tables.get_definition(table_number), columns)
+
+    def iter_tuples(self, table_number=None, columns=None, named=False):
+        """
+        Rows of the table (current by default) as tuples in the order of schema(table_number, columns).names,
+        as schema row_class namedtuples if named is True. MEMO and BLOB fields are lazy TpsMemo handles.
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        schema = self.schema(table_number, columns)
+        decoder = self.get_decoder(table_number, None if columns is None else schema.field_names)
+        make = schema.row_class._make if named else tuple
+        for records in self.__data_pages(table_number):
+            start = self.stats.start()
+            rows = [make(self.__values(decoder, record.data.record_number, record.data.data, table_number,
+                                       schema.memos))
+                    for record in records]
+            self.stats.add('decode', start, rows_decoded=len(rows))
+            for row in rows:
+                yield row
+
+    def iter_batches(self, size, table_number=None, columns=None, named=False, layout='rows'):
+        """
+        Rows of the table (current by default) in lists of up to size rows (see iter_tuples), or if layout
+        is 'columns' in lists of columns (a schema row_class namedtuple of column lists if named is True)
+        """
+        if layout not in ('rows', 'columns'):
+            raise ValueError('Unknown layout {!r}'.format(layout))
+        rows = self.iter_tuples(table_number, columns, named=named and layout == 'rows')
+        make = self.schema(table_number, columns).row_class._make if named else list
+        while True:
+            batch = list(islice(rows, size))
+            if not batch:
+                break
+            if layout == 'columns':
+                yield make(list(column) for column in zip(*batch))
+            else:
+                yield batch
+
+    def get_memos(self, table_number=None, columns=None):
+        """
+        (memo number, memo definition) of MEMO and BLOB fields of the table (current by default),
+        only of the columns that name one if columns is not None
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        memos = list(enumerate(self.tables.get_definition(table_number).record_table_definition_memo))
+        if columns is None:
+            return memos
+        definitions = [memo for number, memo in memos]
+        selected = []
+        for column in columns:
+            try:
+                memo = find_field(definitions, column)
+            except KeyError:
+                continue
+            selected.append(memos[definitions.index(memo)])
+        return selected
+
+    def memo(self, record_number, name, table_number=None):
+        """
+        MEMO or BLOB (lazy TpsMemo handle) of the record by field name
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        memos = self.get_memos(table_number, [name])
+        if not memos:
+            raise KeyError(name)
+        number, memo = memos[0]
+        return TpsMemo(self, table_number, record_number, number, memo)
+
     def __iter__(self):
+        return self.iter_pages(None)
+
+    def scan(self, columns=None, where=None, table_number=None):
+        """
+        Rows of the table (current by default) with the columns only (all if None), that match all where
+        predicates: list of (column, operator, value), operator is one of '==', '!=', '<', '<=', '>', '>=',
+        'in', 'not in'. Columns may name MEMO and BLOB fields (lazy TpsMemo handles).
+
+        Predicates are evaluated on the raw record data (see tpsdecoder.field_predicate), only the matching
+        records are decoded.
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        memos = self.get_memos(table_number, columns)
+        if columns is not None:
+            columns = [column for column in columns if not self.get_memos(table_number, [column])]
+        decoder = self.get_decoder(table_number, columns)
+        names = self.__names(decoder, memos)
+        fields = self.tables.get_definition(table_number).record_table_definition_field
+        predicates = [field_predicate(find_field(fields, column), operator_name, value, encoding=self.encoding,
+                                      date_fieldname=self.date_fieldname, time_fieldname=self.time_fieldname)
+                      for column, operator_name, value in (where or ())]
+        for records in self.__data_pages(table_number):
+            start = self.stats.start()
+            rows = []
+            for record in records:
+                data = record.data.data
+                for predicate in predicates:
+                    if not predicate(data):
+                        break
+                else:
+                    rows.append(self.__row(decoder, names, record.data.record_number, data, table_number, memos))
+            self.stats.add('decode', start, rows_decoded=len(rows))
+            for row in rows:
+                yield row
+
+    def iter_all_tables(self, memos=True):
+        """
+        (table name, row) of all tables in a single pass over leaf pages: every DATA record is decoded by the
+        decoder of its table. DATA records of tables without definition are skipped.
+        """
+        # table_number -> (table name, decoder, names, memos), None if the table has no definition
+        tables = {}
+        for records in self.page_records(record_types=(DATA_TYPE,)):
+            start = self.stats.start()
+            rows = []
+            for record in records:
+                if record.type != 'DATA':
+                    continue
+                table_number = record.data.table_number
+                if table_number not in tables:
+                    try:
+                        decoder = self.get_decoder(table_number)
+                    except KeyError:
+                        warn('DATA records of table {} without definition are skipped'.format(table_number),
+                             RuntimeWarning)
+                        tables[table_number] = None
+                        continue
+                    table_memos = self.get_memos(table_number) if memos else ()
+                    tables[table_number] = (self.tables.get_name(table_number), decoder,
+                                            self.__names(decoder, table_memos), table_memos)
+                table = tables[table_number]
+                if table is not None:
+                    table_name, decoder, names, table_memos = table
+                    rows.append((table_name, self.__row(decoder, names, record.data.record_number, record.data.data,
+                                                        table_number, table_memos)))
+            self.stats.add('decode', start, rows_decoded=len(rows))
+            for row in rows:
+                yield row
+
+    def export_all(self, sink_factory, memos=True):
+        """
+        Export all tables in a single pass (see iter_all_tables)
+
+        sink_factory(table_name) is called once for every table and returns its sink, an object with
+        write(row) and optionally close(). Return row counts by table name.
+        """
+        sinks = {}
+        counts = {}
+        for table_number in self.tables.numbers():
+            table_name = self.tables.get_name(table_number)
+            sinks[table_name] = sink_factory(table_name)
+            counts[table_name] = 0
+        try:
+            for table_name, row in self.iter_all_tables(memos=memos):
+                if table_name not in sinks:
+                    sinks[table_name] = sink_factory(table_name)
+                    counts[table_name] = 0
+                sinks[table_name].write(row)
+                counts[table_name] += 1
+        finally:
+            for sink in sinks.values():
+                if hasattr(sink, 'close'):
+                    sink.close()
+        return counts
+
+    def iter_parallel(self, workers=None, chunk_size=64, ordered=True):
+        """
+        Rows of the current table, leaf pages are decoded by a pool of worker processes
+
+        Every worker gets a pickled copy of this TPS (the file is reopened with its own read-only mmap)
+        and decodes chunks of chunk_size leaf pages. Rows are yielded in page order if ordered is True,
+        else as soon as a chunk is decoded. At most 2 chunks per worker are in flight.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        memos = self.get_memos(self.current_table_number)
+        chunks = iter(chunked(self.leaf_page_refs(self.current_table_number, (DATA_TYPE,)), chunk_size))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self,)) as executor:
+            pending = deque()
+            for chunk in islice(chunks, 2 * workers):
+                pending.append(executor.submit(scan_pages, chunk, self.current_table_number))
+            while pending:
+                if ordered:
+                    done = pending.popleft()
+                else:
+                    done = next(as_completed(pending))
+                    pending.remove(done)
+                for chunk in islice(chunks, 1):
+                    pending.append(executor.submit(scan_pages, chunk, self.current_table_number))
+                for row in done.result():
+                    for number, memo in memos:
+                        row[memo.name] = TpsMemo(self, self.current_table_number, row[RECNO_FIELDNAME], number, memo)
+                    yield row
+
+    def to_numpy(self, columns=None, decode_strings=False):
+        """
+        Current table as NumPy structured array (requires numpy)
+
+        Raw records are collected into one contiguous buffer and decoded column-wise, see tpsnumpy.to_numpy.
+        """
+        from .tpsnumpy import records_to_raw, to_numpy
+
+        definition = self.tables.get_definition(self.current_table_number)
+        record_numbers, raw = records_to_raw(((record.data.record_number, record.data.data)
+                                              for record in self.__data_records(self.current_table_number)),
+                                             definition)
+        start = self.stats.start()
+        result = to_numpy(record_numbers, raw, definition, encoding=self.encoding,
+                          date_fieldname=self.date_fieldname, time_fieldname=self.time_fieldname,
+                          decode_strings=decode_strings, columns=columns)
+        self.stats.add('decode', start, rows_decoded=len(record_numbers))
+        return result
+
+    def to_pandas(self, columns=None, chunksize=None, categorical=(), table_number=None):
+        """
+        Table (current by default) as pandas DataFrame (requires pandas), or if chunksize is not None an
+        iterator of DataFrames of up to chunksize rows. Columns are typed (see tpspandas), categorical - names
+        of string columns to convert to category (True - all string columns).
+        """
+        if table_number is None:
+            table_number = self.current_table_number
+        dataframes = self.__iter_dataframes(table_number, columns, chunksize, categorical)
+        if chunksize is None:
+            return next(dataframes)
+        return dataframes
+
+    def __iter_dataframes(self, table_number, columns, chunksize, categorical):
+        from .tpsnumpy import records_to_raw
+        from .tpspandas import to_dataframe
+
+        definition = self.tables.get_definition(table_number)
+        records = ((record.data.record_number, record.data.data) for record in self.__data_records(table_number))
+        while True:
+            # all records if chunksize is None
+            batch = list(islice(records, chunksize))
+            if not batch and chunksize is not None:
+                break
+            record_numbers, raw = records_to_raw(batch, definition)
+            del batch
+            start = self.stats.start()
+            dataframe = to_dataframe(record_numbers, raw, definition, encoding=self.encoding,
+                                     date_fieldname=self.date_fieldname, time_fieldname=self.time_fieldname,
+                                     columns=columns, categorical=categorical)
+            self.stats.add('decode', start, rows_decoded=len(record_numbers))
+            yield dataframe
+            if chunksize is None:
+                break
+
+    def iter_record_batches(self, table_number=None, columns=None, batch_size=None, memos=True):
+        """
+        Table (current by default) as Arrow RecordBatches of up to batch_size rows (requires pyarrow),
+        only the columns if not None. MEMO and BLOB fields are read if memos is True.
+        See tpsarrow for the types.
+        """
+        from .tpsarrow import DEFAULT_BATCH_ROWS, arrow_schema, record_batch
+        from .tpsnumpy import records_to_raw
+
+        if table_number is None:
+            table_number = self.current_table_number
+        if batch_size is None:
+            batch_size = DEFAULT_BATCH_ROWS
+        definition = self.tables.get_definition(table_number)
+        table_memos = self.get_memos(table_number, columns) if memos else ()
+        schema = arrow_schema(definition, columns, table_memos, date_fieldname=self.date_fieldname,
+                              time_fieldname=self.time_fieldname)
+        records = ((record.data.record_number, record.data.data) for record in self.__data_records(table_number))
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            record_numbers, raw = records_to_raw(batch, definition)
+            del batch
+            start = self.stats.start()
+            memo_values = [[TpsMemo(self, table_number, record_number, number, memo).read()
+                            for record_number in record_numbers.tolist()]
+                           for number, memo in table_memos]
+            yield record_batch(record_numbers, raw, definition, schema, columns, encoding=self.encoding,
+                               memo_values=memo_values)
+            self.stats.add('decode', start, rows_decoded=len(record_numbers))
+
+    def arrow_schema(self, table_number=None, columns=None, memos=True):
+        """
+        Arrow schema of iter_record_batches (requires pyarrow)
+        """
+        from .tpsarrow import arrow_schema
+
+        if table_number is None:
+            table_number = self.current_table_number
+        return arrow_schema(self.tables.get_definition(table_number), columns,
+                            self.get_memos(table_number, columns) if memos else (),
+                            date_fieldname=self.date_fieldname, time_fieldname=self.time_fieldname)
+
+    def to_parquet(self, filename, table_number=None, columns=None, batch_size=None, memos=True,
+                   compression='snappy'):
+        """
+        Write the table (current by default) to Parquet file, a row group per record batch (see
+        iter_record_batches), only one batch is kept in memory. Return the number of rows.
+        """
+        import pyarrow.parquet as pq
+
+        count = 0
+        with pq.ParquetWriter(filename, self.arrow_schema(table_number, columns, memos),
+                              compression=compression) as writer:
+            for batch in self.iter_record_batches(table_number, columns, batch_size, memos):
+                writer.write_batch(batch)
+                count += batch.num_rows
+        return count
+
+    def to_sqlite(self, database, table_numbers=None, indexes=True, batch_size=None, transaction_rows=None):
+        """
+        Load the tables (all if None) into the SQLite database (filename or sqlite3 connection) in a single
+        pass, with the keys as indexes if indexes is True. See tpssqlite.load. Return row counts by table name.
+        """
+        import sqlite3
 
+        from .tpssqlite import DEFAULT_BATCH_SIZE, DEFAULT_TRANSACTION_ROWS, load
 
-        table_definition = self.tables.get_definition(self.current_table_number)
-        #print("n, table_definition", self.current_table_number, table_definition)
-        for page_ref in self.pages.list():
-            if self.pages[page_ref].hierarchy_level == 0:
-                for record in TpsRecordsList(self, self.pages[page_ref], encoding=self.encoding, check=self.check):
-                    if record.type == 'DATA' and record.data.table_number == self.current_table_number:
-                        #print(record, record.data, record.data.data)
-                        check_value('table_record_size', len(record.data.data), table_definition.record_size)
-                        # TODO convert name to string
-                        fields = {"b':RecNo'": record.data.record_number}
-                        for field in table_definition.record_table_definition_field:
-                            field_data = record.data.data[field.offset:field.offset + field.size]
-                            value = ''
-                            if field.type == 'BYTE':
-                                value = ('byte' / Int8ul).parse(field_data)
-                            elif field.type == 'SHORT':
-                                value = ('short' / Int16sl).parse(field_data)
-                            elif field.type == 'USHORT':
-                                value = ('ushort' / Int16ul).parse(field_data)
-                            elif field.type == 'DATE':
-                                value = self.to_date(field_data)
-                            elif field.type == 'TIME':
-                                value = self.to_time(field_data)
-                            elif field.type == 'LONG':
-                                #TODO
-                                if field.name.split(':')[1].lower() in self.date_fieldname:
-                                    if Int32sl('long').parse(field_data) == 0:
-                                        value = None
-                                    else:
-                                        value = date.fromordinal(657433 + Int32sl('long').parse(field_data))
-                                elif field.name.split(':')[1].lower() in self.time_fieldname:
-                                    s, ms = divmod(Int32sl('long').parse(field_data), 100)
-                                    value = str('{}.{:03d}'.format(time.strftime('%Y-%m-%d %H:%M:%S',
-                                                                                 time.gmtime(s)), ms))
-                                else:
-                                    value = ('long' / Int32sl).parse(field_data)
-                            elif field.type == 'ULONG':
-                                value = ('ulong' / Int32ul).parse(field_data)
-                            elif field.type == 'FLOAT':
-                                value = ('float' / Float32l).parse(field_data)
-                            elif field.type == 'DOUBLE':
-                                value = ('double' / Float64l).parse(field_data)
-                            elif field.type == 'DECIMAL':
-                                # TODO BCD
-                                if field_data[0] & 0xF0 == 0xF0:
-                                    sign = -1
-                                    field_data = bytearray(field_data)
-                                    field_data[0] &= 0x0F
-                                else:
-                                    sign = 1
-                                value = sign * int(hexlify(field_data)) / 10 ** field.decimal_count
-                            elif field.type == 'STRING':
-                                value = text_type(field_data, encoding=self.encoding).strip()
-                            elif field.type == 'CSTRING':
-                                value = text_type(field_data, encoding=self.encoding).strip()
-                            elif field.type == 'PSTRING':
-                                value = text_type(field_data[1:field_data[0] + 1], encoding=self.encoding).strip()
-                            else:
-                                # GROUP=0x16
-                                # raise ValueError
-                                #TODO
-                                pass
-
-                            fields[text_type(field.name)] = value
-                        # print(fields)
-                        yield fields
+        connection = sqlite3.connect(database) if not isinstance(database, sqlite3.Connection) else database
+        try:
+            return load(self, connection, table_numbers, indexes=indexes,
+                        batch_size=batch_size or DEFAULT_BATCH_SIZE,
+                        transaction_rows=transaction_rows or DEFAULT_TRANSACTION_ROWS)
+        finally:
+            if connection is not database:
+                connection.close()
 
     def set_current_table(self, tablename):
-        print("set_current_table for '"+tablename+"'...")
         self.current_table_number = self.tables.get_number(tablename)
-        print('set to', self.current_table_number)
-        print(self.tables)
+        logger.debug('Current table %s: %s', tablename, self.current_table_number)
 
     def to_date(self, value):
         value_date = DATE_STRUCT.parse(value)
@@ -209,7 +1006,7 @@ class TPS:
 
     def to_time(self, value):
         value_time = TIME_STRUCT.parse(value)
-        return time(value_time.hour, value_time.minute, value_time.second, value_time.centisecond * 10000)
+        return datetime_time(value_time.hour, value_time.minute, value_time.second, value_time.centisecond * 10000)
 
         # metadata
         # ?header
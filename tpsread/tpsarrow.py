@@ -0,0 +1,117 @@
+"""
+Apache Arrow export of TPS tables (requires pyarrow and numpy)
+
+Raw records of a batch are stacked and decoded column-wise (see tpsnumpy), then wrapped as Arrow arrays:
+numeric columns keep their width, DECIMAL becomes decimal128 with the field decimal_count (exact, built from
+the packed BCD digits), DATE and Clarion LONG dates become date32, TIME and Clarion LONG times time32[ms],
+strings are decoded with the TPS encoding.
+"""
+
+from decimal import Decimal
+
+import numpy as np
+import pyarrow as pa
+from six import text_type
+
+from .tpsdecoder import RECNO_FIELDNAME, field_shortname
+from .tpsnumpy import INT64_DIGITS, convert_clarion_date, convert_date, convert_string, convert_time, \
+    decimal_digits, decimal_ints, table_fields
+
+
+# Rows per record batch
+DEFAULT_BATCH_ROWS = 65536
+
+# Arrow type of the field by field type
+FIELD_ARROW_TYPE = {
+    'BYTE': pa.uint8(),
+    'SHORT': pa.int16(),
+    'USHORT': pa.uint16(),
+    'DATE': pa.date32(),
+    'TIME': pa.time32('ms'),
+    'LONG': pa.int32(),
+    'ULONG': pa.uint32(),
+    'FLOAT': pa.float32(),
+    'DOUBLE': pa.float64(),
+    'STRING': pa.string(),
+    'CSTRING': pa.string(),
+    'PSTRING': pa.string(),
+}
+
+
+def decimal_type(field):
+    # packed BCD, the first nibble is the sign
+    return pa.decimal128(min(field.size * 2 - 1, 38), field.decimal_count)
+
+
+def field_type(field, date_fieldname=(), time_fieldname=()):
+    if field.type == 'DECIMAL':
+        return decimal_type(field)
+    if field.type == 'LONG':
+        if field_shortname(field.name) in date_fieldname:
+            return pa.date32()
+        if field_shortname(field.name) in time_fieldname:
+            return pa.time32('ms')
+    return FIELD_ARROW_TYPE[field.type]
+
+
+def arrow_schema(definition, columns=None, memos=(), date_fieldname=(), time_fieldname=()):
+    """
+    Arrow schema of the table: record number, fields (see tpsnumpy.table_fields), memos
+    ((memo number, memo definition), MEMO as string, BLOB as binary)
+    """
+    schema_fields = [pa.field(RECNO_FIELDNAME, pa.uint32(), nullable=False)]
+    for field in table_fields(definition, columns):
+        schema_fields.append(pa.field(text_type(field.name), field_type(field, date_fieldname, time_fieldname)))
+    for number, memo in memos:
+        schema_fields.append(pa.field(text_type(memo.name),
+                                      pa.binary() if memo.flags.memo_type == 'BLOB' else pa.string()))
+    return pa.schema(schema_fields)
+
+
+def decimal_array(raw, arrow_type):
+    """
+    decimal128 array of packed BCD values (raw - uint8 array rows x field size)
+    """
+    nibbles, negative = decimal_digits(raw)
+    if nibbles.shape[1] > INT64_DIGITS:
+        # python ints, then Decimal values
+        return pa.array([Decimal(value).scaleb(-arrow_type.scale) for value in decimal_ints(nibbles, negative)],
+                        type=arrow_type)
+    weights = 10 ** np.arange(nibbles.shape[1] - 1, -1, -1, dtype='i8')
+    unscaled = np.where(negative, -1, 1) * (nibbles @ weights)
+    # little-endian 128-bit two's complement: low word, sign extended high word
+    words = np.empty((raw.shape[0], 2), dtype='<i8')
+    words[:, 0] = unscaled
+    words[:, 1] = unscaled >> 63
+    return pa.Array.from_buffers(arrow_type, raw.shape[0], [None, pa.py_buffer(words)])
+
+
+def field_array(field, column, arrow_type, encoding=None):
+    if field.type == 'DECIMAL':
+        return decimal_array(column, arrow_type)
+    if field.type == 'DATE':
+        return pa.array(convert_date(column), type=arrow_type, from_pandas=True)
+    if field.type == 'TIME':
+        return pa.array(convert_time(column).astype('i8').astype('i4'), type=arrow_type)
+    if field.type in ('STRING', 'CSTRING', 'PSTRING'):
+        return pa.array(convert_string(column, field.type, encoding or 'ascii'), type=arrow_type)
+    if arrow_type == pa.date32():
+        # Clarion date
+        return pa.array(convert_clarion_date(column), type=arrow_type, from_pandas=True)
+    if arrow_type == pa.time32('ms'):
+        # Clarion time, centiseconds
+        return pa.array((column.astype('i8') * 10).astype('i4'), type=arrow_type)
+    return pa.array(np.ascontiguousarray(column), type=arrow_type)
+
+
+def record_batch(record_numbers, raw, definition, schema, columns=None, encoding=None, memo_values=()):
+    """
+    RecordBatch of the schema (see arrow_schema) from the raw records (see tpsnumpy.records_to_raw),
+    memo_values - list of values for every memo of the schema
+    """
+    arrays = [pa.array(record_numbers, type=pa.uint32())]
+    for field in table_fields(definition, columns):
+        arrays.append(field_array(field, raw[text_type(field.name)], schema.field(len(arrays)).type, encoding))
+    for values in memo_values:
+        arrays.append(pa.array(values, type=schema.field(len(arrays)).type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
@@ -0,0 +1,222 @@
+"""
+Asyncio facade of TPS files
+
+Opening, page reads, decryption and decoding run in an executor, the event loop only gets decoded rows.
+Leaf pages are read in chunks of chunk_size pages by a producer task: up to prefetch chunks are decoded
+ahead while the consumer processes the current one, then the producer waits (backpressure), so a slow
+consumer holds at most prefetch chunks and no executor worker.
+
+With a thread executor (default: the loop executor) the TPS object is shared, so calls of one file are
+serialized (one chunk in flight per file, files are read concurrently). With a ProcessPoolExecutor every
+worker process opens its own copy of the file once (see read_pages).
+"""
+
+import asyncio
+import pickle
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from .tps import TPS, chunked
+from .tpscache import TpsPageCache
+from .tpsdecoder import RECNO_FIELDNAME
+from .tpsmemo import TpsMemo
+from .tpsrecord import DATA_TYPE
+
+
+DEFAULT_PREFETCH = 4
+
+DEFAULT_CHUNK_SIZE = 16
+
+# Max number of TPS files kept open by an executor worker process
+WORKER_FILES = 16
+
+
+def close_worker_file(key, tps):
+    tps.close()
+
+
+# TPS files of the executor worker process: AsyncTPS key -> TPS, closed when evicted
+worker_files = TpsPageCache(max_pages=WORKER_FILES, on_evict=close_worker_file)
+
+
+def read_pages(key, state, page_refs, table_number):
+    """
+    Rows of the leaf pages read by an executor worker process, None if the worker has not opened the file
+    and state (pickled TPS) is None
+    """
+    tps = worker_files.get(key)
+    if tps is None:
+        if state is None:
+            return None
+        tps = pickle.loads(state)
+        worker_files.put(key, tps)
+    # memo handles are added by the parent process
+    return list(tps.iter_pages(page_refs, table_number, memos=False))
+
+
+class AsyncTPS:
+    """
+    TPS file for asyncio (async for row in AsyncTPS or AsyncTPS.table(name))
+    """
+
+    def __init__(self, tps, executor=None, prefetch=DEFAULT_PREFETCH, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        tps - opened TPS file, executor - concurrent.futures executor (loop default executor if None),
+        prefetch - max number of chunks decoded ahead, chunk_size - leaf pages per executor call
+        """
+        if prefetch < 1:
+            raise ValueError('prefetch must be at least 1')
+        self.tps = tps
+        self.executor = executor
+        self.prefetch = prefetch
+        self.chunk_size = chunk_size
+        self.processes = isinstance(executor, ProcessPoolExecutor)
+        # serializes executor calls on the shared TPS object
+        self.__lock = asyncio.Lock()
+        # key and pickled TPS of worker processes
+        self.__key = uuid.uuid4().hex
+        self.__state = None
+
+    @classmethod
+    async def open(cls, filename, executor=None, prefetch=DEFAULT_PREFETCH, chunk_size=DEFAULT_CHUNK_SIZE,
+                   **kwargs):
+        """
+        Open the TPS file in a thread (kwargs - TPS arguments)
+        """
+        loop = asyncio.get_running_loop()
+        thread_executor = None if isinstance(executor, ProcessPoolExecutor) else executor
+        tps = await loop.run_in_executor(thread_executor, lambda: TPS(filename, **kwargs))
+        return cls(tps, executor=executor, prefetch=prefetch, chunk_size=chunk_size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # worker processes close their copies when they are evicted (WORKER_FILES)
+        self.tps.close()
+
+    async def run(self, function, *args):
+        """
+        Result of function(*args) that uses the TPS object, in a thread
+        """
+        loop = asyncio.get_running_loop()
+        thread_executor = None if self.processes else self.executor
+        async with self.__lock:
+            future = loop.run_in_executor(thread_executor, function, *args)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the call can not be cancelled, the TPS object is in use until it returns
+                await asyncio.wait([future])
+                raise
+
+    async def __read_pages(self, page_refs, table_number):
+        if not self.processes:
+            return await self.run(lambda: list(self.tps.iter_pages(page_refs, table_number, memos=False)))
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(self.executor, read_pages, self.__key, None, page_refs, table_number)
+        if rows is None:
+            if self.__state is None:
+                # pickled once, in a thread
+                self.__state = await self.run(pickle.dumps, self.tps)
+            rows = await loop.run_in_executor(self.executor, read_pages, self.__key, self.__state, page_refs,
+                                              table_number)
+        return rows
+
+    async def __produce(self, queue, table_number):
+        try:
+            page_refs = self.tps.leaf_page_refs(table_number, (DATA_TYPE,))
+            for chunk in chunked(page_refs, self.chunk_size):
+                rows = await self.__read_pages(chunk, table_number)
+                if rows:
+                    await queue.put(rows)
+        except Exception as error:
+            await queue.put(error)
+        else:
+            await queue.put(None)
+
+    async def batches(self, table_number=None, memos=True):
+        """
+        Rows of the table (current by default) in lists, one list per chunk of leaf pages. MEMO and BLOB
+        fields are TpsMemo handles if memos is True, read them with read_memo.
+        """
+        if table_number is None:
+            table_number = self.tps.current_table_number
+        table_memos = self.tps.get_memos(table_number) if memos else ()
+        queue = asyncio.Queue(maxsize=self.prefetch)
+        producer = asyncio.ensure_future(self.__produce(queue, table_number))
+        try:
+            while True:
+                rows = await queue.get()
+                if rows is None:
+                    break
+                if isinstance(rows, Exception):
+                    raise rows
+                for row in rows:
+                    for number, memo in table_memos:
+                        row[memo.name] = TpsMemo(self.tps, table_number, row[RECNO_FIELDNAME], number, memo)
+                yield rows
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+    async def rows(self, table_number=None, memos=True):
+        """
+        Rows of the table (current by default), see batches
+        """
+        async for rows in self.batches(table_number, memos):
+            for row in rows:
+                yield row
+
+    def __aiter__(self):
+        return self.rows()
+
+    def table(self, name=None):
+        """
+        Table by name (current if None)
+        """
+        if name is None:
+            return AsyncTpsTable(self, self.tps.current_table_number)
+        return AsyncTpsTable(self, self.tps.tables.get_number(name))
+
+    async def read_memo(self, memo):
+        """
+        BLOB bytes or MEMO text of the TpsMemo handle
+        """
+        return await self.run(memo.read)
+
+    async def get(self, record_number, table_number=None):
+        """
+        Row by record number, see TPS.get
+        """
+        return await self.run(self.tps.get, record_number, table_number)
+
+
+class AsyncTpsTable:
+    """
+    Table of AsyncTPS (async for row in table)
+    """
+
+    def __init__(self, async_tps, number):
+        self.async_tps = async_tps
+        self.number = number
+        self.name = async_tps.tps.tables.get_name(number)
+
+    @property
+    def schema(self):
+        return self.async_tps.tps.schema(self.number)
+
+    def batches(self, memos=True):
+        return self.async_tps.batches(self.number, memos)
+
+    def rows(self, memos=True):
+        return self.async_tps.rows(self.number, memos)
+
+    def __aiter__(self):
+        return self.rows()
+
+    async def get(self, record_number):
+        return await self.async_tps.get(record_number, self.number)
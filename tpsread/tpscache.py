@@ -0,0 +1,90 @@
+"""
+Page cache of TPS file
+
+Least recently used pages are evicted when the cache is over its budget of pages or bytes. TPS keeps two
+caches: split page data (buffer and record positions, cheap to keep) and parsed records (TpsRecord objects).
+Any object with the same get / put interface may be used instead (TPS page_cache and records_cache).
+"""
+
+from collections import OrderedDict
+
+
+# Default budget of the split page data cache
+DEFAULT_PAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Default budget of the parsed records cache: disabled. A scan of more leaf pages than the budget evicts every
+# page before it is read again, and rows are decoded as fast from the split page data (page cache); get and
+# lookup read raw records of the page cache only. A budget of the leaf pages of a table speeds up repeated
+# scans of it (see benchmarks.scan).
+DEFAULT_RECORDS_CACHE_PAGES = 0
+
+
+class TpsPageCache:
+    """
+    LRU cache by page ref, max_pages and max_bytes budgets (None - unbounded, 0 - cache is disabled),
+    on_evict(ref, value) is called for every evicted value (e.g. to close it)
+    """
+
+    def __init__(self, max_pages=None, max_bytes=None, on_evict=None):
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        # page ref -> (value, size in bytes)
+        self.__entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # cached pages (and on_evict) are not pickled, only the budget
+        return {'max_pages': self.max_pages, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_pages'], state['max_bytes'])
+
+    def get(self, ref, default=None):
+        entry = self.__entries.get(ref)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.__entries.move_to_end(ref)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, ref, value, size=0):
+        if self.max_pages == 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        if ref in self.__entries:
+            self.size -= self.__entries.pop(ref)[1]
+        self.__entries[ref] = (value, size)
+        self.size += size
+        while (self.max_pages is not None and len(self.__entries) > self.max_pages) or \
+                (self.max_bytes is not None and self.size > self.max_bytes):
+            evicted_ref, (evicted_value, evicted_size) = self.__entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted_ref, evicted_value)
+
+    def discard(self, ref):
+        entry = self.__entries.pop(ref, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def __contains__(self, ref):
+        return ref in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        self.__entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'pages': len(self.__entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
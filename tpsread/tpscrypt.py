@@ -1,14 +1,29 @@
 """
 Cryptographic Module for TPS File
+
+Data is encrypted by 64 bytes blocks (16 little-endian uint32). With numpy installed all blocks of a read
+are decrypted at once, each of 16 key rounds being applied column-wise to a (blocks, 16) uint32 array.
 """
 
-from construct import Array, GreedyRange, ULInt32
+import mmap
+import struct
+import tempfile
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-class TpsDecryptor:
 
-    CHUNK_DATA_STRUCT = Array(16, ULInt32('data'))
-    DATA_STRUCT = GreedyRange(CHUNK_DATA_STRUCT)
+BLOCK_SIZE = 0x40
+
+BLOCK_STRUCT = struct.Struct('<16L')
+
+# Size of the portion decrypted at once by decrypt_file
+DECRYPT_FILE_CHUNK_SIZE = 0x100000
+
+
+class TpsDecryptor:
 
     def __init__(self, file, password, encoding='utf-8'):
         self.file = file
@@ -24,7 +39,7 @@ class TpsDecryptor:
             for i in range(64):
                 byte_keys[(i * 0x11) & 0x3F] = (i + self.password[(i + 1) % len(self.password)]) & 0xFF
 
-            self.keys = self.CHUNK_DATA_STRUCT.parse(bytes(byte_keys))
+            self.keys = list(BLOCK_STRUCT.unpack(bytes(byte_keys)))
 
             for i in range(2):
                 for pos_a in range(16):
@@ -34,34 +49,92 @@ class TpsDecryptor:
                     self.keys[pos_b] = (data_a + (data_a & data_b)) & 0xFFFFFFFF
                     self.keys[pos_a] = ((data_a | data_b) + data_a) & 0xFFFFFFFF
 
+            # (pos_a, pos_b, key, ~key) of the decryption rounds
+            self.rounds = []
+            for i in range(16):
+                pos_a = 15 - i
+                key = self.keys[pos_a]
+                self.rounds.append((pos_a, key & 0x0F, key, ~key & 0xFFFFFFFF))
+
+    def decrypt_blocks(self, data):
+        """
+        Decrypt whole 64 bytes blocks
+        """
+        if np is not None:
+            blocks = np.frombuffer(data, dtype='<u4').reshape(-1, 16).copy()
+            for pos_a, pos_b, key, not_key in self.rounds:
+                key = np.uint32(key)
+                not_key = np.uint32(not_key)
+                data_a = blocks[:, pos_a] - key
+                data_b = blocks[:, pos_b] - key
+                blocks[:, pos_a] = (data_a & key) | (data_b & not_key)
+                blocks[:, pos_b] = (data_b & key) | (data_a & not_key)
+            return blocks.tobytes()
+
+        result = bytearray(len(data))
+        for offset in range(0, len(data), BLOCK_SIZE):
+            block = list(BLOCK_STRUCT.unpack_from(data, offset))
+            for pos_a, pos_b, key, not_key in self.rounds:
+                data_a = block[pos_a] - key
+                data_b = block[pos_b] - key
+                block[pos_a] = ((data_a & key) | (data_b & not_key)) & 0xFFFFFFFF
+                block[pos_b] = ((data_b & key) | (data_a & not_key)) & 0xFFFFFFFF
+            BLOCK_STRUCT.pack_into(result, offset, *block)
+        return bytes(result)
+
+    def encrypt_blocks(self, data):
+        """
+        Encrypt whole 64 bytes blocks (inverse of decrypt_blocks)
+        """
+        result = bytearray(len(data))
+        for offset in range(0, len(data), BLOCK_SIZE):
+            block = list(BLOCK_STRUCT.unpack_from(data, offset))
+            for pos_a, pos_b, key, not_key in reversed(self.rounds):
+                data_a = (block[pos_a] & key) | (block[pos_b] & not_key)
+                data_b = (block[pos_b] & key) | (block[pos_a] & not_key)
+                block[pos_a] = (data_a + key) & 0xFFFFFFFF
+                block[pos_b] = (data_b + key) & 0xFFFFFFFF
+            BLOCK_STRUCT.pack_into(result, offset, *block)
+        return bytes(result)
+
     def decrypt(self, size, pos=None):
         if pos is None:
             pos = self.file.tell()
         align_start_pos = pos & 0xFFFFFFC0
         self.file.seek(align_start_pos)
         align_end_pos = ((size + pos - 1) | 0x3F) + 1
-        result = self.DATA_STRUCT.parse(self.file.read(align_end_pos - align_start_pos))
-        for chunk_number in range(len(result)):
-            for i in range(16):
-                pos_a = 15 - i
-                key = self.keys[pos_a]
-                pos_b = key & 0x0F
-
-                data_a = result[chunk_number][pos_a]
-                data_a = data_a - key
-
-                data_b = result[chunk_number][pos_b]
-                data_b = data_b - key
-
-                result[chunk_number][pos_a] = ((data_a & key) | (data_b & ~key)) & 0xFFFFFFFF
-                result[chunk_number][pos_b] = ((data_b & key) | (data_a & ~key)) & 0xFFFFFFFF
-
+        data = self.file.read(align_end_pos - align_start_pos)
+        data = self.decrypt_blocks(data[:len(data) & ~0x3F])
         self.file.seek(pos + size)
-        return self.DATA_STRUCT.build(result)[pos - align_start_pos:pos - align_start_pos + size]
-
-    def encrypt(self, size, pos=None):
-        # TODO
-        pass
+        return data[pos - align_start_pos:pos - align_start_pos + size]
+
+    def encrypt(self, data):
+        # Trailing partial block is kept as is
+        align_size = len(data) & ~0x3F
+        return self.encrypt_blocks(data[:align_size]) + data[align_size:]
+
+    def decrypt_file(self, in_memory=True):
+        """
+        Decrypt the whole file once, return mmap of decrypted data (anonymous memory or temporary file)
+        """
+        self.file.seek(0)
+        size = len(self.file)
+        if in_memory:
+            result = mmap.mmap(-1, max(size, 1))
+        else:
+            temp_file = tempfile.TemporaryFile()
+            temp_file.truncate(max(size, 1))
+            result = mmap.mmap(temp_file.fileno(), 0)
+            # mmap keeps its own handle on the file
+            temp_file.close()
+        for pos in range(0, size, DECRYPT_FILE_CHUNK_SIZE):
+            data = self.file[pos:pos + DECRYPT_FILE_CHUNK_SIZE]
+            align_size = len(data) & ~0x3F
+            result[pos:pos + align_size] = self.decrypt_blocks(data[:align_size])
+            # Trailing partial block is kept as is
+            result[pos + align_size:pos + len(data)] = data[align_size:]
+        result.seek(0)
+        return result
 
     def is_encrypted(self):
         return self.password is not None
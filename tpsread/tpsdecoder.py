@@ -0,0 +1,273 @@
+"""
+Compiled decoder of TPS table records
+
+The table definition is turned once into a single struct.Struct layout and a short list of
+converters (DATE, TIME, DECIMAL, strings...), so every DATA record is unpacked in one call.
+"""
+
+import operator
+import struct
+import time
+from binascii import hexlify
+from datetime import date, time as datetime_time
+
+from six import text_type
+
+
+# Clarion standard date: day #1 is 28.12.1800
+CLARION_DATE_ORDINAL = 657433
+
+# TODO convert name to string
+RECNO_FIELDNAME = "b':RecNo'"
+
+# struct format of the (first element of the) field by field type
+FIELD_FORMAT = {
+    'BYTE': 'B',
+    'SHORT': 'h',
+    'USHORT': 'H',
+    # date format 0xYYYYMMDD
+    'DATE': 'I',
+    # time format 0xHHMMSSHS
+    'TIME': 'I',
+    'LONG': 'i',
+    'ULONG': 'I',
+    'FLOAT': 'f',
+    'DOUBLE': 'd',
+}
+
+STRING_TYPES = ('DECIMAL', 'STRING', 'CSTRING', 'PSTRING')
+
+# Predicate operators (TPS.scan where)
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda value, values: value in values,
+    'not in': lambda value, values: value not in values,
+}
+
+
+def field_shortname(name):
+    """Field name without table prefix ('TST:FIELD' -> 'field')"""
+    return name.split(':', 1)[-1].lower()
+
+
+def find_field(fields, name):
+    """Field by full name ('TST:FIELD') or by name without table prefix (case insensitive)"""
+    for field in fields:
+        if text_type(field.name) == name:
+            return field
+    for field in fields:
+        if field_shortname(field.name) == field_shortname(name):
+            return field
+    raise KeyError(name)
+
+
+def to_date(value):
+    if value >> 16 == 0:
+        return None
+    else:
+        return date(value >> 16, (value >> 8) & 0xFF, value & 0xFF)
+
+
+def to_time(value):
+    return datetime_time(value >> 24, (value >> 16) & 0xFF, (value >> 8) & 0xFF, (value & 0xFF) * 10000)
+
+
+def to_clarion_date(value):
+    if value == 0:
+        return None
+    else:
+        return date.fromordinal(CLARION_DATE_ORDINAL + value)
+
+
+def to_clarion_time(value):
+    s, ms = divmod(value, 100)
+    return str('{}.{:03d}'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(s)), ms))
+
+
+def decimal_converter(decimal_count):
+    divider = 10 ** decimal_count
+
+    def to_decimal(value):
+        # TODO BCD
+        if value[0] & 0xF0 == 0xF0:
+            return -int(hexlify(bytes((value[0] & 0x0F,)) + value[1:])) / divider
+        else:
+            return int(hexlify(value)) / divider
+    return to_decimal
+
+
+def string_converter(field_type, encoding):
+    if field_type == 'CSTRING':
+        return lambda value: value.split(b'\x00', 1)[0].decode(encoding).strip()
+    elif field_type == 'PSTRING':
+        return lambda value: value[1:value[0] + 1].decode(encoding).strip()
+    else:
+        return lambda value: value.decode(encoding).strip()
+
+
+class TpsRecordDecoder:
+    """
+    Record decoder compiled from a table definition
+    """
+
+    def __init__(self, definition, encoding=None, date_fieldname=(), time_fieldname=(), columns=None):
+        self.definition = definition
+        self.encoding = encoding
+        self.record_size = definition.record_size
+
+        fields = list(definition.record_table_definition_field)
+        if columns is not None:
+            fields = [find_field(fields, column) for column in columns]
+        self.fields = fields
+        self.names = [text_type(field.name) for field in fields]
+
+        # (offset, struct format, field position) of every field that has a struct representation
+        layout = []
+        # constant values (GROUP...) by field position
+        self.__constants = []
+        for i, field in enumerate(fields):
+            if field.type in FIELD_FORMAT:
+                layout.append((field.offset, FIELD_FORMAT[field.type], i))
+            elif field.type in STRING_TYPES:
+                layout.append((field.offset, '{}s'.format(field.size), i))
+            else:
+                # GROUP=0x16
+                # TODO
+                self.__constants.append((i, ''))
+        layout.sort()
+
+        # Main layout: fields that do not overlap, ordered by offset
+        record_format = '<'
+        position = 0
+        order = []
+        # Fields declared OVER other fields are unpacked on their own
+        self.__overlapped = []
+        for offset, field_format, i in layout:
+            if offset >= position:
+                if offset > position:
+                    record_format += '{}x'.format(offset - position)
+                record_format += field_format
+                position = offset + struct.calcsize('<' + field_format)
+                order.append(i)
+            else:
+                self.__overlapped.append((i, struct.Struct('<' + field_format), offset))
+        self.__struct = struct.Struct(record_format)
+        self.__order = order
+        self.__size = max(position, max([offset + s.size for i, s, offset in self.__overlapped] or [0]))
+
+        self.__converters = []
+        for i, field in enumerate(fields):
+            converter = None
+            if field.type == 'DATE':
+                converter = to_date
+            elif field.type == 'TIME':
+                converter = to_time
+            elif field.type == 'LONG':
+                # TODO
+                if field_shortname(field.name) in date_fieldname:
+                    converter = to_clarion_date
+                elif field_shortname(field.name) in time_fieldname:
+                    converter = to_clarion_time
+            elif field.type == 'DECIMAL':
+                converter = decimal_converter(field.decimal_count)
+            elif field.type in ('STRING', 'CSTRING', 'PSTRING'):
+                converter = string_converter(field.type, self.encoding)
+            if converter is not None:
+                self.__converters.append((i, converter))
+
+        # Values come out of the struct in field order: no reordering needed
+        self.__in_order = order == list(range(len(fields))) and not self.__overlapped and not self.__constants
+
+    @property
+    def struct(self):
+        return self.__struct
+
+    def decode(self, data):
+        """
+        Decode raw record data (record.data.data) to the list of field values
+        """
+        if len(data) < self.__size:
+            data = bytes(data) + b'\x00' * (self.__size - len(data))
+        raw = self.__struct.unpack_from(data)
+        if self.__in_order:
+            values = list(raw)
+        else:
+            values = [None] * len(self.fields)
+            for i, value in zip(self.__order, raw):
+                values[i] = value
+            for i, field_struct, offset in self.__overlapped:
+                values[i] = field_struct.unpack_from(data, offset)[0]
+            for i, value in self.__constants:
+                values[i] = value
+        for i, converter in self.__converters:
+            values[i] = converter(values[i])
+        return values
+
+
+def raw_value(field, value, date_fieldname=(), time_fieldname=()):
+    """
+    Value as stored in the record (what struct unpacks) for numeric, DATE and TIME fields,
+    None if the field has to be converted to compare (strings, DECIMAL, Clarion time)
+    """
+    if field.type == 'DATE':
+        return 0 if value is None else (value.year << 16) | (value.month << 8) | value.day
+    elif field.type == 'TIME':
+        return (value.hour << 24) | (value.minute << 16) | (value.second << 8) | (value.microsecond // 10000)
+    elif field.type == 'LONG' and field_shortname(field.name) in date_fieldname:
+        return 0 if value is None else value.toordinal() - CLARION_DATE_ORDINAL
+    elif field.type == 'LONG' and field_shortname(field.name) in time_fieldname:
+        return None
+    elif field.type in FIELD_FORMAT:
+        return value
+    else:
+        return None
+
+
+def field_predicate(field, operator_name, value, encoding=None, date_fieldname=(), time_fieldname=()):
+    """
+    Function of raw record data: field value (operator) value
+
+    Numeric, DATE and TIME fields are unpacked at the field offset and compared with the value converted once
+    to the stored form; strings, DECIMAL and Clarion time fields are compared after converting this field only.
+    """
+    if operator_name not in OPERATORS:
+        raise ValueError('Unknown operator {}'.format(operator_name))
+    compare = OPERATORS[operator_name]
+    offset = field.offset
+    if operator_name in ('in', 'not in'):
+        values = list(value)
+    else:
+        values = [value]
+
+    if field.type in FIELD_FORMAT:
+        field_struct = struct.Struct('<' + FIELD_FORMAT[field.type])
+        raw_values = [raw_value(field, value, date_fieldname, time_fieldname) for value in values]
+        if None not in raw_values:
+            if operator_name in ('in', 'not in'):
+                raw_values = frozenset(raw_values)
+            else:
+                raw_values = raw_values[0]
+            return lambda data: compare(field_struct.unpack_from(data, offset)[0], raw_values)
+        # Clarion time
+        converter = to_clarion_time
+        unpack = lambda data: converter(field_struct.unpack_from(data, offset)[0])
+    elif field.type == 'DECIMAL':
+        converter = decimal_converter(field.decimal_count)
+        size = field.size
+        unpack = lambda data: converter(bytes(data[offset:offset + size]))
+    elif field.type in ('STRING', 'CSTRING', 'PSTRING'):
+        converter = string_converter(field.type, encoding)
+        size = field.size
+        unpack = lambda data: converter(bytes(data[offset:offset + size]))
+    else:
+        raise ValueError('Field {} of type {} can not be compared'.format(field.name, field.type))
+    if operator_name in ('in', 'not in'):
+        values = frozenset(values)
+    else:
+        values = values[0]
+    return lambda data: compare(unpack(data), values)
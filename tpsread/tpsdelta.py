@@ -0,0 +1,147 @@
+"""
+Incremental change detection between two snapshots of a TPS file
+
+A snapshot keeps the header change_count and last_issued_row, and for every leaf page a fingerprint
+(hash of the page data) with (table_number, record_number, crc32 of data) of its DATA records. Pages are
+matched by fingerprint, not by ref, so moved pages are not changed. Only the records of pages whose
+fingerprint is not in the other snapshot are compared: a record can not leave or enter an unchanged page.
+"""
+
+import base64
+import json
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+from .tpspage import PAGE_HEADER, page_data_hash
+from .tpsrecord import DATA_RECORD_HEADER_STRUCT, DATA_TYPE, TABLE_NAME_TYPE, TpsRecordsList
+
+
+SNAPSHOT_VERSION = 1
+
+# table_number, record_number, crc32 of record data
+RECORD_FINGERPRINT_STRUCT = struct.Struct('>LLL')
+
+
+class TpsChanges(namedtuple('TpsChanges', ['snapshot', 'changed_pages', 'inserted', 'updated', 'deleted'])):
+    """
+    Changes since the previous snapshot: the current snapshot, refs of changed leaf pages, and record numbers
+    inserted, updated and deleted by table number ({table_number: sorted list})
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+class TpsSnapshot:
+    """
+    Fingerprints of the leaf pages: page hash -> packed RECORD_FINGERPRINT_STRUCT of its DATA records
+    """
+
+    def __init__(self, change_count, last_issued_row, file_size, pages):
+        self.change_count = change_count
+        self.last_issued_row = last_issued_row
+        self.file_size = file_size
+        self.pages = pages
+
+    def records(self, page_hashes):
+        """
+        {(table_number, record_number): crc32} of DATA records of the pages
+        """
+        records = {}
+        for page_hash in page_hashes:
+            for table_number, record_number, crc in RECORD_FINGERPRINT_STRUCT.iter_unpack(self.pages[page_hash]):
+                records[(table_number, record_number)] = crc
+        return records
+
+    def state(self):
+        return {'version': SNAPSHOT_VERSION,
+                'change_count': self.change_count,
+                'last_issued_row': self.last_issued_row,
+                'file_size': self.file_size,
+                'pages': dict((page_hash, base64.b64encode(records).decode('ascii'))
+                              for page_hash, records in self.pages.items())}
+
+    def save(self, filename):
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as snapshot_file:
+            json.dump(self.state(), snapshot_file, separators=(',', ':'))
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as snapshot_file:
+            state = json.load(snapshot_file)
+        if state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported snapshot version {}'.format(state.get('version')))
+        return cls(state['change_count'], state['last_issued_row'], state['file_size'],
+                   dict((page_hash, base64.b64decode(records)) for page_hash, records in state['pages'].items()))
+
+
+def page_hash(tps, page):
+    # page data without the header (the header has the page offset)
+    data = tps.read(page.size - PAGE_HEADER.size, page.ref * 0x100 + tps.header.size + PAGE_HEADER.size)
+    return page_data_hash(data)
+
+
+def page_fingerprints(tps, page):
+    fingerprints = bytearray()
+    for record in TpsRecordsList(tps, page, encoding=tps.encoding).raw_records():
+        if len(record) >= DATA_RECORD_HEADER_STRUCT.size and record[0] != TABLE_NAME_TYPE and \
+                record[4] == DATA_TYPE:
+            table_number, record_type, record_number = DATA_RECORD_HEADER_STRUCT.unpack_from(record)
+            fingerprints += RECORD_FINGERPRINT_STRUCT.pack(table_number, record_number,
+                                                           zlib.crc32(record[DATA_RECORD_HEADER_STRUCT.size:]))
+    return bytes(fingerprints)
+
+
+def snapshot(tps, previous=None):
+    """
+    Snapshot of the TPS file and refs of leaf pages not in the previous snapshot (records of the pages
+    of the previous snapshot are not read again)
+    """
+    pages = {}
+    changed_pages = []
+    for page_ref in tps.pages.leaf_refs():
+        page = tps.pages[page_ref]
+        current_hash = page_hash(tps, page)
+        if previous is not None and current_hash in previous.pages:
+            pages[current_hash] = previous.pages[current_hash]
+        else:
+            pages[current_hash] = page_fingerprints(tps, page)
+            changed_pages.append(page_ref)
+    return TpsSnapshot(tps.header.change_count, tps.header.last_issued_row, tps.file_size, pages), changed_pages
+
+
+def is_unchanged(tps, previous):
+    return previous.change_count == tps.header.change_count and \
+        previous.last_issued_row == tps.header.last_issued_row and previous.file_size == tps.file_size
+
+
+def changes(tps, previous):
+    """
+    Changes of the TPS file since the previous snapshot (TpsChanges)
+    """
+    if is_unchanged(tps, previous):
+        return TpsChanges(previous, [], {}, {}, {})
+    current, changed_pages = snapshot(tps, previous)
+    old_records = previous.records(page_hash for page_hash in previous.pages if page_hash not in current.pages)
+    new_records = current.records(page_hash for page_hash in current.pages if page_hash not in previous.pages)
+
+    inserted = {}
+    updated = {}
+    deleted = {}
+    for key, crc in new_records.items():
+        if key not in old_records:
+            inserted.setdefault(key[0], []).append(key[1])
+        elif old_records[key] != crc:
+            updated.setdefault(key[0], []).append(key[1])
+    for key in old_records:
+        if key not in new_records:
+            deleted.setdefault(key[0], []).append(key[1])
+    for record_numbers in (inserted, updated, deleted):
+        for table_number in record_numbers:
+            record_numbers[table_number].sort()
+    return TpsChanges(current, changed_pages, inserted, updated, deleted)
@@ -0,0 +1,118 @@
+"""
+Export of all tables of a TPS file to CSV, JSON Lines, SQLite or Parquet (requires pyarrow)
+
+Rows are written as they are decoded (TPS.export_all), at most batch_size rows are buffered by a sink.
+MEMO and BLOB fields are read, BLOB bytes are base64 encoded in CSV and JSON Lines. Parquet files are
+written table by table from Arrow record batches (TPS.to_parquet), SQLite databases by the bulk loader
+(TPS.to_sqlite).
+"""
+
+import base64
+import csv
+import json
+import os
+import os.path
+import re
+from datetime import date, time
+
+from .tpsmemo import TpsMemo
+
+
+FORMATS = ('csv', 'jsonl', 'sqlite', 'parquet')
+
+# Rows per CSV / JSON Lines write, executemany, Parquet row group (record batch)
+DEFAULT_BATCH_SIZE = 10000
+
+
+def table_filename(table_name):
+    # table name as file name
+    return re.sub(r'[^\w.-]', '_', table_name) or 'table'
+
+
+def plain_value(value):
+    """
+    Value for text formats: memo data, base64 of bytes, ISO format of date and time
+    """
+    if isinstance(value, TpsMemo):
+        value = value.read()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+class CsvSink:
+    def __init__(self, filename, batch_size=DEFAULT_BATCH_SIZE):
+        self.file = open(filename, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.batch_size = batch_size
+        self.batch = []
+        self.names = None
+
+    def write(self, row):
+        if self.names is None:
+            self.names = list(row)
+            self.writer.writerow(self.names)
+        self.batch.append([plain_value(row[name]) for name in self.names])
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.batch)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class JsonLinesSink:
+    def __init__(self, filename, batch_size=DEFAULT_BATCH_SIZE):
+        self.file = open(filename, 'w', encoding='utf-8')
+        self.batch_size = batch_size
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(json.dumps(row, default=plain_value, ensure_ascii=False))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.file.write('\n'.join(self.batch))
+            self.file.write('\n')
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def export_file(tps, output_format, output_path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Export all tables of the TPS file (in a single pass except Parquet). 'csv', 'jsonl', 'parquet': output_path
+    is a directory with a file per table, 'sqlite': output_path is a database with a table per TPS table.
+    Return row counts by table name.
+    """
+    if output_format not in FORMATS:
+        raise ValueError('Unknown format {!r}'.format(output_format))
+    if output_format == 'sqlite':
+        return tps.to_sqlite(output_path, batch_size=batch_size)
+
+    os.makedirs(output_path, exist_ok=True)
+    if output_format == 'parquet':
+        counts = {}
+        for table_number in tps.tables.numbers():
+            table_name = tps.tables.get_name(table_number)
+            filename = os.path.join(output_path, '{}.parquet'.format(table_filename(table_name)))
+            counts[table_name] = tps.to_parquet(filename, table_number, batch_size=batch_size)
+        return counts
+
+    def sink_factory(table_name):
+        filename = os.path.join(output_path, '{}.{}'.format(table_filename(table_name), output_format))
+        if output_format == 'csv':
+            return CsvSink(filename, batch_size)
+        return JsonLinesSink(filename, batch_size)
+
+    return tps.export_all(sink_factory)
@@ -0,0 +1,188 @@
+"""
+Keys (indexes) of TPS tables
+
+Index records are sorted by their raw bytes: table_number, index number, key fields, record_number
+(big-endian). Key fields are stored so that bytes compare as values: numbers big-endian with the sign bit
+flipped, floats in the IEEE sortable form, strings padded to the field size (upper case for NOCASE keys),
+all bytes inverted for DESCENDING fields. DECIMAL fields are kept as BCD (best effort).
+"""
+
+import struct
+from datetime import date, time as datetime_time
+
+from six import text_type
+
+from .tpsdecoder import FIELD_FORMAT, decimal_converter, field_shortname, string_converter, to_date, to_time
+from .tpsrecord import INDEX_RECORD_HEADER_STRUCT
+
+
+SIGNED_TYPES = ('SHORT', 'LONG')
+FLOAT_TYPES = ('FLOAT', 'DOUBLE')
+
+
+def invert(data):
+    return bytes(byte ^ 0xFF for byte in data)
+
+
+class TpsKeyField:
+    """
+    Key field: encoding of a value to key bytes and back
+    """
+
+    def __init__(self, field, descending=False, nocase=False, encoding=None):
+        self.field = field
+        self.name = text_type(field.name)
+        self.type = field.type
+        self.size = field.size
+        self.descending = descending
+        self.nocase = nocase
+        self.encoding = encoding
+        if self.type in FIELD_FORMAT:
+            self.struct = struct.Struct('>' + FIELD_FORMAT[self.type])
+            self.size = self.struct.size
+        else:
+            self.struct = None
+        if self.type == 'DECIMAL':
+            self.__converter = decimal_converter(field.decimal_count)
+        elif self.type in ('STRING', 'CSTRING', 'PSTRING'):
+            self.__converter = string_converter(self.type, encoding)
+        else:
+            self.__converter = None
+
+    def encode(self, value):
+        if isinstance(value, bytes):
+            # raw key bytes
+            data = value
+        elif self.struct is not None:
+            if isinstance(value, date):
+                value = (value.year << 16) | (value.month << 8) | value.day
+            elif isinstance(value, datetime_time):
+                value = (value.hour << 24) | (value.minute << 16) | (value.second << 8) | \
+                        (value.microsecond // 10000)
+            data = bytearray(self.struct.pack(value))
+            if self.type in SIGNED_TYPES:
+                data[0] ^= 0x80
+            elif self.type in FLOAT_TYPES:
+                if data[0] & 0x80:
+                    data = bytearray(invert(data))
+                else:
+                    data[0] ^= 0x80
+            data = bytes(data)
+        elif self.type == 'DECIMAL':
+            digits = '{:0{}d}'.format(abs(int(round(value * 10 ** self.field.decimal_count))), self.size * 2)
+            data = bytearray.fromhex(digits[-self.size * 2:])
+            if value < 0:
+                data[0] |= 0xF0
+            data = bytes(data)
+        elif self.type in ('STRING', 'CSTRING', 'PSTRING'):
+            data = value.upper() if self.nocase else value
+            data = data.encode(self.encoding)
+            if self.type == 'STRING':
+                data = data.ljust(self.size, b' ')
+            elif self.type == 'PSTRING':
+                data = bytes((len(data),)) + data
+            data = data.ljust(self.size, b'\x00')[:self.size]
+        else:
+            raise ValueError('Key field {} of type {} needs raw bytes value'.format(self.name, self.type))
+        if self.descending:
+            data = invert(data)
+        return data
+
+    def decode(self, data):
+        data = bytes(data)
+        if self.descending:
+            data = invert(data)
+        if self.struct is not None:
+            data = bytearray(data)
+            if self.type in SIGNED_TYPES:
+                data[0] ^= 0x80
+            elif self.type in FLOAT_TYPES:
+                if data[0] & 0x80:
+                    data[0] ^= 0x80
+                else:
+                    data = bytearray(invert(data))
+            value = self.struct.unpack(bytes(data))[0]
+            if self.type == 'DATE':
+                return to_date(value)
+            elif self.type == 'TIME':
+                return to_time(value)
+            return value
+        elif self.__converter is not None:
+            return self.__converter(data)
+        else:
+            return data
+
+
+class TpsKey:
+    """
+    Key (index) of a table, from the table definition (record_table_definition_index)
+    """
+
+    def __init__(self, table_number, number, definition, encoding=None):
+        index = definition.record_table_definition_index[number]
+        fields = definition.record_table_definition_field
+        self.table_number = table_number
+        self.number = number
+        self.name = text_type(index.name)
+        self.type = index.flags.type
+        self.nocase = index.flags.NOCASE
+        self.dup = index.flags.DUP
+        self.fields = [TpsKeyField(fields[index_field.field_number],
+                                   descending=index_field.field_order_type == 'DESCENDING',
+                                   nocase=self.nocase, encoding=encoding)
+                       for index_field in index.index_field_propertly]
+        self.names = [field.name for field in self.fields]
+        self.size = sum(field.size for field in self.fields)
+
+    def prefix(self, values=None):
+        """
+        Index records prefix for the values of the first key fields (scalar or tuple, all records if None)
+        """
+        prefix = INDEX_RECORD_HEADER_STRUCT.pack(self.table_number, self.number)
+        if values is None:
+            return prefix
+        if not isinstance(values, (tuple, list)):
+            values = (values,)
+        if len(values) > len(self.fields):
+            raise ValueError('Key {} has {} fields'.format(self.name, len(self.fields)))
+        return prefix + b''.join(field.encode(value) for field, value in zip(self.fields, values))
+
+    def range(self, low=None, high=None):
+        """
+        (first, last) index records prefixes in key order for the values from low to high (see prefix): the
+        bounds are swapped if the first key field where they differ is DESCENDING (the first field if a bound
+        is None), so low <= high in value order for any key
+        """
+        if low is None and high is None:
+            return self.prefix(), self.prefix()
+        low_values = low if low is None or isinstance(low, (tuple, list)) else (low,)
+        high_values = high if high is None or isinstance(high, (tuple, list)) else (high,)
+        field = self.fields[0]
+        if low_values is not None and high_values is not None:
+            for field, low_value, high_value in zip(self.fields, low_values, high_values):
+                if low_value != high_value:
+                    break
+        if field.descending:
+            low, high = high, low
+        return self.prefix(low), self.prefix(high)
+
+    def decode(self, key):
+        """
+        Key field values from key bytes (TpsIndexRecord.key)
+        """
+        values = []
+        pos = 0
+        for field in self.fields:
+            values.append(field.decode(key[pos:pos + field.size]))
+            pos += field.size
+        return values
+
+
+def find_key(definition, key_name):
+    """
+    Number of the key by name (full or without table prefix, case insensitive)
+    """
+    for number, index in enumerate(definition.record_table_definition_index):
+        if index.name == key_name or field_shortname(index.name) == field_shortname(key_name):
+            return number
+    raise KeyError(key_name)
@@ -0,0 +1,94 @@
+"""
+MEMO and BLOB fields of TPS tables
+
+Every MEMO or BLOB of a row is stored in MEMO records (chunks) sorted by table_number, record_number of the
+row, memo number and sequence number, so the chunks of one memo are found by binary search (TPS.records_range)
+and are read only when the memo is accessed. BLOB data starts with its size (little-endian uint32).
+"""
+
+import io
+import struct
+
+from .tpsrecord import MEMO_RECORD_HEADER_STRUCT, MEMO_TYPE
+
+
+# table_number, type, record_number, memo number
+MEMO_PREFIX_STRUCT = struct.Struct('>LBLB')
+
+BLOB_SIZE_STRUCT = struct.Struct('<L')
+
+
+class TpsMemo:
+    """
+    MEMO or BLOB of a row (lazy handle)
+    """
+    __slots__ = ('tps', 'table_number', 'record_number', 'number', 'name', 'is_blob')
+
+    def __init__(self, tps, table_number, record_number, number, definition):
+        self.tps = tps
+        self.table_number = table_number
+        self.record_number = record_number
+        self.number = number
+        self.name = definition.name
+        self.is_blob = definition.flags.memo_type == 'BLOB'
+
+    def chunks(self):
+        """
+        Data of the memo chunks in sequence order (views into page buffers)
+        """
+        prefix = MEMO_PREFIX_STRUCT.pack(self.table_number, MEMO_TYPE, self.record_number, self.number)
+        size = None
+        for record in self.tps.records_range(prefix):
+            data = record[MEMO_RECORD_HEADER_STRUCT.size:]
+            if self.is_blob:
+                if size is None:
+                    size = BLOB_SIZE_STRUCT.unpack_from(data)[0]
+                    data = data[BLOB_SIZE_STRUCT.size:]
+                data = data[:size]
+                size -= len(data)
+            yield data
+
+    def __iter__(self):
+        return self.chunks()
+
+    def read(self):
+        """
+        BLOB bytes or MEMO text (empty if the row has no such memo)
+        """
+        data = b''.join(self.chunks())
+        if self.is_blob:
+            return data
+        return data.rstrip(b'\x00').decode(self.tps.encoding)
+
+    def open(self):
+        """
+        Binary file-like object reading the chunks one by one
+        """
+        return io.BufferedReader(TpsMemoStream(self.chunks()))
+
+    def __repr__(self):
+        return '<TpsMemo {} of record {}>'.format(self.name, self.record_number)
+
+
+class TpsMemoStream(io.RawIOBase):
+    """
+    Raw stream over memo chunks
+    """
+
+    def __init__(self, chunks):
+        self.__chunks = chunks
+        self.__chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.__chunk) == 0:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                return 0
+            self.__chunk = memoryview(chunk)
+        size = min(len(buffer), len(self.__chunk))
+        buffer[:size] = self.__chunk[:size]
+        self.__chunk = self.__chunk[size:]
+        return size
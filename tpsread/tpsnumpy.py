@@ -0,0 +1,203 @@
+"""
+Columnar export of TPS tables to NumPy structured arrays
+
+Raw record buffers are stacked into one contiguous array and decoded with np.frombuffer: numeric columns
+are plain views, DATE/TIME/DECIMAL/Clarion dates and strings are converted column-wise.
+"""
+
+import numpy as np
+from six import text_type
+
+from .tpsdecoder import CLARION_DATE_ORDINAL, RECNO_FIELDNAME, field_shortname, find_field
+
+
+# NumPy type of the (first element of the) field by field type
+FIELD_DTYPE = {
+    'BYTE': 'u1',
+    'SHORT': '<i2',
+    'USHORT': '<u2',
+    # date format 0xYYYYMMDD
+    'DATE': '<u4',
+    # time format 0xHHMMSSHS
+    'TIME': '<u4',
+    'LONG': '<i4',
+    'ULONG': '<u4',
+    'FLOAT': '<f4',
+    'DOUBLE': '<f8',
+}
+
+# Clarion date #0 as numpy date (days since 1970-01-01)
+CLARION_DATE_EPOCH = CLARION_DATE_ORDINAL - 719163
+
+# Max digits of int64 DECIMAL conversion (wider fields are converted with python ints)
+INT64_DIGITS = 18
+
+
+def table_fields(definition, columns=None):
+    """
+    Table fields (without GROUP) which can be exported, with unique names, in the order of the columns
+    (full names or names without table prefix, see tpsdecoder.find_field) if not None. Columns naming
+    MEMO and BLOB fields are skipped, unknown columns raise KeyError.
+    """
+    fields = definition.record_table_definition_field
+    if columns is not None:
+        selected = []
+        for column in columns:
+            try:
+                selected.append(find_field(fields, column))
+            except KeyError:
+                # raises KeyError if it is not a memo either
+                find_field(definition.record_table_definition_memo, column)
+        fields = selected
+    exported = []
+    names = set()
+    for field in fields:
+        name = text_type(field.name)
+        if (field.type in FIELD_DTYPE or field.type in ('DECIMAL', 'STRING', 'CSTRING', 'PSTRING')) \
+                and name not in names:
+            names.add(name)
+            exported.append(field)
+    return exported
+
+
+def raw_dtype(definition, columns=None):
+    """
+    Structured dtype of the raw record bytes (record.data.data)
+    """
+    fields = table_fields(definition, columns)
+    formats = []
+    for field in fields:
+        if field.type in FIELD_DTYPE:
+            formats.append(FIELD_DTYPE[field.type])
+        elif field.type == 'DECIMAL':
+            formats.append(('u1', (field.size,)))
+        else:
+            formats.append('S{}'.format(field.size))
+    return np.dtype({'names': [text_type(field.name) for field in fields],
+                     'formats': formats,
+                     'offsets': [field.offset for field in fields],
+                     'itemsize': definition.record_size})
+
+
+def records_to_raw(records, definition):
+    """
+    Stack raw records (record number, record data) into (record numbers, raw structured array)
+    """
+    record_size = definition.record_size
+    record_numbers = []
+    buffers = []
+    for record_number, data in records:
+        record_numbers.append(record_number)
+        if len(data) != record_size:
+            data = bytes(data[:record_size]).ljust(record_size, b'\x00')
+        buffers.append(data)
+    return (np.array(record_numbers, dtype='<u4'),
+            np.frombuffer(b''.join(buffers), dtype=raw_dtype(definition)))
+
+
+def convert_date(raw):
+    year = (raw >> 16).astype('i8')
+    month = ((raw >> 8) & 0xFF).astype('i8')
+    day = (raw & 0xFF).astype('i8')
+    result = ((year - 1970).astype('datetime64[Y]') + (month - 1).astype('timedelta64[M]')).astype('datetime64[D]') \
+        + (day - 1).astype('timedelta64[D]')
+    result[year == 0] = np.datetime64('NaT')
+    return result
+
+
+def convert_time(raw):
+    raw = raw.astype('i8')
+    return ((raw >> 24) * 3600000 + ((raw >> 16) & 0xFF) * 60000 + ((raw >> 8) & 0xFF) * 1000
+            + (raw & 0xFF) * 10).astype('timedelta64[ms]')
+
+
+def convert_clarion_date(raw):
+    result = (raw.astype('i8') + CLARION_DATE_EPOCH).astype('datetime64[D]')
+    result[raw == 0] = np.datetime64('NaT')
+    return result
+
+
+def convert_clarion_time(raw):
+    return (raw.astype('i8') * 10).astype('datetime64[ms]')
+
+
+def decimal_digits(raw):
+    """
+    Digits (nibbles, the sign nibble cleared) and negative flags of packed BCD values
+    (raw - uint8 array rows x field size)
+    """
+    # first nibble is the sign (0xF - negative)
+    nibbles = np.empty((raw.shape[0], raw.shape[1] * 2), dtype='i8')
+    nibbles[:, 0::2] = raw >> 4
+    nibbles[:, 1::2] = raw & 0x0F
+    negative = nibbles[:, 0] == 0x0F
+    nibbles[:, 0] = np.where(negative, 0, nibbles[:, 0])
+    return nibbles, negative
+
+
+def decimal_ints(nibbles, negative):
+    """
+    Unscaled values of decimal_digits as python ints (any number of digits)
+    """
+    weights = [10 ** power for power in range(nibbles.shape[1] - 1, -1, -1)]
+    return [(-1 if sign else 1) * sum(digit * weight for digit, weight in zip(digits, weights) if digit)
+            for digits, sign in zip(nibbles.tolist(), negative.tolist())]
+
+
+def convert_decimal(raw, decimal_count):
+    nibbles, negative = decimal_digits(raw)
+    if nibbles.shape[1] > INT64_DIGITS:
+        # int64 would overflow, exact python ints divided as by the row decoder
+        divider = 10 ** decimal_count
+        return np.array([value / divider for value in decimal_ints(nibbles, negative)], dtype='f8')
+    weights = 10 ** np.arange(nibbles.shape[1] - 1, -1, -1, dtype='i8')
+    return np.where(negative, -1.0, 1.0) * (nibbles @ weights) / 10 ** decimal_count
+
+
+def convert_string(raw, field_type, encoding=None):
+    data = np.ascontiguousarray(raw).view('u1').reshape(raw.shape[0], raw.dtype.itemsize)
+    if field_type == 'PSTRING':
+        # first byte is length
+        lengths = data[:, :1].astype('i8')
+        data = np.where(np.arange(data.shape[1] - 1) < lengths, data[:, 1:], 0).astype('u1')
+    elif field_type == 'CSTRING':
+        data = np.where(np.cumsum(data == 0, axis=1) > 0, 0, data).astype('u1')
+    result = np.ascontiguousarray(data).view('S{}'.format(data.shape[1])).reshape(raw.shape[0])
+    if encoding is not None:
+        result = np.char.strip(np.char.decode(result, encoding))
+    return result
+
+
+def to_numpy(record_numbers, raw, definition, encoding=None, date_fieldname=(), time_fieldname=(),
+             decode_strings=False, columns=None):
+    """
+    Convert raw structured array to the structured array of values
+
+    DATE and Clarion LONG dates become datetime64[D], Clarion LONG times datetime64[ms], TIME becomes
+    timedelta64[ms] since midnight, DECIMAL becomes float64. Strings stay fixed width bytes unless
+    decode_strings is True.
+    """
+    columns_data = [(RECNO_FIELDNAME, record_numbers)]
+    for field in table_fields(definition, columns):
+        name = text_type(field.name)
+        column = raw[name]
+        if field.type == 'DATE':
+            column = convert_date(column)
+        elif field.type == 'TIME':
+            column = convert_time(column)
+        elif field.type == 'LONG':
+            # TODO
+            if field_shortname(field.name) in date_fieldname:
+                column = convert_clarion_date(column)
+            elif field_shortname(field.name) in time_fieldname:
+                column = convert_clarion_time(column)
+        elif field.type == 'DECIMAL':
+            column = convert_decimal(column, field.decimal_count)
+        elif field.type in ('STRING', 'CSTRING', 'PSTRING'):
+            column = convert_string(column, field.type, encoding if decode_strings else None)
+        columns_data.append((name, column))
+
+    result = np.empty(len(record_numbers), dtype=[(name, column.dtype) for name, column in columns_data])
+    for name, column in columns_data:
+        result[name] = column
+    return result
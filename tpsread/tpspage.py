@@ -2,9 +2,12 @@
 TPS File Page
 """
 
-from warnings import warn
+import hashlib
+import struct
+from array import array
+from bisect import bisect_left
 
-from construct import Array, Byte, Struct, Int16ul, Int32ul
+from construct import Byte, Struct, Int16ul, Int32ul
 
 from .utils import check_value
 
@@ -19,33 +22,44 @@ PAGE_HEADER_STRUCT = 'page' / Struct('offset' / Int32ul,
                             'record_count' / Int16ul,
                             'hierarchy_level' / Byte, )
 
+PAGE_HEADER = struct.Struct('<LHHHHB')
+
+
+def page_data_hash(data):
+    """
+    Hash of the stored page data without the header (the header has the page offset), see tpsdelta
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
 
 class TpsPage:
-    def __init__(self, tps, ref, parent_ref, check=False):
-        self.tps = tps
+    # a page keeps only its header: there may be millions of them
+    __slots__ = ('__ref', 'parent_ref', 'offset', 'size', 'uncompressed_size', 'uncompressed_unabridged_size',
+                 'record_count', 'hierarchy_level', '__page_child_ref')
+
+    def __init__(self, tps, ref, parent_ref, check=False, state=None):
         self.__ref = ref
         self.parent_ref = parent_ref
-        self.check = check
-        self.__page_child_ref = []
+        self.__page_child_ref = ()
 
-        self.tps.seek(ref * 0x100 + self.tps.header.size)
-        page = PAGE_HEADER_STRUCT.parse(self.tps.read(PAGE_HEADER_STRUCT.sizeof()))
+        if state is not None:
+            # page header saved by state() (sidecar index)
+            (self.offset, self.size, self.uncompressed_size, self.uncompressed_unabridged_size,
+             self.record_count, self.hierarchy_level, page_child_ref) = state
+            self.__page_child_ref = array('L', page_child_ref)
+            return
 
-        if page.hierarchy_level != 0:
-            page.data = Array(lambda ctx: page.record_count, 'page_child_ref' / Int32ul).parse(
-                self.tps.read(page.size - PAGE_HEADER_STRUCT.sizeof()))
+        data = tps.read(PAGE_HEADER.size, ref * 0x100 + tps.header.size)
+        (self.offset, self.size, self.uncompressed_size, self.uncompressed_unabridged_size,
+         self.record_count, self.hierarchy_level) = PAGE_HEADER.unpack(data)
 
-        self.offset = page.offset
-        self.size = page.size
-        self.uncompressed_size = page.uncompressed_size
-        self.uncompressed_unabridged_size = page.uncompressed_unabridged_size
-        self.record_count = page.record_count
-        self.hierarchy_level = page.hierarchy_level
         if self.hierarchy_level != 0:
-            self.__page_child_ref = page.data
+            # Control page: refs of child pages
+            self.__page_child_ref = array('L', struct.unpack_from(
+                '<{}L'.format(self.record_count), tps.read(self.size - PAGE_HEADER.size)))
 
-        if self.check:
-            check_value('page_offset', self.offset, ref * 0x100 + self.tps.header.size)
+        if check:
+            check_value('page_offset', self.offset, ref * 0x100 + tps.header.size)
 
     @property
     def ref(self):
@@ -55,65 +69,205 @@ class TpsPage:
     def children(self):
         return self.__page_child_ref
 
+    def state(self):
+        return [self.offset, self.size, self.uncompressed_size, self.uncompressed_unabridged_size,
+                self.record_count, self.hierarchy_level, list(self.__page_child_ref)]
+
 
 class TpsPagesList:
     # tree-like structure
-    def __init__(self, tps, root_ref, check=False):
+    # Control pages are read when the tree is walked, leaf page headers only when the page is used.
+    # Integrity checks are done by TPS.verify
+    def __init__(self, tps, root_ref, check=False, state=None):
         self.tps = tps
         self.root_page_ref = root_ref
         self.check = check
+        # page headers read so far
         self.__pages = {}
+        # leaf page refs in tree order and their parents (physical order, for lookup)
+        self.__leaf_refs = array('L')
+        self.__leaf_parent_refs = array('L')
+        self.__sorted_leaf_refs = array('L')
+        self.__sorted_leaf_parent_refs = array('L')
+        # Leaf page index: page ref -> {(table_number, record type code): record count}, filled when the page
+        # records are read
+        self.__contents = {}
+        # Record number locator: page ref -> {table_number: (min, max) record_number of DATA records}, filled
+        # with the leaf page index
+        self.__record_numbers = {}
+        # page ref -> page_data_hash of the leaf pages of the leaf page index, and the refs to check against
+        # the file after refresh
+        self.__hashes = {}
+        self.__unverified = set()
+
+        if state is not None:
+            # page tree and leaf page index saved by state() (sidecar index)
+            for ref, parent_ref, page_state in state['pages']:
+                self[ref] = TpsPage(self.tps, ref, parent_ref, state=page_state)
+            self.__set_leaf_refs(state['leaf_refs'], state['leaf_parent_refs'])
+            for ref, contents in state['contents']:
+                self.__contents[ref] = dict(((table_number, record_type), count)
+                                            for table_number, record_type, count in contents)
+            for ref, record_numbers in state['record_numbers']:
+                self.__record_numbers[ref] = dict((table_number, (min_record_number, max_record_number))
+                                                  for table_number, min_record_number, max_record_number
+                                                  in record_numbers)
+            return
 
-        self.__add(self.root_page_ref, check=self.check)
+        self.__walk()
 
-        for current_page_ref in self.__generator(self.root_page_ref):
+    def __walk(self, previous_pages=None):
+        # iterative depth-first walk in tree order; children of level 1 pages are leaves and are not read;
+        # control pages equal to previous_pages are kept
+        leaf_refs = array('L')
+        leaf_parent_refs = array('L')
 
-            if self.__pages[current_page_ref].hierarchy_level != 0:
-                # Control page
-                for child_page_ref in self.__pages[current_page_ref].children:
-                    new_page = self.__add(child_page_ref, parent_ref=current_page_ref, check=self.check)
-                    # check page inside block
-                    if self.check:
-                        new_page_end_ref = (new_page.offset + new_page.size - self.tps.header.size) / 0x100
-                        if not self.tps.block_contains(child_page_ref, new_page_end_ref):
-                            warn('Not exist block, that contains page ref# {page_ref}'
-                                 .format(page_ref=child_page_ref))
+        def read_page(ref, parent_ref):
+            page = TpsPage(self.tps, ref, parent_ref)
+            if previous_pages is not None and ref in previous_pages:
+                previous_page = previous_pages[ref]
+                if previous_page.parent_ref == parent_ref and previous_page.state() == page.state():
+                    return previous_page
+            return page
 
-    def __add(self, ref, parent_ref=None, check=False):
-        page = TpsPage(self.tps, ref, parent_ref, check)
+        root = read_page(self.root_page_ref, None)
+        self[root.ref] = root
+        # control pages to expand, or (leaf ref, parent ref)
+        stack = [root]
+        while stack:
+            page = stack.pop()
+            if isinstance(page, tuple):
+                leaf_refs.append(page[0])
+                leaf_parent_refs.append(page[1])
+            elif page.hierarchy_level == 0:
+                # root page is a leaf
+                leaf_refs.append(page.ref)
+                leaf_parent_refs.append(page.ref)
+            elif page.hierarchy_level == 1:
+                leaf_refs.extend(page.children)
+                leaf_parent_refs.extend([page.ref] * len(page.children))
+            else:
+                for child_ref in reversed(page.children):
+                    child = read_page(child_ref, page.ref)
+                    self[child_ref] = child
+                    stack.append(child if child.hierarchy_level != 0 else (child_ref, page.ref))
+        self.__set_leaf_refs(leaf_refs, leaf_parent_refs)
 
-        if self.check:
-            intersection_page = self.__intersection(ref, page.size)
-            if intersection_page is not None:
-                warn('Page ref# {page_ref1} intersects with the page ref# {page_ref2}'
-                     .format(page_ref1=ref, page_ref2=intersection_page.ref))
+    def refresh(self, root_ref):
+        """
+        Walk the page tree again from the (new) root after the file has changed: unchanged control pages are
+        kept, leaf pages of the leaf page index that are still in the tree are checked lazily against their
+        page_data_hash (see is_current), other leaf pages are dropped. Return refs of the dropped leaf pages.
+        """
+        previous_pages = self.__pages
+        self.root_page_ref = root_ref
+        self.__pages = {}
+        self.__walk(previous_pages)
+        leaf_refs = set(self.__leaf_refs)
+        dropped = []
+        for ref in list(self.__contents):
+            if ref in leaf_refs and ref in self.__hashes:
+                self.__unverified.add(ref)
+            else:
+                self.__forget(ref)
+                dropped.append(ref)
+        return dropped
+
+    def is_current(self, ref):
+        """
+        Check the leaf page index entry of the page against the file after refresh, drop it and the cached
+        page data (TPS.discard_page) if the page has changed. Return False if it has changed.
+        """
+        if ref not in self.__unverified:
+            return True
+        self.__unverified.discard(ref)
+        page = self[ref]
+        data = self.tps.read(page.size - PAGE_HEADER.size, ref * 0x100 + self.tps.header.size + PAGE_HEADER.size)
+        if page_data_hash(data) == self.__hashes.get(ref):
+            return True
+        self.__forget(ref)
+        self.tps.discard_page(ref)
+        return False
+
+    def __forget(self, ref):
+        self.__contents.pop(ref, None)
+        self.__record_numbers.pop(ref, None)
+        self.__hashes.pop(ref, None)
+        self.__unverified.discard(ref)
 
-        self[ref] = page
+    def __set_leaf_refs(self, leaf_refs, leaf_parent_refs):
+        self.__leaf_refs = array('L', leaf_refs)
+        self.__leaf_parent_refs = array('L', leaf_parent_refs)
+        order = sorted(range(len(leaf_refs)), key=leaf_refs.__getitem__)
+        self.__sorted_leaf_refs = array('L', [leaf_refs[i] for i in order])
+        self.__sorted_leaf_parent_refs = array('L', [leaf_parent_refs[i] for i in order])
 
-        return page
+    def leaf_refs(self, order='tree'):
+        """
+        Refs of leaf pages in tree order ('tree') or file order ('physical')
+        """
+        if order == 'tree':
+            return list(self.__leaf_refs)
+        elif order == 'physical':
+            return list(self.__sorted_leaf_refs)
+        else:
+            raise ValueError('order must be "tree" or "physical"')
 
     def list(self):
-        return list(self.__pages)
-
-    def __generator(self, ref):
-        yield ref
-        queue = self[ref].children
-        while queue:
-            yield queue[0]
-            expansion = self[queue[0]].children
-            queue = expansion + queue[1:]
-
-    def __intersection(self, ref, size):
-        start_offset = ref * 0x100 + self.tps.header.size
-        end_offset = start_offset + size
-        for current_page_ref in self.__pages:
-            current_page_end_offset = self.__pages[current_page_ref].offset + self.__pages[current_page_ref].size
-            if not (not (self.__pages[current_page_ref].offset <= start_offset < current_page_end_offset) and not (
-                            self.__pages[current_page_ref].offset < end_offset <= current_page_end_offset)):
-                return current_page_ref
-        return None
+        """
+        Refs of all pages: control pages, then leaf pages in tree order
+        """
+        leaf_refs = set(self.__leaf_refs)
+        return [ref for ref in self.__pages if ref not in leaf_refs] + list(self.__leaf_refs)
+
+    def get_contents(self, ref):
+        """
+        Tables and record types of the leaf page, None if the page has not been read yet (or has changed)
+        """
+        self.is_current(ref)
+        return self.__contents.get(ref)
+
+    def set_contents(self, ref, contents, record_numbers=None, data_hash=None):
+        """
+        Leaf page index entry of the page, data_hash - page_data_hash of the page (entries without it are
+        dropped by refresh)
+        """
+        self.__contents[ref] = contents
+        self.__record_numbers[ref] = record_numbers if record_numbers is not None else {}
+        if data_hash is not None:
+            self.__hashes[ref] = data_hash
+        else:
+            self.__hashes.pop(ref, None)
+        self.__unverified.discard(ref)
+
+    def get_record_numbers(self, ref):
+        """
+        {table_number: (min, max) record_number} of DATA records of the leaf page, None if not read yet
+        """
+        self.is_current(ref)
+        return self.__record_numbers.get(ref)
+
+    def state(self):
+        return {'pages': [[ref, page.parent_ref, page.state()] for ref, page in self.__pages.items()],
+                'leaf_refs': list(self.__leaf_refs),
+                'leaf_parent_refs': list(self.__leaf_parent_refs),
+                'contents': [[ref, [[table_number, record_type, count]
+                                    for (table_number, record_type), count in contents.items()]]
+                             for ref, contents in self.__contents.items()],
+                'record_numbers': [[ref, [[table_number, min_record_number, max_record_number]
+                                          for table_number, (min_record_number, max_record_number)
+                                          in record_numbers.items()]]
+                                   for ref, record_numbers in self.__record_numbers.items()]}
 
     def __getitem__(self, ref):
+        if ref not in self.__pages:
+            # leaf page header is read on first use
+            i = bisect_left(self.__sorted_leaf_refs, ref)
+            if i < len(self.__sorted_leaf_refs) and self.__sorted_leaf_refs[i] == ref:
+                parent_ref = self.__sorted_leaf_parent_refs[i]
+            else:
+                parent_ref = None
+            self[ref] = TpsPage(self.tps, ref, parent_ref)
         return self.__pages[ref]
 
     def __setitem__(self, ref, item):
@@ -0,0 +1,46 @@
+"""
+pandas export of TPS tables (requires pandas and numpy)
+
+Columns are built from the column-wise decoded records (see tpsnumpy.to_numpy), never from row dicts:
+BYTE/SHORT/LONG... keep their width (uint8, int16, int32...), FLOAT and DOUBLE are float32 and float64,
+DECIMAL is float64, DATE and Clarion LONG dates are datetime64 (NaT for empty dates), TIME is timedelta64
+since midnight, strings are decoded with the TPS encoding, as category if requested.
+"""
+
+import pandas as pd
+
+from .tpsdecoder import find_field
+from .tpsnumpy import table_fields, to_numpy
+
+# String field types (categorical columns)
+STRING_TYPES = ('STRING', 'CSTRING', 'PSTRING')
+
+
+def categorical_names(definition, columns=None, categorical=()):
+    """
+    Names of the string columns to convert to category (categorical - names, see tpsdecoder.find_field,
+    or True for all strings). Unknown names raise KeyError, names of other columns ValueError.
+    """
+    fields = [field for field in table_fields(definition, columns) if field.type in STRING_TYPES]
+    if categorical is True:
+        return [str(field.name) for field in fields]
+    names = []
+    for name in categorical:
+        field = find_field(definition.record_table_definition_field, name)
+        if field not in fields:
+            raise ValueError('{} is not a string column'.format(name))
+        names.append(str(field.name))
+    return names
+
+
+def to_dataframe(record_numbers, raw, definition, encoding=None, date_fieldname=(), time_fieldname=(),
+                 columns=None, categorical=()):
+    """
+    DataFrame of the raw records (see tpsnumpy.records_to_raw)
+    """
+    values = to_numpy(record_numbers, raw, definition, encoding=encoding, date_fieldname=date_fieldname,
+                      time_fieldname=time_fieldname, decode_strings=encoding is not None, columns=columns)
+    dataframe = pd.DataFrame(dict((name, values[name]) for name in values.dtype.names), columns=values.dtype.names)
+    for name in categorical_names(definition, columns, categorical):
+        dataframe[name] = dataframe[name].astype('category')
+    return dataframe
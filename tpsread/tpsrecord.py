@@ -1,10 +1,38 @@
-from construct import Byte, Bytes, Embedded, EmbeddedSwitch, Enum, IfThenElse, Peek, PaddedString, Struct, Switch, Int32ub, Int16ul, Int32ul, Probe, Const, this
+import struct
 
-from .tpspage import PAGE_HEADER_STRUCT
+from construct import Byte, Bytes, EmbeddedSwitch, Enum, Peek, PaddedString, Struct, Int32ub, Int16ul, Int32ul, this
+
+from .tpspage import PAGE_HEADER_STRUCT, page_data_hash
 from .utils import check_value
 
 record_encoding = 'ascii'
 
+DATA_SIZE_STRUCT = struct.Struct('<H')
+
+# table_number, type, record_number
+DATA_RECORD_HEADER_STRUCT = struct.Struct('>LBL')
+
+TABLE_NUMBER_STRUCT = struct.Struct('>L')
+
+# table_number, index number (record type code below DATA_TYPE), then key and record_number
+INDEX_RECORD_HEADER_STRUCT = struct.Struct('>LB')
+RECORD_NUMBER_STRUCT = struct.Struct('>L')
+
+# table_number, type, owner record_number, memo number, sequence number of the chunk
+MEMO_RECORD_HEADER_STRUCT = struct.Struct('>LBLBH')
+
+# Record type codes (RECORD_TYPE)
+DATA_TYPE = 0xF3
+METADATA_TYPE = 0xF6
+TABLE_DEFINITION_TYPE = 0xFA
+MEMO_TYPE = 0xFC
+TABLE_NAME_TYPE = 0xFE
+
+# Approximate memory size of a record position (page cache budget)
+POSITION_SIZE = 80
+
+REPEAT_BYTES = [bytes((i,)) for i in range(0x100)]
+
 #RECORD_TYPE = 'type' / Enum(Byte,
 #                   NULL=None,
 #                   DATA=0xF3,
@@ -57,33 +85,86 @@ RECORD_STRUCT =   'record' / EmbeddedSwitch( Struct('data_size' / Int16ul,
                                                        })} )
 
 
+class TpsDataRecord:
+    """
+    DATA record (same fields as DATA_RECORD_DATA), data is a view into the page buffer
+    """
+    __slots__ = ('table_number', 'type', 'record_number', 'data')
+
+    def __init__(self, table_number, record_number, data):
+        self.table_number = table_number
+        self.type = 'DATA'
+        self.record_number = record_number
+        self.data = data
+
+
+class TpsIndexRecord:
+    """
+    INDEX record: key is a view of the key fields bytes (see tpskey.TpsKey.decode)
+    """
+    __slots__ = ('table_number', 'type', 'index_number', 'key', 'record_number')
+
+    def __init__(self, table_number, index_number, key, record_number):
+        self.table_number = table_number
+        self.type = 'INDEX'
+        self.index_number = index_number
+        self.key = key
+        self.record_number = record_number
+
+
+class TpsMemoRecord:
+    """
+    MEMO record: a chunk of the MEMO or BLOB (memo_number in the table definition) of a DATA record
+    """
+    __slots__ = ('table_number', 'type', 'record_number', 'memo_number', 'sequence_number', 'data')
+
+    def __init__(self, table_number, record_number, memo_number, sequence_number, data):
+        self.table_number = table_number
+        self.type = 'MEMO'
+        self.record_number = record_number
+        self.memo_number = memo_number
+        self.sequence_number = sequence_number
+        self.data = data
+
+
 class TpsRecord:
     def __init__(self, header_size, data):
+        # data - record bytes (without data_size)
         self.header_size = header_size
         self.data_bytes = data
-        # print(data)
 
-        data_size = len(self.data_bytes) - 2
-
-        # print('data_size', data_size, header_size)
-
-        if data_size == 0:
+        if len(data) == 0:
             self.type = 'NULL'
+        elif len(data) >= DATA_RECORD_HEADER_STRUCT.size and data[0] != 0xFE and data[4] == 0xF3:
+            # DATA records are parsed without construct
+            table_number, record_type, record_number = DATA_RECORD_HEADER_STRUCT.unpack_from(data)
+            self.data = TpsDataRecord(table_number, record_number, data[DATA_RECORD_HEADER_STRUCT.size:])
+            self.type = self.data.type
+        elif len(data) >= MEMO_RECORD_HEADER_STRUCT.size and data[0] != 0xFE and data[4] == MEMO_TYPE:
+            table_number, record_type, record_number, memo_number, sequence_number = \
+                MEMO_RECORD_HEADER_STRUCT.unpack_from(data)
+            self.data = TpsMemoRecord(table_number, record_number, memo_number, sequence_number,
+                                      data[MEMO_RECORD_HEADER_STRUCT.size:])
+            self.type = self.data.type
+        elif len(data) >= INDEX_RECORD_HEADER_STRUCT.size + RECORD_NUMBER_STRUCT.size and data[0] != 0xFE \
+                and data[4] < DATA_TYPE:
+            # Index records: record type code is the index number
+            table_number, index_number = INDEX_RECORD_HEADER_STRUCT.unpack_from(data)
+            record_number = RECORD_NUMBER_STRUCT.unpack_from(data, len(data) - RECORD_NUMBER_STRUCT.size)[0]
+            self.data = TpsIndexRecord(table_number, index_number,
+                                       data[INDEX_RECORD_HEADER_STRUCT.size:-RECORD_NUMBER_STRUCT.size],
+                                       record_number)
+            self.type = self.data.type
         else:
-            #print("self.data_bytes=", self.data_bytes)
-            self.data = RECORD_STRUCT.parse(self.data_bytes)
-            
+            self.data = RECORD_STRUCT.parse(DATA_SIZE_STRUCT.pack(len(data)) + bytes(data))
+
             # Small workaround for EmbeddedSwitch inability to share a field name
             if self.data.table_number_n is not None:
                 self.data.table_number = self.data.table_number_n
             if self.data.type_n is not None:
                 self.data.type = self.data.type_n
-             
-            #TODO: Index records are ignored...
-                
-            #print("self.data=", self.data)
+
             self.type = self.data.type
-            #print('record type:', self.data.type)
 
 
 class TpsRecordsList:
@@ -95,71 +176,207 @@ class TpsRecordsList:
         global record_encoding
         record_encoding = encoding
         self.__records = []
+        # (table_number, record type code) -> record count
+        self.contents = {}
+        # size of (uncompressed) page data, None if records come from the records cache
+        self.data_size = None
+        self.__positions = None
 
         if self.tps_page.hierarchy_level == 0:
-            if self.tps_page.ref in self.tps.cache_pages:
-                self.__records = tps.cache_pages[self.tps_page.ref]
+            ref = self.tps_page.ref
+            # cached data of a page changed since refresh is dropped
+            self.tps.pages.is_current(ref)
+            records = self.tps.records_cache.get(ref) if self.tps.cached else None
+            if records is not None:
+                self.__records = records
+                self.contents = self.tps.pages.get_contents(ref)
+                return
+            page = self.tps.page_cache.get(ref) if self.tps.cached else None
+            if page is not None:
+                self.__buffer, self.__positions, self.data_size = page
+                self.contents = self.tps.pages.get_contents(ref)
             else:
                 data = self.tps.read(self.tps_page.size - PAGE_HEADER_STRUCT.sizeof(),
-                                     self.tps_page.ref * 0x100 + self.tps.header.size + PAGE_HEADER_STRUCT.sizeof())
+                                     ref * 0x100 + self.tps.header.size + PAGE_HEADER_STRUCT.sizeof())
+                data_hash = page_data_hash(data)
 
+                stats = self.tps.stats
                 if self.tps_page.uncompressed_size > self.tps_page.size:
-                    data = self.__uncompress(data)
+                    start = stats.start()
+                    data = uncompress(data, self.tps_page.uncompressed_size - PAGE_HEADER_STRUCT.sizeof())
+                    stats.add('decompress', start, bytes_decompressed=len(data))
 
                     if self.check:
                         check_value('record_data.size', len(data) + PAGE_HEADER_STRUCT.sizeof(),
                                     tps_page.uncompressed_size)
 
-                record_data = b''
-                pos = 0
-                record_size = 0
-                record_header_size = 0
-
-                while pos < len(data):
-                    byte_counter = data[pos]
-                    pos += 1
-                    if (byte_counter & 0x80) == 0x80:
-                        record_size = data[pos + 1] * 0x100 + data[pos]
-                        pos += 2
-                    if (byte_counter & 0x40) == 0x40:
-                        record_header_size = data[pos + 1] * 0x100 + data[pos]
-                        pos += 2
-                    byte_counter &= 0x3F
-                    new_data_size = record_size - byte_counter
-                    record_data = record_data[:byte_counter] + data[pos:pos + new_data_size]
-                    self.__records.append(TpsRecord(record_header_size, ('data_size' / Int16ul).build(record_size)
-                                                    + record_data))
-                    pos += new_data_size
-
-                if self.tps.cached and self.tps_page.ref not in tps.cache_pages:
-                    tps.cache_pages[self.tps_page.ref] = self.__records
-
-    def __uncompress(self, data):
-        pos = 0
-        result = b''
-        while pos < len(data):
-            repeat_rel_offset = data[pos]
+                start = stats.start()
+                self.data_size = len(data)
+                self.__buffer, self.__positions = split_records(data)
+                self.contents = records_contents(self.__buffer, self.__positions)
+                self.tps.pages.set_contents(ref, self.contents,
+                                            data_record_numbers(self.__buffer, self.__positions), data_hash)
+                stats.add('split', start, pages_read=1)
+                if self.tps.cached:
+                    self.tps.page_cache.put(ref, (self.__buffer, self.__positions, self.data_size),
+                                            len(self.__buffer) + POSITION_SIZE * len(self.__positions))
+            # TpsRecord objects are created on first access
+            self.__records = None
+
+    def contains(self, table_number=None, record_types=None):
+        return contents_match(self.contents, table_number, record_types)
+
+    def data_sizes(self):
+        """
+        (table_number, data size) of DATA records
+        """
+        if self.__positions is None:
+            return [(record.data.table_number, len(record.data.data)) for record in self.__get_records()
+                    if record.type == 'DATA']
+        buffer = self.__buffer
+        return [(TABLE_NUMBER_STRUCT.unpack_from(buffer, start)[0], end - start - DATA_RECORD_HEADER_STRUCT.size)
+                for record_header_size, start, end in self.__positions
+                if end - start >= DATA_RECORD_HEADER_STRUCT.size and buffer[start] != TABLE_NAME_TYPE
+                and buffer[start + 4] == DATA_TYPE]
+
+    def __get_records(self):
+        if self.__records is None:
+            parse_start = self.tps.stats.start()
+            buffer = memoryview(self.__buffer)
+            self.__records = [TpsRecord(record_header_size, buffer[start:end])
+                              for record_header_size, start, end in self.__positions]
+            self.tps.stats.add('parse', parse_start, records_parsed=len(self.__records))
+            if self.tps.cached:
+                self.tps.records_cache.put(self.tps_page.ref, self.__records)
+        return self.__records
+
+    def raw_records(self):
+        """
+        Bytes of the records (without data_size) in page order, records are not parsed
+        """
+        if self.__positions is None:
+            return [record.data_bytes for record in self.__get_records()]
+        buffer = memoryview(self.__buffer)
+        return [buffer[start:end] for record_header_size, start, end in self.__positions]
+
+    def __getitem__(self, key):
+        return self.__get_records()[key]
+
+    def __len__(self):
+        return len(self.__get_records())
+
+
+def records_contents(buffer, positions):
+    """
+    (table_number, record type code) -> record count, from the record headers only
+    """
+    contents = {}
+    for record_header_size, start, end in positions:
+        if end - start >= 5:
+            if buffer[start] == TABLE_NAME_TYPE:
+                key = (TABLE_NUMBER_STRUCT.unpack_from(buffer, end - 4)[0], TABLE_NAME_TYPE)
+            else:
+                key = (TABLE_NUMBER_STRUCT.unpack_from(buffer, start)[0], buffer[start + 4])
+            contents[key] = contents.get(key, 0) + 1
+    return contents
+
+
+def data_record_numbers(buffer, positions):
+    """
+    table_number -> (min, max) record_number of DATA records, from the record headers only
+    """
+    record_numbers = {}
+    for record_header_size, start, end in positions:
+        if end - start >= DATA_RECORD_HEADER_STRUCT.size and buffer[start] != TABLE_NAME_TYPE and \
+                buffer[start + 4] == DATA_TYPE:
+            table_number, record_type, record_number = DATA_RECORD_HEADER_STRUCT.unpack_from(buffer, start)
+            if table_number in record_numbers:
+                min_record_number, max_record_number = record_numbers[table_number]
+                record_numbers[table_number] = (min(min_record_number, record_number),
+                                                max(max_record_number, record_number))
+            else:
+                record_numbers[table_number] = (record_number, record_number)
+    return record_numbers
+
+
+def contents_match(contents, table_number=None, record_types=None):
+    """
+    Page contents has records of the table (any if None) and of one of record types (any if None)
+    """
+    for contents_table_number, record_type in contents:
+        if (table_number is None or contents_table_number == table_number) and \
+                (record_types is None or record_type in record_types):
+            return True
+    return False
+
+
+def uncompress(data, size=0):
+    """
+    Uncompress page data (RLE), size - expected uncompressed size (buffer preallocation)
+    """
+    result = bytearray(size)
+    data = memoryview(data)
+    pos = 0
+    result_pos = 0
+    while pos < len(data):
+        repeat_rel_offset = data[pos]
+        pos += 1
+
+        if repeat_rel_offset > 0x7F:
+            # size repeat_count = 2 bytes
+            repeat_rel_offset = ((data[pos] << 8) + ((repeat_rel_offset & 0x7F) << 1)) >> 1
             pos += 1
 
-            if repeat_rel_offset > 0x7F:
-                # size repeat_count = 2 bytes
-                repeat_rel_offset = ((data[pos] << 8) + ((repeat_rel_offset & 0x7F) << 1)) >> 1
-                pos += 1
+        result[result_pos:result_pos + repeat_rel_offset] = data[pos:pos + repeat_rel_offset]
+        pos += repeat_rel_offset
+        result_pos += repeat_rel_offset
 
-            result += data[pos:pos + repeat_rel_offset]
-            pos += repeat_rel_offset
+        if pos < len(data):
+            repeat_count = data[pos]
+            pos += 1
 
-            if pos < len(data):
-                repeat_byte = bytes(result[-1:])
-                repeat_count = data[pos]
+            if repeat_count > 0x7F:
+                repeat_count = ((data[pos] << 8) + ((repeat_count & 0x7F) << 1)) >> 1
                 pos += 1
 
-                if repeat_count > 0x7F:
-                    repeat_count = ((data[pos] << 8) + ((repeat_count & 0x7F) << 1)) >> 1
-                    pos += 1
+            if result_pos > 0:
+                repeat_byte = result[result_pos - 1]
+                result[result_pos:result_pos + repeat_count] = REPEAT_BYTES[repeat_byte] * repeat_count
+                result_pos += repeat_count
+    del result[result_pos:]
+    return result
 
-                result += repeat_byte * repeat_count
-        return result
 
-    def __getitem__(self, key):
-        return self.__records[key]
+def split_records(data):
+    """
+    Split uncompressed page data to records
+
+    Each record shares first bytes with the previous record (byte_counter), records are rebuilt one after
+    another in a single buffer. Return the buffer and (record_header_size, start, end) of every record.
+    """
+    buffer = bytearray()
+    records = []
+    pos = 0
+    record_size = 0
+    record_header_size = 0
+    start = 0
+
+    while pos < len(data):
+        byte_counter = data[pos]
+        pos += 1
+        if (byte_counter & 0x80) == 0x80:
+            record_size = data[pos + 1] * 0x100 + data[pos]
+            pos += 2
+        if (byte_counter & 0x40) == 0x40:
+            record_header_size = data[pos + 1] * 0x100 + data[pos]
+            pos += 2
+        byte_counter &= 0x3F
+        new_data_size = record_size - byte_counter
+        new_start = len(buffer)
+        if byte_counter:
+            buffer += buffer[start:start + byte_counter]
+        buffer += data[pos:pos + new_data_size]
+        start = new_start
+        records.append((record_header_size, start, len(buffer)))
+        pos += new_data_size
+    return buffer, records
@@ -0,0 +1,66 @@
+"""
+Sidecar metadata index (.tpsidx) of TPS file
+
+JSON file next to the TPS file with the header, the page tree, the leaf page index and the table
+definitions, so an unchanged file is reopened without walking the page tree and scanning for definitions.
+The sidecar is valid while the file size, mtime and header change_count are the same.
+"""
+
+import json
+import os
+import os.path
+from warnings import warn
+
+
+SIDECAR_VERSION = 3
+
+SIDECAR_EXTENSION = '.tpsidx'
+
+
+def sidecar_filename(filename):
+    return os.path.splitext(filename)[0] + SIDECAR_EXTENSION
+
+
+def file_signature(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_sidecar(tps, filename):
+    """
+    Sidecar state of the TPS file, None if there is no valid sidecar
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'r') as sidecar_file:
+            state = json.load(sidecar_file)
+    except (OSError, ValueError):
+        return None
+
+    file_size, mtime = file_signature(tps.filename)
+    if state.get('version') != SIDECAR_VERSION or state['file_size'] != file_size or state['mtime'] != mtime \
+            or state['change_count'] != tps.header.change_count:
+        return None
+    return state
+
+
+def save_sidecar(tps, filename):
+    """
+    Write sidecar of the opened TPS file (atomically, a failure is only a warning)
+    """
+    file_size, mtime = file_signature(tps.filename)
+    state = {'version': SIDECAR_VERSION,
+             'file_size': file_size,
+             'mtime': mtime,
+             'change_count': tps.header.change_count,
+             'pages': tps.pages.state(),
+             'tables': tps.tables.state()}
+    temp_filename = filename + '.tmp'
+    try:
+        with open(temp_filename, 'w') as sidecar_file:
+            json.dump(state, sidecar_file, separators=(',', ':'))
+        os.replace(temp_filename, filename)
+    except OSError as error:
+        warn('Sidecar index {filename} is not saved: {error}'.format(filename=filename, error=error),
+             RuntimeWarning)
@@ -0,0 +1,215 @@
+"""
+Bulk load of TPS tables into SQLite
+
+A table is created from the table definition (typed columns, the record number as INTEGER PRIMARY KEY) and
+rows are inserted with executemany in batches, transaction_rows rows per transaction. Durability is not
+needed for a mirror that can be loaded again: the load runs with synchronous=OFF and the rollback journal in
+memory, the previous settings of the connection are restored after the load. Indexes of the table definition
+(keys) are created after the rows are inserted.
+"""
+
+from datetime import date, time
+
+from six import text_type
+
+from .tpsdecoder import field_shortname
+from .tpsmemo import TpsMemo
+
+
+# SQLite column type by field type (TpsSchema.types), BLOB for other types (GROUP)
+SQLITE_TYPE = {
+    'ULONG': 'INTEGER',
+    'BYTE': 'INTEGER',
+    'SHORT': 'INTEGER',
+    'USHORT': 'INTEGER',
+    'LONG': 'INTEGER',
+    'FLOAT': 'REAL',
+    'DOUBLE': 'REAL',
+    'DECIMAL': 'REAL',
+    'DATE': 'TEXT',
+    'TIME': 'TEXT',
+    'STRING': 'TEXT',
+    'CSTRING': 'TEXT',
+    'PSTRING': 'TEXT',
+    'MEMO': 'TEXT',
+    'BLOB': 'BLOB',
+}
+
+DEFAULT_BATCH_SIZE = 10000
+
+DEFAULT_TRANSACTION_ROWS = 200000
+
+# (pragma, value) set during the load
+LOAD_PRAGMAS = (('synchronous', 'OFF'), ('journal_mode', 'MEMORY'), ('temp_store', 'MEMORY'), ('cache_size', -65536))
+
+
+def quote(name):
+    return '"{}"'.format(text_type(name).replace('"', '""'))
+
+
+def column_types(tps, table_number):
+    """
+    SQLite types of the row columns (TpsSchema names)
+    """
+    schema = tps.schema(table_number)
+    types = []
+    for i, (name, field_type) in enumerate(zip(schema.names, schema.types)):
+        if i == 0:
+            types.append('INTEGER PRIMARY KEY')
+        elif field_type == 'LONG' and (field_shortname(name) in tps.date_fieldname or
+                                       field_shortname(name) in tps.time_fieldname):
+            # Clarion dates and times are decoded as text
+            types.append('TEXT')
+        else:
+            types.append(SQLITE_TYPE.get(field_type, 'BLOB'))
+    return types
+
+
+def sqlite_value(value):
+    if isinstance(value, TpsMemo):
+        return value.read()
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+def index_statements(tps, table_number, table_name):
+    """
+    CREATE INDEX statements of the keys and indexes of the table definition (not unique: values are
+    compared as decoded text, the key may be unique only in the TPS collation)
+    """
+    definition = tps.tables.get_definition(table_number)
+    fields = definition.record_table_definition_field
+    names = set(tps.schema(table_number).names)
+    statements = []
+    for index in definition.record_table_definition_index:
+        columns = []
+        for index_field in index.index_field_propertly:
+            name = text_type(fields[index_field.field_number].name)
+            if name not in names:
+                break
+            column = quote(name)
+            if index.flags.NOCASE:
+                column += ' COLLATE NOCASE'
+            if index_field.field_order_type == 'DESCENDING':
+                column += ' DESC'
+            columns.append(column)
+        else:
+            if columns:
+                statements.append('CREATE INDEX {} ON {} ({})'.format(
+                    quote('{}_{}'.format(table_name, index.name)), quote(table_name), ', '.join(columns)))
+    return statements
+
+
+class TpsSqliteTable:
+    """
+    SQLite table loaded from a TPS table, rows are inserted in batches
+    """
+
+    def __init__(self, tps, connection, table_number, table_name=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.tps = tps
+        self.connection = connection
+        self.table_number = table_number
+        self.name = table_name if table_name is not None else tps.tables.get_name(table_number)
+        self.batch_size = batch_size
+        schema = tps.schema(table_number)
+        self.names = schema.names
+        # columns that need conversion: dates, times and memos
+        self.converted = [i for i, field_type in enumerate(schema.types)
+                          if field_type in ('DATE', 'TIME', 'MEMO', 'BLOB')]
+        self.insert = 'INSERT INTO {} VALUES ({})'.format(quote(self.name), ', '.join('?' * len(self.names)))
+        self.batch = []
+        self.count = 0
+
+    def create(self):
+        columns = ', '.join('{} {}'.format(quote(name), column_type)
+                            for name, column_type in zip(self.names, column_types(self.tps, self.table_number)))
+        self.connection.execute('DROP TABLE IF EXISTS {}'.format(quote(self.name)))
+        self.connection.execute('CREATE TABLE {} ({})'.format(quote(self.name), columns))
+
+    def write(self, row):
+        values = [row[name] for name in self.names]
+        for i in self.converted:
+            values[i] = sqlite_value(values[i])
+        self.batch.append(values)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.connection.executemany(self.insert, self.batch)
+            self.count += len(self.batch)
+            self.batch = []
+
+    def create_indexes(self):
+        for statement in index_statements(self.tps, self.table_number, self.name):
+            self.connection.execute(statement)
+
+
+def load(tps, connection, table_numbers=None, indexes=True, batch_size=DEFAULT_BATCH_SIZE,
+         transaction_rows=DEFAULT_TRANSACTION_ROWS, pragmas=LOAD_PRAGMAS):
+    """
+    Load the tables (all if None) in a single pass over leaf pages into the SQLite connection, existing tables
+    are replaced. Tables with the name of another table of the file (SQLite names are case insensitive) raise
+    ValueError.
+    Return row counts by table name.
+    """
+    if table_numbers is None:
+        table_numbers = tps.tables.numbers()
+    # lowercase table name -> table_number; rows of iter_all_tables are matched by table name, so other
+    # tables of the file must not have the name of a loaded table either
+    names = {}
+    for table_number in table_numbers:
+        table_name = tps.tables.get_name(table_number)
+        if table_name.lower() in names:
+            raise ValueError('Tables with the same name {!r}'.format(table_name))
+        names[table_name.lower()] = table_number
+    for table_number in tps.tables.numbers():
+        table_name = tps.tables.get_name(table_number)
+        if names.get(table_name.lower(), table_number) != table_number:
+            raise ValueError('Tables with the same name {!r}'.format(table_name))
+    tables = {}
+    saved_pragmas = [(name, connection.execute('PRAGMA {}'.format(name)).fetchone()[0]) for name, value in pragmas]
+    for name, value in pragmas:
+        connection.execute('PRAGMA {} = {}'.format(name, value))
+    # explicit transactions
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    try:
+        connection.execute('BEGIN')
+        for table_number in names.values():
+            table = TpsSqliteTable(tps, connection, table_number, batch_size=batch_size)
+            table.create()
+            tables[table.name] = table
+        pending = 0
+        if len(tables) == 1:
+            table, = tables.values()
+            rows = ((table.name, row) for row in tps.iter_pages(None, table.table_number))
+        else:
+            rows = tps.iter_all_tables()
+        for table_name, row in rows:
+            table = tables.get(table_name)
+            if table is None:
+                continue
+            table.write(row)
+            pending += 1
+            if pending >= transaction_rows:
+                for table in tables.values():
+                    table.flush()
+                connection.execute('COMMIT')
+                connection.execute('BEGIN')
+                pending = 0
+        for table in tables.values():
+            table.flush()
+            if indexes:
+                table.create_indexes()
+        connection.execute('COMMIT')
+    except BaseException:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.isolation_level = isolation_level
+        for name, value in saved_pragmas:
+            connection.execute('PRAGMA {} = {}'.format(name, value))
+    return dict((table.name, table.count) for table in tables.values())
@@ -0,0 +1,75 @@
+"""
+Instrumentation of TPS file reading
+
+Counters are always kept (pages read, bytes read, decrypted and decompressed, records parsed, rows decoded).
+Time per stage is measured only if timing is enabled or a hook is added, hooks are called after every stage
+with the stage name, the counters increments and the elapsed time.
+"""
+
+from timeit import default_timer
+
+
+COUNTERS = ('pages_read', 'bytes_read', 'bytes_decrypted', 'bytes_decompressed', 'records_parsed',
+            'rows_decoded')
+
+# read - file read, decrypt - decryption, decompress - RLE uncompress, split - split page data to records,
+# parse - TpsRecord objects, decode - rows from DATA records
+STAGES = ('read', 'decrypt', 'decompress', 'split', 'parse', 'decode')
+
+
+class TpsStats:
+    """
+    Counters and timers of the reading stages (TPS.stats)
+    """
+
+    def __init__(self, timing=False):
+        self.timing = timing
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+        self.times = dict.fromkeys(STAGES, 0.0)
+
+    def add_hook(self, hook):
+        """
+        hook(stage, counters, elapsed) is called after every stage, counters - dict of increments
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def start(self):
+        """
+        Start time of a stage, None if time is not measured
+        """
+        if self.timing or self.hooks:
+            return default_timer()
+        return None
+
+    def add(self, stage, start, **counters):
+        for counter, value in counters.items():
+            setattr(self, counter, getattr(self, counter) + value)
+        if start is not None:
+            elapsed = default_timer() - start
+            self.times[stage] += elapsed
+            for hook in self.hooks:
+                hook(stage, counters, elapsed)
+
+    def as_dict(self):
+        result = dict((counter, getattr(self, counter)) for counter in COUNTERS)
+        result['times'] = dict(self.times)
+        return result
+
+    def __getstate__(self):
+        # hooks may be not picklable (worker processes get empty stats)
+        return {'timing': self.timing}
+
+    def __setstate__(self, state):
+        self.__init__(state['timing'])
+
+    def __repr__(self):
+        return 'TpsStats({})'.format(', '.join('{}={}'.format(counter, getattr(self, counter))
+                                               for counter in COUNTERS))
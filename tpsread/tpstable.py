@@ -2,9 +2,21 @@
 TPS File Table
 """
 
-from construct import Array, BitsInteger, BitStruct, Byte, Const, CString, Embedded, Enum, Flag, If, Padding, Struct, Int16ul, Probe, this, len_
+import keyword
+import logging
+import re
+from collections import namedtuple
 
-from .tpsrecord import TpsRecordsList
+from construct import Array, BitsInteger, BitStruct, Byte, Const, Container, CString, Enum, Flag, If, Padding, Struct, Int16ul, this, len_
+
+from .tpsdecoder import RECNO_FIELDNAME, field_shortname, find_field
+from .tpsrecord import METADATA_TYPE, TABLE_DEFINITION_TYPE, TABLE_NAME_TYPE
+
+
+logger = logging.getLogger(__name__)
+
+# Record types with table metadata
+TABLE_RECORD_TYPES = (TABLE_NAME_TYPE, TABLE_DEFINITION_TYPE, METADATA_TYPE)
 
 
 FIELD_TYPE_STRUCT = 'type' / Enum(Byte,
@@ -39,8 +51,8 @@ TABLE_DEFINITION_FIELD_STRUCT = 'record_table_definition_field' / Struct(
                                        'overlaps' / Int16ul,
                                        # record number
                                        'number' / Int16ul,
-                                       'array_element_size' / If(this.type == 'STRING' or this.type == 'CSTRING' or this.type == 'PSTRING' or this.type == 'PICTURE', Int16ul),
-                                       'template' / If(this.type == 'STRING' or this.type == 'CSTRING' or this.type == 'PSTRING' or this.type == 'PICTURE', Int16ul),
+                                       'array_element_size' / If(lambda ctx: ctx.type in ('STRING', 'CSTRING', 'PSTRING', 'PICTURE'), Int16ul),
+                                       'template' / If(lambda ctx: ctx.type in ('STRING', 'CSTRING', 'PSTRING', 'PICTURE'), Int16ul),
 #                                       'dummy' / If(this.type == 'CSTRING', Embedded('array_element_size' / Int16ul)),
 #                                       'dummy' / If(this.type == 'CSTRING', Embedded('template' / Int16ul)),
 #                                       'dummy' / If(this.type == 'PSTRING', Embedded('array_element_size' / Int16ul)),
@@ -83,7 +95,7 @@ TABLE_DEFINITION_INDEX_STRUCT = 'record_table_definition_index' / Struct(
                                                        'OPT' / Flag,
                                                        'DUP' / Flag),
                                        'field_count' / Int16ul,
-                                       Array(this.field_count,
+                                       'index_field_propertly' / Array(this.field_count,
                                              'index_field_propertly' / Struct(
                                                     'field_number' / Int16ul,
                                                     INDEX_FIELD_ORDER_TYPE_STRUCT)), )
@@ -96,7 +108,7 @@ TABLE_DEFINITION_MEMO_STRUCT = 'record_table_definition_memo' / Struct(
                                       # May be external_filename
                                       # if external_filename == 0, no external file index
                                       'external_filename' / CString('ascii'),
-                                      If(len_(this.external_filename) == 0, 'memo_mark' / Const(0, Byte)), # Original had a const '1' but it seems a '0' is required...
+                                      If(len_(this.external_filename) == 0, 'memo_mark' / Const(1, Byte)),
                                       'name' / CString('ascii'),
                                       'size' / Int16ul,
 #                                      Embedded('flags' / BitStruct(
@@ -124,6 +136,71 @@ TABLE_DEFINITION_STRUCT = 'record_table_definition' / Struct(
                                  'record_table_definition_index' / Array(this.index_count, TABLE_DEFINITION_INDEX_STRUCT), )
 
 
+def row_identifiers(names):
+    """
+    Python identifiers for row names ('TST:FIELD' -> 'field', record number -> 'record_number')
+    """
+    identifiers = []
+    for name in names:
+        if name == RECNO_FIELDNAME:
+            identifier = 'record_number'
+        else:
+            identifier = re.sub(r'\W', '_', field_shortname(name))
+        if not identifier.isidentifier() or keyword.iskeyword(identifier) or identifier.startswith('_'):
+            identifier = 'f_' + identifier
+        unique_identifier = identifier
+        i = 2
+        while unique_identifier in identifiers:
+            unique_identifier = '{}_{}'.format(identifier, i)
+            i += 1
+        identifiers.append(unique_identifier)
+    return identifiers
+
+
+class TpsSchema:
+    """
+    Columns of table rows: record number, fields, then MEMO and BLOB fields (of the columns if not None)
+    """
+
+    def __init__(self, definition, columns=None):
+        fields = list(definition.record_table_definition_field)
+        memos = list(enumerate(definition.record_table_definition_memo))
+        if columns is not None:
+            memo_definitions = [memo for number, memo in memos]
+            selected_fields = []
+            selected_memos = []
+            for column in columns:
+                try:
+                    memo = find_field(memo_definitions, column)
+                except KeyError:
+                    selected_fields.append(find_field(fields, column))
+                else:
+                    selected_memos.append(memos[memo_definitions.index(memo)])
+            fields = selected_fields
+            memos = selected_memos
+        self.fields = fields
+        # (memo number, memo definition)
+        self.memos = memos
+        self.names = tuple([RECNO_FIELDNAME] + [str(field.name) for field in fields] +
+                           [str(memo.name) for number, memo in memos])
+        self.types = tuple(['ULONG'] + [str(field.type) for field in fields] +
+                           [str(memo.flags.memo_type) for number, memo in memos])
+        self.identifiers = tuple(row_identifiers(self.names))
+        # namedtuple of rows
+        self.row_class = namedtuple('TpsRow', self.identifiers)
+
+    @property
+    def field_names(self):
+        return [str(field.name) for field in self.fields]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return 'TpsSchema({})'.format(', '.join('{} {}'.format(name, field_type)
+                                                for name, field_type in zip(self.names, self.types)))
+
+
 class TpsTable:
     def __init__(self, number):
         self.number = number
@@ -131,11 +208,12 @@ class TpsTable:
         self.definition_bytes = {}
         self.definition = ''
         self.statistics = {}
+        self.__schema = None
 
     @property
     def iscomplete(self):
         # TODO check all parts complete
-        if self.name != '':
+        if self.name != '' and self.definition_bytes:
             self.get_definition()
             return True
         else:
@@ -145,6 +223,8 @@ class TpsTable:
         portion_number = ('portion_number' / Int16ul).parse(definition[:2])
         #print("portion_number = ", portion_number, definition)
         self.definition_bytes[portion_number] = definition[2:]
+        self.definition = ''
+        self.__schema = None
         #print(self, self.definition_bytes)
 
     def add_statistics(self, statistics_struct):
@@ -152,55 +232,70 @@ class TpsTable:
         self.statistics[statistics_struct.metadata_type] = statistics_struct
 
     def get_definition(self):
-        definition_bytes = b''
-        for value in self.definition_bytes.values():
-            definition_bytes += value
-        #print(self, "definition_bytes:", definition_bytes)
-        self.definition = TABLE_DEFINITION_STRUCT.parse(definition_bytes)
+        # parsed once, until a new definition portion is added
+        if self.definition == '':
+            definition_bytes = b''
+            for portion_number in sorted(self.definition_bytes):
+                definition_bytes += self.definition_bytes[portion_number]
+            #print(self, "definition_bytes:", definition_bytes)
+            self.definition = TABLE_DEFINITION_STRUCT.parse(definition_bytes)
         return self.definition
 
+    def get_schema(self):
+        # built once, until a new definition portion is added
+        if self.__schema is None:
+            self.__schema = TpsSchema(self.get_definition())
+        return self.__schema
+
     def set_name(self, name):
         self.name = name
 
 
 class TpsTablesList:
-    def __init__(self, tps, encoding=None, check=False):
+    def __init__(self, tps, encoding=None, check=False, state=None):
         self.__tps = tps
         self.encoding = encoding
         self.check = check
         self.__tables = {}
 
+        if state is not None:
+            # tables saved by state() (sidecar index)
+            for table_state in state:
+                table = TpsTable(table_state['number'])
+                table.set_name(table_state['name'])
+                for portion_number, definition in table_state['definition']:
+                    table.definition_bytes[portion_number] = bytes.fromhex(definition)
+                for metadata_type, record_count, record_last_access in table_state['statistics']:
+                    table.add_statistics(Container(metadata_type=metadata_type,
+                                                   metadata_record_count=record_count,
+                                                   metadata_record_last_access=record_last_access))
+                self.__tables[table.number] = table
+            return
+
         # get tables definition
-        i = 0
-        d = None
-        s = None
-        for page_ref in reversed(self.__tps.pages.list()):
-            if self.__tps.pages[page_ref].hierarchy_level == 0:
-                for record in TpsRecordsList(self.__tps, self.__tps.pages[page_ref],
-                                             encoding=self.encoding, check=self.check):
-                    i += 1
-                    if record.type != 'NULL' and record.data.table_number not in self.__tables.keys():
-                        self.__tables[record.data.table_number] = TpsTable(record.data.table_number)
-                    if record.type == 'TABLE_NAME':
-                        print('Table name set...')
-                        print('  to:', record.data.table_name)
-                        self.__tables[record.data.table_number].set_name(record.data.table_name)
-                    if record.type == 'TABLE_DEFINITION':
-                        print('Table definition read...')
-                        self.__tables[record.data.table_number].add_definition(record.data.table_definition_bytes)
-                        #d = i
-                    if record.type == 'METADATA':
-                        #print('Table metadata read...')
-                        #print(record.data)
-                        self.__tables[record.data.table_number].add_statistics(record.data)
-                        #s = i
-                    #TODO optimize (table_definition and metadata(statistics))
-                    if self.__iscomplete():
-                        break
+        # only pages with table names, definitions and metadata, from the end of file
+        for records in self.__tps.page_records(record_types=TABLE_RECORD_TYPES, reverse=True):
+            for record in records:
+                if record.type not in ('TABLE_NAME', 'TABLE_DEFINITION', 'METADATA'):
+                    continue
+                if record.data.table_number not in self.__tables.keys():
+                    self.__tables[record.data.table_number] = TpsTable(record.data.table_number)
+                if record.type == 'TABLE_NAME':
+                    logger.debug('Table name set to: %s', record.data.table_name)
+                    self.__tables[record.data.table_number].set_name(record.data.table_name)
+                if record.type == 'TABLE_DEFINITION':
+                    logger.debug('Table definition read...')
+                    self.__tables[record.data.table_number].add_definition(record.data.table_definition_bytes)
+                if record.type == 'METADATA':
+                    #print('Table metadata read...')
+                    #print(record.data)
+                    self.__tables[record.data.table_number].add_statistics(record.data)
+                #TODO optimize (table_definition and metadata(statistics))
                 if self.__iscomplete():
                     break
-                    #print('stats:', i, d, s, len(self.__tps.pages.list()))
-                    #TODO raise exception: No definition found
+            if self.__iscomplete():
+                break
+                #TODO raise exception: No definition found
 
     def __iscomplete(self):
         for i in self.__tables:
@@ -211,11 +306,29 @@ class TpsTablesList:
         else:
             return True
 
+    def state(self):
+        return [{'number': table.number,
+                 'name': table.name,
+                 'definition': [[portion_number, definition.hex()]
+                                for portion_number, definition in sorted(table.definition_bytes.items())],
+                 'statistics': [[statistics.metadata_type, statistics.metadata_record_count,
+                                 statistics.metadata_record_last_access]
+                                for statistics in table.statistics.values()]}
+                for table in self.__tables.values()]
+
     def get_definition(self, number):
         return self.__tables[number].get_definition()
 
+    def get_schema(self, number):
+        return self.__tables[number].get_schema()
+
+    def numbers(self):
+        return list(self.__tables)
+
+    def get_name(self, number):
+        return self.__tables[number].name
+
     def get_number(self, name):
         for i in self.__tables:
-            print("table ", i, "name=", self.__tables[i].name)
             if self.__tables[i].name == name:
                 return i
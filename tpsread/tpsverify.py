@@ -0,0 +1,140 @@
+"""
+Integrity check of TPS file
+
+Page overlaps are found with a sweep over pages sorted by offset, block membership with bisect over
+sorted blocks, so the whole check is O(n log n) in the number of pages.
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+
+from .tpspage import PAGE_HEADER_STRUCT
+from .tpsrecord import TpsRecordsList
+
+
+# File size is not a multiple of 64 bytes
+FILE_SIZE = 'FILE_SIZE'
+# Page offset in page header differs from page ref
+PAGE_OFFSET = 'PAGE_OFFSET'
+# Page ends beyond end of file
+PAGE_SIZE = 'PAGE_SIZE'
+# Page intersects another page
+PAGE_OVERLAP = 'PAGE_OVERLAP'
+# No block contains the page
+PAGE_OUTSIDE_BLOCK = 'PAGE_OUTSIDE_BLOCK'
+# Uncompressed page data size differs from page header
+UNCOMPRESSED_SIZE = 'UNCOMPRESSED_SIZE'
+# Size of DATA records differs from table record size (value - count of such records in the page)
+RECORD_SIZE = 'RECORD_SIZE'
+
+
+class TpsFinding(namedtuple('TpsFinding', ['kind', 'page_ref', 'value', 'expected'])):
+    """
+    Integrity check finding: kind (FILE_SIZE, PAGE_OFFSET...), page ref (None for the file),
+    found and expected values
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        if self.kind == FILE_SIZE:
+            return 'File size is not a multiple of 64 bytes.'
+        elif self.kind == PAGE_OVERLAP:
+            return 'Page ref# {0.page_ref} intersects with the page ref# {0.value}'.format(self)
+        elif self.kind == PAGE_OUTSIDE_BLOCK:
+            return 'Not exist block, that contains page ref# {0.page_ref}'.format(self)
+        elif self.kind == RECORD_SIZE:
+            return 'Page ref# {0.page_ref} has {0.value} DATA records of size other than {0.expected}'.format(self)
+        elif self.page_ref is None:
+            return '{0.kind}: {0.value} (expected {0.expected})'.format(self)
+        else:
+            return 'Page ref# {0.page_ref} {0.kind}: {0.value} (expected {0.expected})'.format(self)
+
+
+class TpsBlocks:
+    """
+    Blocks of the file header (block_start_ref, block_end_ref) for fast lookup
+    """
+
+    def __init__(self, start_refs, end_refs):
+        blocks = sorted(zip(start_refs, end_refs))
+        self.start_refs = [start_ref for start_ref, end_ref in blocks]
+        # max end ref of blocks starting before
+        self.max_end_refs = []
+        max_end_ref = None
+        for start_ref, end_ref in blocks:
+            max_end_ref = end_ref if max_end_ref is None else max(max_end_ref, end_ref)
+            self.max_end_refs.append(max_end_ref)
+
+    def contains(self, start_ref, end_ref):
+        i = bisect_right(self.start_refs, start_ref) - 1
+        return i >= 0 and end_ref <= self.max_end_refs[i]
+
+
+def find_overlaps(pages, header_size):
+    """
+    (page ref, intersected page ref) for pages (TpsPage) intersecting a page with a lower offset
+    """
+    intervals = sorted((page.ref * 0x100 + header_size, page.size, page.ref) for page in pages)
+    overlaps = []
+    max_end_offset = None
+    max_end_ref = None
+    for start_offset, size, ref in intervals:
+        if max_end_offset is not None and start_offset < max_end_offset:
+            overlaps.append((ref, max_end_ref))
+        if max_end_offset is None or start_offset + size > max_end_offset:
+            max_end_offset = start_offset + size
+            max_end_ref = ref
+    return overlaps
+
+
+def verify(tps, records=True):
+    """
+    Check file and page structure, and, if records is True, the uncompressed size of leaf pages and
+    the size of DATA records. Return list of TpsFinding.
+    """
+    findings = []
+    header_size = tps.header.size
+
+    if tps.file_size & 0x3F != 0:
+        findings.append(TpsFinding(FILE_SIZE, None, tps.file_size, tps.file_size & ~0x3F))
+
+    pages = [tps.pages[page_ref] for page_ref in tps.pages.list()]
+    blocks = TpsBlocks(tps.header.block_start_ref, tps.header.block_end_ref)
+    for page in pages:
+        if page.offset != page.ref * 0x100 + header_size:
+            findings.append(TpsFinding(PAGE_OFFSET, page.ref, page.offset, page.ref * 0x100 + header_size))
+        if page.ref * 0x100 + header_size + page.size > tps.file_size:
+            findings.append(TpsFinding(PAGE_SIZE, page.ref, page.ref * 0x100 + header_size + page.size,
+                                       tps.file_size))
+        page_end_ref = (page.offset + page.size - header_size) / 0x100
+        if not blocks.contains(page.ref, page_end_ref):
+            findings.append(TpsFinding(PAGE_OUTSIDE_BLOCK, page.ref, page_end_ref, None))
+
+    for page_ref, other_page_ref in find_overlaps(pages, header_size):
+        findings.append(TpsFinding(PAGE_OVERLAP, page_ref, other_page_ref, None))
+
+    if records:
+        record_sizes = {}
+        for page in pages:
+            if page.hierarchy_level != 0 or page.ref * 0x100 + header_size + page.size > tps.file_size:
+                continue
+            page_records = TpsRecordsList(tps, page, encoding=tps.encoding)
+            if page.uncompressed_size > page.size and page_records.data_size is not None and \
+                    page_records.data_size + PAGE_HEADER_STRUCT.sizeof() != page.uncompressed_size:
+                findings.append(TpsFinding(UNCOMPRESSED_SIZE, page.ref,
+                                           page_records.data_size + PAGE_HEADER_STRUCT.sizeof(),
+                                           page.uncompressed_size))
+            mismatches = {}
+            for table_number, size in page_records.data_sizes():
+                if table_number not in record_sizes:
+                    try:
+                        record_sizes[table_number] = tps.tables.get_definition(table_number).record_size
+                    except KeyError:
+                        # DATA of a table without definition
+                        record_sizes[table_number] = None
+                if record_sizes[table_number] is not None and size != record_sizes[table_number]:
+                    mismatches[table_number] = mismatches.get(table_number, 0) + 1
+            for table_number, count in mismatches.items():
+                findings.append(TpsFinding(RECORD_SIZE, page.ref, count, record_sizes[table_number]))
+
+    return findings